@@ -1,115 +1,205 @@
 """
 Agent nodes for the LangGraph workflow
 """
+import asyncio
+import contextvars
 import json
-from langchain_core.messages import HumanMessage, SystemMessage
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from models.state import AgentState
-from utils.llm_factory import initialize_llm
+from utils.llm_call import acall_llm, call_llm
 from utils.image_utils import get_next_user_image_placeholder
+from utils.image_pipeline import add_srcset, build_variants, slot_targets
+from utils.html_utils import derive_class_contract, reconcile_classes
+from utils.quality import check_quality
+from utils.patching import PatchError, apply_patches, parse_patch_response
+from utils.design_spec import ELEMENTS_SCHEMA, EMPTY_SPEC, build_design_spec, shrink_spec, spec_json
+from utils.json_repair import JSONRepairError, loads_tolerant
+from utils.schema import invalid_fields, validate
+from utils.prompt_budget import compact_markup, fit_prompt, trim_text
+from utils.blob_store import blob_store
+from utils.events import emit
+from utils.instrumentation import metrics
 from prompts.templates import *
-
-def analyze_design_node(state: AgentState) -> AgentState:
-    """Analyze the design template and extract key elements including images"""
-    progress_msg = "Analyzing design template...\n"
-    state["progress_log"] = state.get("progress_log", "") + progress_msg
-
-    image_data = state.get("image_base64", "")
-    api_provider = state.get("api_provider", "openrouter")
-
-    llm = initialize_llm(api_provider)
-
-    response = llm.invoke([
+import config
+
+# Used for fields the extraction model didn't return validly
+DEFAULT_ELEMENTS = {
+    "colors": {
+        "primary": "#FF6B35",
+        "secondary": "#F7F7F7",
+        "accent": "#004E89",
+        "background": "#FFFFFF",
+        "text": "#000000"
+    },
+    "typography": {
+        "heading": {"family": "Arial, sans-serif", "weight": "bold"},
+        "body": {"family": "Arial, sans-serif", "weight": "normal"}
+    },
+    "layout": {"type": "flex", "columns": 2},
+}
+
+def _log(state: AgentState, message: str):
+    """Emit a progress line for the node's job"""
+    emit(state.get("job_id"), message)
+
+def _call_llm(state: AgentState, messages: List, channel: str, hedge: bool = False, json_mode: bool = False):
+    """Invoke the job's provider through the resilient call layer, streaming to the job's stream"""
+    return call_llm(messages, state.get("api_provider", "openrouter"), job_id=state.get("job_id"),
+                    channel=channel, hedge=hedge, json_mode=json_mode)
+
+async def _acall_llm(state: AgentState, messages: List, channel: str, hedge: bool = False,
+                     json_mode: bool = False):
+    """Async variant of _call_llm"""
+    return await acall_llm(messages, state.get("api_provider", "openrouter"), job_id=state.get("job_id"),
+                           channel=channel, hedge=hedge, json_mode=json_mode)
+
+def _compact_json(value) -> str:
+    """JSON without indentation or spaces, for prompts"""
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+def _analysis_messages(state: AgentState) -> List:
+    """Build the vision prompt with the template image"""
+    image_data = blob_store.get(state["image_ref"])
+    image_mime_type = state.get("image_mime_type", "image/png")
+
+    return [
         HumanMessage(content=[
             {"type": "text", "text": DESIGN_ANALYSIS_PROMPT + "\n\nAnalyze this design template in detail:"},
-            {"type": "image_url", "image_url": f"data:image/png;base64,{image_data}"}
+            {"type": "image_url", "image_url": f"data:{image_mime_type};base64,{image_data}"}
         ])
-    ])
+    ]
 
-    state["design_analysis"] = response.content
-    state["messages"].append("Design analysis complete")
-    state["progress_log"] += "Design analysis complete\n"
+def _apply_analysis(state: AgentState, response) -> dict:
+    """Return the design analysis update"""
+    _log(state, "Design analysis complete")
+    return {"design_analysis": response.content}
 
-    return state
+def analyze_design_node(state: AgentState) -> dict:
+    """Analyze the design template and extract key elements including images"""
+    _log(state, "Analyzing design template...")
+
+    response = _call_llm(state, _analysis_messages(state), "analysis", hedge=True)
+    return _apply_analysis(state, response)
 
-def extract_design_elements_node(state: AgentState) -> AgentState:
-    """Extract specific design elements including images"""
-    progress_msg = "Extracting design elements and preparing image slots...\n"
-    state["progress_log"] += progress_msg
+async def aanalyze_design_node(state: AgentState) -> dict:
+    """Async variant of analyze_design_node"""
+    _log(state, "Analyzing design template...")
 
-    api_provider = state.get("api_provider", "openrouter")
-    llm = initialize_llm(api_provider)
+    response = await _acall_llm(state, _analysis_messages(state), "analysis", hedge=True)
+    return _apply_analysis(state, response)
 
-    extraction_prompt = ELEMENTS_EXTRACTION_PROMPT.format(
-        design_analysis=state['design_analysis']
+def _extraction_messages(state: AgentState) -> List:
+    """Build the design elements extraction prompt"""
+    extraction_prompt = fit_prompt(
+        "extraction",
+        lambda s: ELEMENTS_EXTRACTION_PROMPT.format(design_analysis=s["analysis"]),
+        {"analysis": (state['design_analysis'], trim_text)},
+        job_id=state.get("job_id"),
     )
 
-    messages = [
+    return [
         SystemMessage(content=extraction_prompt),
         HumanMessage(content="Extract the design elements now.")
     ]
 
-    response = llm.invoke(messages)
-
+def _check_extraction(state: AgentState, response, attempt: int):
+    """Parse and validate the extracted elements JSON; returns (elements or None, schema problems)"""
     try:
-        content = response.content.strip()
-        if content.startswith("```"):
-            content = content.split("```")[1]
-            if content.startswith("json"):
-                content = content[4:]
-        content = content.strip()
-
-        elements = json.loads(content)
-        state["color_palette"] = elements.get("colors", {})
-        state["typography"] = elements.get("typography", {})
-        state["layout_structure"] = elements.get("layout", {})
-
-        # Process detected images and assign placeholder tokens (NOT base64!)
-        images_detected = elements.get("images", [])
-        user_images_count = state.get("user_images_count", 0)
-
-        for idx, img in enumerate(images_detected):
-            # Use lightweight placeholder token instead of heavy base64
-            img["url"] = get_next_user_image_placeholder(idx, idx, user_images_count)
-
-        state["images_detected"] = images_detected
-
-    except (json.JSONDecodeError, Exception) as e:
-        # Fallback default values
-        state.update({
-            "color_palette": {
-                "primary": "#FF6B35",
-                "secondary": "#F7F7F7",
-                "accent": "#004E89",
-                "background": "#FFFFFF",
-                "text": "#000000"
-            },
-            "typography": {
-                "heading": {"family": "Arial, sans-serif", "weight": "bold"},
-                "body": {"family": "Arial, sans-serif", "weight": "normal"}
-            },
-            "layout_structure": {"type": "flex", "columns": 2},
-            "images_detected": []
-        })
-
-    state["messages"].append("Design elements extracted")
-    state["progress_log"] += f"Design elements extracted ({len(state['images_detected'])} image slots prepared)\n"
-
-    return state
-
-def generate_html_node(state: AgentState) -> AgentState:
-    """Generate semantic HTML structure with image placeholder tokens"""
-    progress_msg = "Generating HTML structure with image placeholders...\n"
-    state["progress_log"] += progress_msg
-
-    api_provider = state.get("api_provider", "openrouter")
-    llm = initialize_llm(api_provider)
+        elements, repaired = loads_tolerant(response.content)
+        problems = validate(elements, ELEMENTS_SCHEMA)
+    except JSONRepairError as e:
+        elements, repaired, problems = None, False, [str(e)]
+
+    outcome = "invalid" if problems else "repaired" if repaired else "valid"
+    metrics.inc("extraction_attempts_total", help="Design element extraction attempts by outcome", outcome=outcome)
+    if problems:
+        retry = "re-asking" if attempt < config.EXTRACTION_MAX_ATTEMPTS else "using defaults for invalid fields"
+        _log(state, f"Extraction attempt {attempt} returned invalid JSON ({problems[0]}); {retry}")
+    return elements, problems
+
+def _extraction_retry_messages(messages: List, response, problems: List[str]) -> List:
+    """The extraction conversation extended with the invalid answer and what was wrong with it"""
+    listed = "\n".join(f"- {problem}" for problem in problems[:8])
+    return messages + [
+        AIMessage(content=response.content),
+        HumanMessage(content=EXTRACTION_RETRY_PROMPT.format(problems=listed)),
+    ]
 
-    images_info = json.dumps(state["images_detected"], indent=2) if state["images_detected"] else "No images detected"
+def _apply_extraction(state: AgentState, elements, problems: List[str] = ()) -> dict:
+    """Build the design spec and prepare image slots, defaulting fields that failed validation"""
+    elements = dict(elements) if isinstance(elements, dict) else {}
+    invalid = invalid_fields(problems)
+    defaulted = sorted(field for field in DEFAULT_ELEMENTS if field in invalid or field not in elements)
+    for field in defaulted:
+        elements[field] = DEFAULT_ELEMENTS[field]
+    if defaulted:
+        metrics.inc("extraction_fallbacks_total", help="Extractions that fell back to default design elements")
+        _log(state, f"Default design elements used for: {', '.join(defaulted)}")
+
+    update = {"extraction_used_defaults": bool(defaulted)}
+    update["design_spec"], spec_errors = build_design_spec(elements)
+    if spec_errors:
+        _log(state, f"Design spec had {len(spec_errors)} schema violations, defaults used: {spec_errors[0]}")
+    update["color_palette"] = elements["colors"]
+    update["typography"] = elements["typography"]
+    update["layout_structure"] = elements["layout"]
+
+    # Process detected images and assign placeholder tokens (NOT base64!)
+    images = elements.get("images")
+    images_detected = [dict(img) for img in images if isinstance(img, dict)] if isinstance(images, list) else []
+    user_images_count = state.get("user_images_count", 0)
+
+    for idx, img in enumerate(images_detected):
+        # Use lightweight placeholder token instead of heavy base64
+        img["url"] = get_next_user_image_placeholder(idx, idx, user_images_count)
+
+    update["images_detected"] = images_detected
+
+    _log(state, f"Design elements extracted ({len(update['images_detected'])} image slots prepared)")
+    return update
+
+def extract_design_elements_node(state: AgentState) -> dict:
+    """Extract specific design elements including images, re-asking only this call when the JSON is invalid"""
+    _log(state, "Extracting design elements and preparing image slots...")
+
+    messages = _extraction_messages(state)
+    for attempt in range(1, config.EXTRACTION_MAX_ATTEMPTS + 1):
+        response = _call_llm(state, messages, "extraction", json_mode=config.EXTRACTION_JSON_MODE)
+        elements, problems = _check_extraction(state, response, attempt)
+        if not problems:
+            break
+        messages = _extraction_retry_messages(messages, response, problems)
+    return _apply_extraction(state, elements, problems)
+
+async def aextract_design_elements_node(state: AgentState) -> dict:
+    """Async variant of extract_design_elements_node"""
+    _log(state, "Extracting design elements and preparing image slots...")
+
+    messages = _extraction_messages(state)
+    for attempt in range(1, config.EXTRACTION_MAX_ATTEMPTS + 1):
+        response = await _acall_llm(state, messages, "extraction", json_mode=config.EXTRACTION_JSON_MODE)
+        elements, problems = _check_extraction(state, response, attempt)
+        if not problems:
+            break
+        messages = _extraction_retry_messages(messages, response, problems)
+    return _apply_extraction(state, elements, problems)
+
+def _html_messages(state: AgentState, class_contract: List[str] = None) -> List:
+    """Build the HTML generation prompt"""
+    images_info = _compact_json(state["images_detected"]) if state["images_detected"] else "No images detected"
+
+    if class_contract:
+        class_names_rule = f"""- Use these BEM class names (the CSS is written against them in parallel): {", ".join(class_contract)}
+  Only add other class names when none of these fit"""
+    else:
+        class_names_rule = "- Use meaningful class names following BEM methodology"
 
-    html_prompt = f"""You are an expert frontend developer. Generate clean, semantic HTML5 code for this design:
+    def html_prompt(s):
+        return f"""You are an expert frontend developer. Generate clean, semantic HTML5 code for this design:
 
-Design Analysis: {state['design_analysis']}
-Layout Structure: {json.dumps(state['layout_structure'], indent=2)}
+Design Spec (JSON; sections list the visible text): {s['spec']}
 
 IMAGES TO INCLUDE (use placeholder tokens):
 {images_info}
@@ -118,7 +208,7 @@ Requirements:
 - Use semantic HTML5 tags (header, section, article, etc.)
 - Include proper accessibility attributes (alt, aria-labels)
 - Create a responsive structure
-- Use meaningful class names following BEM methodology
+{class_names_rule}
 - Include all text content visible in the original design
 - **IMPORTANT**: For each image, use the placeholder token from the "url" field in the src attribute
   Example: <img src="{{{{USER_IMAGE_0}}}}" alt="Description">
@@ -128,43 +218,44 @@ Requirements:
 
 Generate ONLY the HTML code structure, no explanations. Start with <!DOCTYPE html> and include a <head> section with meta tags."""
 
-    messages = [
-        SystemMessage(content=html_prompt),
+    return [
+        SystemMessage(content=fit_prompt(
+            "html", html_prompt, {"spec": (spec_json(state.get("design_spec")), shrink_spec)}, job_id=state.get("job_id")
+        )),
         HumanMessage(content="Generate the HTML structure now with image placeholder tokens.")
     ]
 
-    response = llm.invoke(messages)
-    html_content = response.content.strip()
+def _parse_html(content: str) -> str:
+    """Strip markdown fences from generated HTML"""
+    html_content = content.strip()
 
     if "```html" in html_content:
         html_content = html_content.split("```html")[1].split("```")[0].strip()
     elif "```" in html_content:
         html_content = html_content.split("```")[1].split("```")[0].strip()
 
-    state["html_code"] = html_content
-    state["messages"].append("HTML generated with image placeholders")
-    state["progress_log"] += "HTML generated with image placeholders\n"
-
-    return state
-
+    return html_content
 
-def generate_css_node(state: AgentState) -> AgentState:
-    """Generate CSS styling"""
-    progress_msg = "Generating CSS styles...\n"
-    state["progress_log"] += progress_msg
-
-    api_provider = state.get("api_provider", "openrouter")
-    llm = initialize_llm(api_provider)
+def _css_messages(state: AgentState, class_contract: List[str] = None) -> List:
+    """Build the CSS generation prompt, against the HTML preview or the class contract"""
+    if class_contract:
+        structure = f"""Class Name Contract (the HTML is generated in parallel using exactly these BEM classes):
+{", ".join(class_contract)}"""
+    else:
+        structure = f"""HTML Structure Preview:
+{state['html_code'][:800]}..."""
 
-    css_prompt = f"""You are an expert CSS developer. Generate modern, responsive CSS for this HTML structure:
+    spec = state.get("design_spec") or EMPTY_SPEC
+    def css_prompt(s):
+        return f"""You are an expert CSS developer. Generate modern, responsive CSS for this HTML structure:
 
-HTML Structure Preview:
-{state['html_code'][:800]}...
+{s['structure']}
 
 Design Specifications:
-- Colors: {json.dumps(state['color_palette'], indent=2)}
-- Typography: {json.dumps(state['typography'], indent=2)}
-- Layout: {json.dumps(state['layout_structure'], indent=2)}
+- Colors: {_compact_json(spec['colors'])}
+- Typography: {_compact_json(spec['typography'])}
+- Layout: {_compact_json(spec['layout'])}
+- Spacing: {_compact_json(spec.get('spacing', {}))}
 
 Requirements:
 - Use modern CSS (Flexbox/Grid)
@@ -182,35 +273,118 @@ Requirements:
 
 Generate ONLY the CSS code (without <style> tags), no explanations."""
 
-    messages = [
-        SystemMessage(content=css_prompt),
+    return [
+        SystemMessage(content=fit_prompt(
+            "css", css_prompt, {"structure": (structure, trim_text if not class_contract else None)},
+            job_id=state.get("job_id"),
+        )),
         HumanMessage(content="Generate the CSS styles now.")
     ]
 
-    response = llm.invoke(messages)
-    css_content = response.content.strip()
+def _parse_css(content: str) -> str:
+    """Strip markdown fences and style tags from generated CSS"""
+    css_content = content.strip()
 
     if "```css" in css_content:
         css_content = css_content.split("```css")[1].split("```")[0].strip()
     elif "```" in css_content:
         css_content = css_content.split("```")[1].split("```")[0].strip()
 
-    css_content = css_content.replace("<style>", "").replace("</style>", "").strip()
+    return css_content.replace("<style>", "").replace("</style>", "").strip()
+
+def _apply_html(state: AgentState, response) -> dict:
+    """Return the generated HTML update"""
+    _log(state, "HTML generated with image placeholders")
+    return {"html_code": _parse_html(response.content)}
+
+def generate_html_node(state: AgentState) -> dict:
+    """Generate semantic HTML structure with image placeholder tokens"""
+    _log(state, "Generating HTML structure with image placeholders...")
+
+    response = _call_llm(state, _html_messages(state), "html")
+    return _apply_html(state, response)
+
+async def agenerate_html_node(state: AgentState) -> dict:
+    """Async variant of generate_html_node"""
+    _log(state, "Generating HTML structure with image placeholders...")
 
-    state["css_code"] = css_content
-    state["messages"].append("CSS generated")
-    state["progress_log"] += "CSS generated\n"
+    response = await _acall_llm(state, _html_messages(state), "html")
+    return _apply_html(state, response)
 
-    return state
+def _apply_css(state: AgentState, response) -> dict:
+    """Return the generated CSS update"""
+    _log(state, "CSS generated")
+    return {"css_code": _parse_css(response.content)}
 
+def generate_css_node(state: AgentState) -> dict:
+    """Generate CSS styling"""
+    _log(state, "Generating CSS styles...")
+
+    response = _call_llm(state, _css_messages(state), "css")
+    return _apply_css(state, response)
+
+async def agenerate_css_node(state: AgentState) -> dict:
+    """Async variant of generate_css_node"""
+    _log(state, "Generating CSS styles...")
+
+    response = await _acall_llm(state, _css_messages(state), "css")
+    return _apply_css(state, response)
+
+def _apply_code(state: AgentState, class_contract: List[str], html_response, css_response) -> dict:
+    """Return the HTML and CSS generated in parallel"""
+    _log(state, "HTML and CSS generated in parallel")
+    return {
+        "html_code": _parse_html(html_response.content),
+        "css_code": _parse_css(css_response.content),
+        "class_contract": class_contract,
+    }
+
+def generate_code_node(state: AgentState) -> dict:
+    """Generate HTML and CSS concurrently against a class contract derived from the layout"""
+    class_contract = derive_class_contract(state["layout_structure"], state["images_detected"])
+    _log(state, f"Generating HTML and CSS in parallel ({len(class_contract)} contract classes)...")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        html_future = executor.submit(
+            contextvars.copy_context().run, _call_llm, state, _html_messages(state, class_contract), "html"
+        )
+        css_future = executor.submit(
+            contextvars.copy_context().run, _call_llm, state, _css_messages(state, class_contract), "css"
+        )
+        html_response = html_future.result()
+        css_response = css_future.result()
+
+    return _apply_code(state, class_contract, html_response, css_response)
+
+async def agenerate_code_node(state: AgentState) -> dict:
+    """Async variant of generate_code_node"""
+    class_contract = derive_class_contract(state["layout_structure"], state["images_detected"])
+    _log(state, f"Generating HTML and CSS in parallel ({len(class_contract)} contract classes)...")
+
+    html_response, css_response = await asyncio.gather(
+        _acall_llm(state, _html_messages(state, class_contract), "html"),
+        _acall_llm(state, _css_messages(state, class_contract), "css"),
+    )
+
+    return _apply_code(state, class_contract, html_response, css_response)
 
-def combine_code_node(state: AgentState) -> AgentState:
+def combine_code_node(state: AgentState) -> dict:
     """Combine HTML and CSS into a complete self-contained file"""
-    progress_msg = "🔧 Combining HTML and CSS...\n"
-    state["progress_log"] += progress_msg
+    _log(state, "🔧 Combining HTML and CSS...")
 
     html = state["html_code"]
     css = state["css_code"]
+    update = {}
+
+    # Reconcile HTML and CSS generated in parallel against the class contract
+    if state.get("class_contract"):
+        css, unused, off_contract = reconcile_classes(html, css, state["class_contract"])
+        _log(state, f"Reconciled class contract ({len(unused)} unused CSS classes pruned, "
+                    f"{len(off_contract)} HTML classes outside the contract without rules)")
+        if off_contract:
+            update["refinement_notes"] = [
+                f"HTML classes outside the class contract have no CSS rules: {', '.join(off_contract)}"
+            ]
 
     if "</head>" in html:
         style_tag = f"\n<style>\n{css}\n</style>\n"
@@ -231,31 +405,50 @@ def combine_code_node(state: AgentState) -> AgentState:
 </body>
 </html>"""
 
-    state["html_code"] = html
-    state["messages"].append("Code combined")
-    state["progress_log"] += "Code combined (fully self-contained)\n"
-
-    return state
-
-
-def refine_code_node(state: AgentState) -> AgentState:
-    """Refine and optimize the generated code"""
-    progress_msg = "✨ Refining code...\n"
-    state["progress_log"] += progress_msg
-
-    api_provider = state.get("api_provider", "openrouter")
-    llm = initialize_llm(api_provider)
-
-    refinement_prompt = f"""Review and refine this HTML/CSS code to ensure it perfectly matches the original Canva template:
+    _log(state, "Code combined (fully self-contained)")
+    update["html_code"] = html
+    return update
+
+def quality_check_node(state: AgentState) -> dict:
+    """Score the current document locally; its issues drive the next refinement pass"""
+    report = check_quality(state["html_code"], state.get("images_detected"), state.get("color_palette"))
+    checks = ", ".join(f"{name} {value:.2f}" for name, value in report.checks.items())
+    _log(state, f"Quality score {report.score:.2f} ({checks or 'no checks apply'})")
+    scores = state.get("quality_scores", [])
+    # The first check keeps the notes of the class-contract reconciliation for the first pass
+    carried = [note for note in state.get("refinement_notes", []) if note not in report.issues] if not scores else []
+    update = {
+        "quality_scores": scores + [report.score],
+        "refinement_notes": carried + report.issues,
+    }
+    if not scores or report.score > max(scores):
+        # Keep the best document out of the state; a later pass that lowers the score is undone
+        update["best_html_ref"] = blob_store.put(state["html_code"], owner=state.get("job_id"))
+    elif report.score < max(scores) and state.get("best_html_ref"):
+        _log(state, f"Refinement lowered the quality score to {report.score:.2f}, keeping the best document ({max(scores):.2f})")
+        update["html_code"] = blob_store.get(state["best_html_ref"])
+    return update
+
+
+def _refinement_messages(state: AgentState) -> List:
+    """Build the refinement prompt"""
+    notes = state.get("refinement_notes", [])
+    known_issues = "\n".join(f"- {note}" for note in notes) if notes else "None reported"
+
+    def refinement_prompt(s):
+        return f"""Review and refine this HTML/CSS code to ensure it perfectly matches the original Canva template:
 
 Current Code:
-{state['html_code']}
+{s['document']}
 
-Original Design Analysis:
-{state['design_analysis']}
+Design Spec:
+{s['spec']}
 
 Images: {len(state.get('images_detected', []))} image placeholders (will be replaced with base64 later)
 
+Known Issues:
+{s['notes']}
+
 Tasks:
 1. Verify all visual elements are present including image placeholders
 2. Check color accuracy against the original design
@@ -270,12 +463,64 @@ Tasks:
 
 Provide the refined COMPLETE HTML file (with embedded CSS) that's production-ready. Make sure it closely matches the original Canva template design."""
 
-    messages = [
-        SystemMessage(content=refinement_prompt),
+    # The document is compacted but never cut: the model returns it in full
+    sections = {
+        "document": (compact_markup(state['html_code']), None),
+        "spec": (spec_json(state.get("design_spec")), shrink_spec),
+        "notes": (known_issues, trim_text),
+    }
+    return [
+        SystemMessage(content=fit_prompt("refine", refinement_prompt, sections, job_id=state.get("job_id"))),
         HumanMessage(content="Refine the code now.")
     ]
 
-    response = llm.invoke(messages)
+def _patch_messages(state: AgentState) -> List:
+    """Build the refinement prompt asking for targeted edits instead of a full document"""
+    notes = state.get("refinement_notes", [])
+    known_issues = "\n".join(f"- {note}" for note in notes) if notes else "None reported"
+
+    def patch_prompt(s):
+        return f"""Review this HTML/CSS code against the design spec and return targeted edits as JSON that fix its issues:
+
+Current Code:
+{s['document']}
+
+Design Spec:
+{s['spec']}
+
+Known Issues:
+{s['notes']}
+
+Focus on the known issues first, then color accuracy, spacing, responsive behavior and missing hover states.
+Change only what needs to change; unchanged code must not appear in the edits.
+
+{REFINE_PATCH_FORMAT}"""
+
+    sections = {
+        "document": (compact_markup(state['html_code']), None),
+        "spec": (spec_json(state.get("design_spec")), shrink_spec),
+        "notes": (known_issues, trim_text),
+    }
+    return [
+        SystemMessage(content=fit_prompt("refine", patch_prompt, sections, job_id=state.get("job_id"))),
+        HumanMessage(content="Return the edits now.")
+    ]
+
+def _apply_patch_response(state: AgentState, response) -> dict:
+    """Apply the model's edits to the current document; raises PatchError if they don't apply cleanly"""
+    edits = parse_patch_response(response.content)
+    html_code = apply_patches(state["html_code"], edits)
+    metrics.inc("refine_patches_total", help="Refinement passes by outcome", outcome="applied")
+    _log(state, f"Code refined with {len(edits)} targeted edit{'s' if len(edits) != 1 else ''}")
+    return {"html_code": html_code, "iteration_count": state.get("iteration_count", 0) + 1}
+
+def _patch_failed(state: AgentState, error: PatchError):
+    """Count and log a rejected patch response before falling back to full regeneration"""
+    metrics.inc("refine_patches_total", help="Refinement passes by outcome", outcome="fallback")
+    _log(state, f"Targeted edits rejected ({error}); regenerating the full document")
+
+def _apply_refinement(state: AgentState, response) -> dict:
+    """Keep the refined document if the model returned a full HTML file"""
     refined_code = response.content.strip()
 
     if "```html" in refined_code:
@@ -283,25 +528,70 @@ Provide the refined COMPLETE HTML file (with embedded CSS) that's production-rea
     elif "```" in refined_code:
         refined_code = refined_code.split("```")[1].split("```")[0].strip()
 
+    update = {"iteration_count": state.get("iteration_count", 0) + 1}
     if "<!DOCTYPE html>" in refined_code or "<html" in refined_code:
-        state["html_code"] = refined_code
-
-    state["iteration_count"] = state.get("iteration_count", 0) + 1
-    state["messages"].append("Code refined")
-    state["progress_log"] += "Code refined and optimized\n"
+        update["html_code"] = refined_code
 
-    return state
+    _log(state, "Code refined and optimized")
+    return update
 
-def output_node(state: AgentState) -> AgentState:
+def refine_code_node(state: AgentState) -> dict:
+    """Refine and optimize the generated code"""
+    _log(state, "✨ Refining code...")
+
+    if config.REFINE_MODE == "patch":
+        response = _call_llm(state, _patch_messages(state), "refine_patch", hedge=True)
+        try:
+            return _apply_patch_response(state, response)
+        except PatchError as e:
+            _patch_failed(state, e)
+    response = _call_llm(state, _refinement_messages(state), "refine", hedge=True)
+    return _apply_refinement(state, response)
+
+async def arefine_code_node(state: AgentState) -> dict:
+    """Async variant of refine_code_node"""
+    _log(state, "✨ Refining code...")
+
+    if config.REFINE_MODE == "patch":
+        response = await _acall_llm(state, _patch_messages(state), "refine_patch", hedge=True)
+        try:
+            return _apply_patch_response(state, response)
+        except PatchError as e:
+            _patch_failed(state, e)
+    response = await _acall_llm(state, _refinement_messages(state), "refine", hedge=True)
+    return _apply_refinement(state, response)
+
+def output_node(state: AgentState) -> dict:
     """Final output node - replace placeholders with actual base64"""
-    state["messages"].append("Embedding base64 images...")
-    state["progress_log"] += "Replacing placeholders with base64 images...\n"
+    _log(state, "Replacing placeholders with base64 images...")
 
     # NOW we replace the lightweight placeholders with actual base64 data
-    from utils.image_utils import replace_image_placeholders
-    user_images_base64 = state.get("user_images_base64", {})
-    state["html_code"] = replace_image_placeholders(state["html_code"], user_images_base64)
-
-    state["messages"].append("Generation complete!")
-    state["progress_log"] += "Generation complete! HTML file is fully self-contained.\n"
-    return state
\ No newline at end of file
+    from utils.image_utils import dedupe_image_placeholders, replace_image_placeholders
+    user_images_base64 = {
+        filename: blob_store.get(ref) for filename, ref in state.get("user_image_refs", {}).items()
+    }
+    html_code = state["html_code"]
+    variants = {}
+    if config.RESPONSIVE_IMAGES and user_images_base64:
+        targets = slot_targets(state.get("images_detected", []), len(user_images_base64))
+        variants = build_variants(user_images_base64, targets, srcset=config.USER_IMAGE_SRCSET)
+        original_bytes = sum(len(uri) for uri in user_images_base64.values())
+        user_images_base64 = {
+            filename: variants[index][-1][0] for index, filename in enumerate(user_images_base64)
+        }
+        encoded_bytes = sum(len(uri) for uri in user_images_base64.values())
+        _log(state, f"Resized and re-encoded {len(user_images_base64)} user images for their slots "
+                    f"({original_bytes / 1024:.0f} KB -> {encoded_bytes / 1024:.0f} KB)")
+    if config.DEDUPE_IMAGES:
+        html_code, report = dedupe_image_placeholders(html_code, user_images_base64)
+        if report["shared_images"]:
+            metrics.inc("dedupe_bytes_saved_total", report["bytes_saved"], help="Bytes saved by embedding shared images once")
+            _log(state, f"Embedded {report['shared_images']} shared images once for {report['shared_references']} "
+                        f"references ({report['bytes_saved'] / 1024:.0f} KB saved, "
+                        f"{report['deduped_bytes'] / 1024:.0f} KB instead of {report['inline_bytes'] / 1024:.0f} KB)")
+    if config.USER_IMAGE_SRCSET and variants:
+        html_code = add_srcset(html_code, variants)
+    html_code = replace_image_placeholders(html_code, user_images_base64)
+
+    _log(state, "Generation complete! HTML file is fully self-contained.")
+    return {"html_code": html_code}
\ No newline at end of file
@@ -1,48 +1,221 @@
 """
 LangGraph workflow definition for Canva to HTML generation
 """
+import functools
+import inspect
+import threading
+from langchain_core.runnables import RunnableLambda
 from langgraph.graph import StateGraph, END
 from typing import Literal
 from agents.nodes import *
 from models.state import AgentState
+from utils.cache import hash_parts, stage_cache
+from utils.events import emit
+from utils.instrumentation import mark_cache_hit, node_span
+from utils.llm_factory import default_model
+import config
 
-def should_refine(state: AgentState) -> Literal["refine", "output"]:
-    """Decide if we need another refinement iteration"""
-    if state.get("iteration_count", 0) < 1:
+# Compiled graphs, keyed by their shape parameters
+_graph_cache = {}
+_graph_cache_lock = threading.Lock()
+
+# State fields each LLM stage reads and writes; the stage cache key is derived
+# from the inputs, so a rerun skips every stage whose inputs haven't changed
+STAGE_IO = {
+    "analyze_design": (
+        ["image_ref", "image_mime_type", "api_provider"],
+        ["design_analysis"],
+    ),
+    "extract_elements": (
+        ["design_analysis", "user_images_count", "api_provider"],
+        ["color_palette", "typography", "layout_structure", "images_detected", "design_spec"],
+    ),
+    "generate_html": (
+        ["design_spec", "images_detected", "api_provider"],
+        ["html_code"],
+    ),
+    "generate_css": (
+        ["html_code", "design_spec", "api_provider"],
+        ["css_code"],
+    ),
+    "generate_code": (
+        ["design_spec", "layout_structure", "images_detected", "api_provider"],
+        ["html_code", "css_code", "class_contract"],
+    ),
+    "refine": (
+        ["html_code", "design_spec", "images_detected", "refinement_notes", "iteration_count", "api_provider"],
+        ["html_code", "iteration_count"],
+    ),
+}
+
+# Config settings that change what a stage produces from the same inputs
+STAGE_SETTINGS = {
+    "refine": ["REFINE_MODE"],
+}
+
+def memoize_stage(stage: str, node_fn):
+    """Wrap a node (sync or async) so its outputs are reused when its inputs are unchanged"""
+    input_fields, output_fields = STAGE_IO[stage]
+
+    def cache_key(state: AgentState) -> str:
+        api_provider = state.get("api_provider", "openrouter")
+        # Output fields are part of the key so entries from an older STAGE_IO aren't reused
+        return hash_parts(
+            stage,
+            output_fields,
+            default_model(api_provider),
+            *[getattr(config, setting) for setting in STAGE_SETTINGS.get(stage, [])],
+            *[state.get(field) for field in input_fields]
+        )
+
+    def apply_cached(state: AgentState, cached) -> dict:
+        mark_cache_hit()
+        emit(state.get("job_id"), f"Reused cached {stage} result (inputs unchanged)")
+        return dict(cached)
+
+    def store(key: str, state: AgentState, update: dict):
+        if update.get("extraction_used_defaults"):
+            return  # degraded output: ask the model again next time
+        stage_cache.put(key, {field: update.get(field, state.get(field)) for field in output_fields})
+
+    if inspect.iscoroutinefunction(node_fn):
+        @functools.wraps(node_fn)
+        async def async_wrapper(state: AgentState) -> dict:
+            if not config.STAGE_CACHE_ENABLED:
+                return await node_fn(state)
+            key = cache_key(state)
+            cached = stage_cache.get(key)
+            if cached is not None:
+                return apply_cached(state, cached)
+            update = await node_fn(state)
+            store(key, state, update)
+            return update
+
+        return async_wrapper
+
+    @functools.wraps(node_fn)
+    def wrapper(state: AgentState) -> dict:
+        if not config.STAGE_CACHE_ENABLED:
+            return node_fn(state)
+        key = cache_key(state)
+        cached = stage_cache.get(key)
+        if cached is not None:
+            return apply_cached(state, cached)
+        update = node_fn(state)
+        store(key, state, update)
+        return update
+
+    return wrapper
+
+def instrument_node(node: str, node_fn):
+    """Wrap a node (sync or async) so it runs inside a trace span of its job"""
+    if inspect.iscoroutinefunction(node_fn):
+        @functools.wraps(node_fn)
+        async def async_wrapper(state: AgentState) -> dict:
+            with node_span(state.get("job_id"), node):
+                return await node_fn(state)
+
+        return async_wrapper
+
+    @functools.wraps(node_fn)
+    def wrapper(state: AgentState) -> dict:
+        with node_span(state.get("job_id"), node):
+            return node_fn(state)
+
+    return wrapper
+
+def llm_stage(stage: str, node_fn, async_node_fn) -> RunnableLambda:
+    """Graph node with memoized, instrumented sync and async implementations"""
+    return RunnableLambda(
+        instrument_node(stage, memoize_stage(stage, node_fn)),
+        afunc=instrument_node(stage, memoize_stage(stage, async_node_fn)),
+        name=stage,
+    )
+
+def make_should_refine(max_refinements: int):
+    """Build the refinement router for a given maximum number of refinement passes"""
+    def should_refine(state: AgentState) -> Literal["refine", "output"]:
+        """Refine while the quality check fails, passes remain and the last pass helped"""
+        scores = state.get("quality_scores", [])
+        if scores and scores[-1] >= config.QUALITY_THRESHOLD:
+            return "output"
+        if state.get("iteration_count", 0) >= max_refinements:
+            return "output"
+        if len(scores) >= 2 and scores[-1] <= scores[-2]:
+            emit(state.get("job_id"), "Last refinement did not improve the quality score, stopping")
+            return "output"
         return "refine"
-    return "output"
+    return should_refine
+
+should_refine = make_should_refine(config.MAX_ITERATIONS)
+
+def create_agent_graph(max_refinements: int = None, parallel_codegen: bool = None):
+    """Create the LangGraph workflow (supports both invoke and ainvoke)"""
+    if max_refinements is None:
+        max_refinements = config.MAX_ITERATIONS
+    if parallel_codegen is None:
+        parallel_codegen = config.PARALLEL_CODEGEN
 
-def create_agent_graph():
-    """Create the LangGraph workflow"""
     workflow = StateGraph(AgentState)
 
     # Add all nodes
-    workflow.add_node("analyze_design", analyze_design_node)
-    workflow.add_node("extract_elements", extract_design_elements_node)
-    workflow.add_node("generate_html", generate_html_node)
-    workflow.add_node("generate_css", generate_css_node)
-    workflow.add_node("combine_code", combine_code_node)
-    workflow.add_node("refine", refine_code_node)
-    workflow.add_node("output", output_node)
+    workflow.add_node("analyze_design", llm_stage("analyze_design", analyze_design_node, aanalyze_design_node))
+    workflow.add_node("extract_elements", llm_stage("extract_elements", extract_design_elements_node, aextract_design_elements_node))
+    if parallel_codegen:
+        workflow.add_node("generate_code", llm_stage("generate_code", generate_code_node, agenerate_code_node))
+    else:
+        workflow.add_node("generate_html", llm_stage("generate_html", generate_html_node, agenerate_html_node))
+        workflow.add_node("generate_css", llm_stage("generate_css", generate_css_node, agenerate_css_node))
+    workflow.add_node("combine_code", instrument_node("combine_code", combine_code_node))
+    workflow.add_node("quality_check", instrument_node("quality_check", quality_check_node))
+    workflow.add_node("refine", llm_stage("refine", refine_code_node, arefine_code_node))
+    workflow.add_node("output", instrument_node("output", output_node))
 
     # Define workflow
     workflow.set_entry_point("analyze_design")
     workflow.add_edge("analyze_design", "extract_elements")
-    workflow.add_edge("extract_elements", "generate_html")
-    workflow.add_edge("generate_html", "generate_css")
-    workflow.add_edge("generate_css", "combine_code")
-    workflow.add_edge("combine_code", "refine")
+    if parallel_codegen:
+        workflow.add_edge("extract_elements", "generate_code")
+        workflow.add_edge("generate_code", "combine_code")
+    else:
+        workflow.add_edge("extract_elements", "generate_html")
+        workflow.add_edge("generate_html", "generate_css")
+        workflow.add_edge("generate_css", "combine_code")
+    workflow.add_edge("combine_code", "quality_check")
 
-    # Conditional refinement
+    # Conditional refinement: each pass edits the current document and is checked again
     workflow.add_conditional_edges(
-        "refine",
-        should_refine,
+        "quality_check",
+        make_should_refine(max_refinements),
         {
-            "refine": "generate_html",
+            "refine": "refine",
             "output": "output"
         }
     )
+    workflow.add_edge("refine", "quality_check")
 
     workflow.add_edge("output", END)
 
-    return workflow.compile()
\ No newline at end of file
+    return workflow.compile()
+
+def get_agent_graph(max_refinements: int = None, parallel_codegen: bool = None):
+    """
+    Return the compiled workflow for the given shape, compiling it on first use.
+    Compiled graphs are stateless and shared by all concurrent invocations.
+    """
+    if max_refinements is None:
+        max_refinements = config.MAX_ITERATIONS
+    if parallel_codegen is None:
+        parallel_codegen = config.PARALLEL_CODEGEN
+    key = (max_refinements, parallel_codegen)
+
+    graph = _graph_cache.get(key)
+    if graph is not None:
+        return graph
+
+    with _graph_cache_lock:
+        graph = _graph_cache.get(key)
+        if graph is None:
+            graph = create_agent_graph(max_refinements, parallel_codegen)
+            _graph_cache[key] = graph
+    return graph
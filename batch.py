@@ -0,0 +1,75 @@
+"""
+Headless batch entry point: convert a directory (or manifest) of Canva templates
+
+Examples:
+    python batch.py --input exports/ --output out/ --workers 8
+    python batch.py --manifest jobs.json --output out/ --rate-limit gemini=30
+"""
+import argparse
+import sys
+from pathlib import Path
+from services.batch_service import BatchRunner, discover_jobs, load_manifest
+import config
+
+
+def parse_rate_limits(values):
+    """Parse repeated provider=requests_per_minute options"""
+    limits = {}
+    for value in values or []:
+        provider, _, rpm = value.partition("=")
+        if not rpm:
+            raise argparse.ArgumentTypeError(f"Invalid rate limit '{value}', expected provider=requests_per_minute")
+        limits[provider] = float(rpm)
+    return limits
+
+
+def main():
+    """Run a batch conversion from the command line"""
+    parser = argparse.ArgumentParser(description="Convert Canva templates to HTML in batch")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", type=Path, help="folder of template images")
+    source.add_argument("--manifest", type=Path, help="JSON manifest of templates and user images")
+    parser.add_argument("--images", type=Path, help="user images shared by templates without their own folder")
+    parser.add_argument("--output", type=Path, default=config.OUTPUT_FOLDER / "batch", help="output folder")
+    parser.add_argument("--provider", choices=["openrouter", "gemini", "fake"], default=config.DEFAULT_API_PROVIDER)
+    parser.add_argument("--workers", type=int, default=config.MAX_CONCURRENT_JOBS, help="parallel jobs")
+    parser.add_argument("--rate-limit", action="append", metavar="PROVIDER=RPM",
+                        help="max job starts per minute for a provider (repeatable)")
+    parser.add_argument("--force", action="store_true", help="regenerate outputs that already exist")
+    parser.add_argument("--linked-assets", action="store_true",
+                        help="write <name>/index.html, styles.css and image files instead of one inline HTML file")
+    parser.add_argument("--dedupe-images", action="store_true",
+                        help="embed images used more than once a single time")
+    args = parser.parse_args()
+
+    if args.dedupe_images:
+        config.DEDUPE_IMAGES = True
+
+    try:
+        rate_limits = parse_rate_limits(args.rate_limit)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    jobs = load_manifest(args.manifest) if args.manifest else discover_jobs(args.input, args.images)
+    if not jobs:
+        print("No templates found.")
+        return 1
+
+    print(f"Converting {len(jobs)} templates with {args.workers} workers -> {args.output}")
+    runner = BatchRunner(
+        output_dir=args.output,
+        api_provider=args.provider,
+        workers=args.workers,
+        rate_limits=rate_limits,
+        force=args.force,
+        linked_assets=args.linked_assets,
+    )
+    summary = runner.run(jobs)
+
+    print(f"Done in {summary['wall_seconds']:.1f}s: {summary['counts']}")
+    print(f"Summary written to {args.output / 'summary.json'}")
+    return 0 if "failed" not in summary["counts"] else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
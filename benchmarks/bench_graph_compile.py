@@ -0,0 +1,48 @@
+"""
+Micro-benchmark: per-request overhead of building the workflow graph
+
+Compares compiling the LangGraph workflow on every request (old behaviour)
+with fetching the cached compiled graph.
+
+Usage:
+    python -m benchmarks.bench_graph_compile [--runs 200]
+"""
+import argparse
+import statistics
+import time
+from agents.workflow import create_agent_graph, get_agent_graph
+
+
+def _time_calls(fn, runs: int):
+    """Return per-call timings in milliseconds"""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def _report(label: str, timings):
+    """Print a summary line for a set of timings"""
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{label:<28} mean={statistics.mean(timings):8.3f} ms  "
+          f"median={statistics.median(timings):8.3f} ms  p95={p95:8.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Graph compilation overhead benchmark")
+    parser.add_argument("--runs", type=int, default=200, help="calls per variant")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    get_agent_graph()
+    print(f"Startup compilation: {(time.perf_counter() - start) * 1000:.3f} ms")
+
+    _report("compile per request", _time_calls(create_agent_graph, args.runs))
+    _report("cached compiled graph", _time_calls(get_agent_graph, args.runs))
+
+
+if __name__ == "__main__":
+    main()
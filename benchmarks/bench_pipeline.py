@@ -0,0 +1,160 @@
+"""
+End-to-end pipeline benchmark against the deterministic fake provider
+
+Runs the workflow over a corpus of synthetic templates and user-image sets and
+reports per-node wall time, peak memory, payload bytes, graph state size per
+step and throughput at several concurrency levels. No API keys are needed; set FAKE_LLM_LATENCY /
+FAKE_LLM_TOKENS_PER_SECOND to model provider latency, or FAKE_LLM_RESPONSES
+to replay recorded responses. Result and stage caches are disabled unless
+--with-caches is given, so the numbers reflect the pipeline's own work.
+
+Usage:
+    python -m benchmarks.bench_pipeline [--templates 4] [--concurrency 1,4,16] [--json out.json]
+"""
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from agents.workflow import create_agent_graph
+from benchmarks.bench_template_payload import synthetic_template
+from services.generator_service import GeneratorService
+from services.scheduler import scheduler
+from utils.blob_store import blob_store
+import config
+
+PROVIDER = "fake"
+TEMPLATE_SIZES = [(1080, 1920), (1920, 1080), (2480, 3508), (3840, 2160)]
+IMAGE_SET_SIZES = [0, 3, 10]
+
+
+def build_corpus(count: int):
+    """Synthetic (template, user images) pairs cycling through sizes and image-set sizes"""
+    corpus = []
+    for idx in range(count):
+        width, height = TEMPLATE_SIZES[idx % len(TEMPLATE_SIZES)]
+        template = synthetic_template(width, height)
+        image_count = IMAGE_SET_SIZES[idx % len(IMAGE_SET_SIZES)]
+        user_images = [
+            Image.effect_noise((1600, 1200), 40 + i).convert("RGB")
+            for i in range(image_count)
+        ]
+        corpus.append((template, user_images))
+    return corpus
+
+
+def state_size(state) -> int:
+    """Approximate bytes of the graph state (what LangGraph carries between steps)"""
+    return len(json.dumps(state, default=str).encode("utf-8"))
+
+
+def profile_graph(corpus):
+    """Per-node wall time, peak memory, payload bytes and state size for single runs of the graph"""
+    agent = create_agent_graph()
+    node_times = {}
+    runs = []
+
+    for template, user_images in corpus:
+        job = GeneratorService._prepare_job(template, user_images, PROVIDER)
+        GeneratorService._store_blobs(job)
+        state = job["state"]
+        current = dict(state)
+        snapshots = []
+        payloads = job["payloads"]
+        payload_bytes = len(payloads["image"]) + sum(len(uri) for uri in payloads["user_images"].values())
+
+        tracemalloc.start()
+        start = last = time.perf_counter()
+        final_html = ""
+        for update in agent.stream(state, stream_mode="updates"):
+            now = time.perf_counter()
+            for node, output in update.items():
+                node_times.setdefault(node, []).append(now - last)
+                final_html = (output or {}).get("html_code", final_html)
+                current.update(output or {})
+                snapshots.append(dict(current))  # sized after the timed run
+            last = now
+        total = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        blob_store.release(state["job_id"])
+        state_sizes = [state_size(snapshot) for snapshot in snapshots]
+
+        runs.append({
+            "template": f"{template.size[0]}x{template.size[1]}",
+            "user_images": len(user_images),
+            "seconds": total,
+            "peak_memory_bytes": peak,
+            "payload_bytes": payload_bytes,
+            "output_bytes": len(final_html.encode("utf-8")),
+            "initial_state_bytes": state_size(state),
+            "max_state_bytes": max(state_sizes),
+            "steps": len(state_sizes),
+        })
+
+    nodes = {node: {"mean_ms": statistics.mean(times) * 1000, "max_ms": max(times) * 1000}
+             for node, times in node_times.items()}
+    return nodes, runs
+
+
+def measure_throughput(corpus, concurrency: int, jobs: int):
+    """Jobs per second through GeneratorService.process_image with N concurrent callers"""
+    scheduler.configure(max_concurrent=concurrency, provider_limits={PROVIDER: concurrency},
+                        max_queue_depth=jobs)
+    work = [corpus[i % len(corpus)] for i in range(jobs)]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda item: GeneratorService.process_image(item[0], item[1], PROVIDER), work))
+    elapsed = time.perf_counter() - start
+
+    failures = sum(1 for _, html, _ in results if not html)
+    return {"concurrency": concurrency, "jobs": jobs, "seconds": elapsed,
+            "jobs_per_second": jobs / elapsed, "failures": failures}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark (fake provider)")
+    parser.add_argument("--templates", type=int, default=4, help="synthetic templates in the corpus")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated concurrency levels")
+    parser.add_argument("--jobs", type=int, default=16, help="jobs per throughput run")
+    parser.add_argument("--with-caches", action="store_true", help="keep result and stage caches enabled")
+    parser.add_argument("--json", help="write the full report to this file")
+    args = parser.parse_args()
+
+    if not args.with_caches:
+        config.RESULT_CACHE_ENABLED = False
+        config.STAGE_CACHE_ENABLED = False
+
+    corpus = build_corpus(args.templates)
+    nodes, runs = profile_graph(corpus)
+
+    print("Per-node wall time")
+    for node, timing in nodes.items():
+        print(f"  {node:<18} mean={timing['mean_ms']:9.2f} ms  max={timing['max_ms']:9.2f} ms")
+
+    print("Single runs")
+    for run in runs:
+        print(f"  {run['template']:>10} + {run['user_images']:>2} images  {run['seconds'] * 1000:9.1f} ms  "
+              f"peak={run['peak_memory_bytes'] / 2**20:7.1f} MiB  payload={run['payload_bytes'] / 2**20:7.2f} MiB  "
+              f"output={run['output_bytes'] / 2**20:7.2f} MiB  "
+              f"state={run['initial_state_bytes'] / 2**20:6.2f}->{run['max_state_bytes'] / 2**20:6.2f} MiB "
+              f"over {run['steps']} steps")
+
+    print("Throughput (GeneratorService.process_image)")
+    throughput = []
+    for level in [int(value) for value in args.concurrency.split(",")]:
+        result = measure_throughput(corpus, level, args.jobs)
+        throughput.append(result)
+        print(f"  concurrency={level:<3} {result['jobs_per_second']:8.2f} jobs/s  "
+              f"({result['jobs']} jobs in {result['seconds']:.2f}s, {result['failures']} failures)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"nodes": nodes, "runs": runs, "throughput": throughput}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
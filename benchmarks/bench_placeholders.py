@@ -0,0 +1,65 @@
+"""
+Micro-benchmark: embedding user images into the final HTML
+
+Compares one str.replace per image over the whole document (old behaviour)
+with the single-pass substitution. Reports wall time and peak traced memory.
+
+Usage:
+    python -m benchmarks.bench_placeholders [--images 10] [--uses 3] [--image-kb 2048]
+"""
+import argparse
+import base64
+import os
+import time
+import tracemalloc
+from utils.image_utils import replace_image_placeholders
+
+
+def replace_per_image(html_code: str, user_images_base64):
+    """The previous implementation: one full-document copy per image"""
+    for idx, data_uri in enumerate(user_images_base64.values()):
+        html_code = html_code.replace(f"{{{{USER_IMAGE_{idx}}}}}", data_uri)
+    return html_code
+
+
+def synthetic_document(images: int, uses: int, image_kb: int):
+    """HTML referencing each image `uses` times, plus one data URI of image_kb per image"""
+    sections = [
+        f'<section><img src="{{{{USER_IMAGE_{idx}}}}}" alt="Image {idx}"><p>{"Lorem ipsum " * 40}</p></section>'
+        for _ in range(uses) for idx in range(images)
+    ]
+    html_code = "<!DOCTYPE html><html><body>" + "\n".join(sections) + "</body></html>"
+    user_images = {
+        f"user_image_{idx}": "data:image/png;base64," + base64.b64encode(os.urandom(image_kb * 768)).decode("ascii")
+        for idx in range(images)
+    }
+    return html_code, user_images
+
+
+def measure(label: str, fn):
+    """Run fn once under tracemalloc and print its time and peak memory"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<26} {elapsed * 1000:9.1f} ms  peak={peak / 2**20:8.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Placeholder substitution benchmark")
+    parser.add_argument("--images", type=int, default=10, help="distinct user images")
+    parser.add_argument("--uses", type=int, default=3, help="references per image")
+    parser.add_argument("--image-kb", type=int, default=2048, help="size of each data URI in KB")
+    args = parser.parse_args()
+
+    html_code, user_images = synthetic_document(args.images, args.uses, args.image_kb)
+    print(f"{args.images} images x {args.uses} uses, {args.image_kb} KB each")
+
+    measure("str.replace per image", lambda: replace_per_image(html_code, user_images))
+    measure("single pass", lambda: replace_image_placeholders(html_code, user_images))
+
+
+if __name__ == "__main__":
+    main()
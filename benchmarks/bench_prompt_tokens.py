@@ -0,0 +1,96 @@
+"""
+Prompt size report: estimated input tokens per LLM node, before and after the design spec
+
+Builds each node's prompt from the fake provider's scripted analysis and
+extraction (or a recorded analysis) and compares it with the previous
+prompts, which embedded the prose analysis, indented JSON and the full
+uncompacted document. The fixed instructions are shared, so the previous
+size is the current prompt with its data sections swapped back.
+
+Usage:
+    python -m benchmarks.bench_prompt_tokens [--analysis analysis.txt] [--iterations 2]
+"""
+import argparse
+import json
+from agents import nodes
+from utils.design_spec import spec_json
+from utils.fake_llm import SCRIPTED_RESPONSES
+from utils.html_utils import derive_class_contract
+from utils.instrumentation import estimate_tokens
+from utils.prompt_budget import compact_markup
+
+
+def pipeline_state(design_analysis: str) -> dict:
+    """State after extraction and combining, as the codegen and refine prompts see it"""
+    state = {
+        "job_id": None, "design_analysis": design_analysis, "user_images_count": 3,
+        "refinement_notes": ["HTML classes without CSS rules: features__text"], "iteration_count": 0,
+    }
+    state.update(nodes._apply_extraction(state, json.loads(SCRIPTED_RESPONSES["extraction"])))
+    state["html_code"] = nodes._parse_html(SCRIPTED_RESPONSES["html"])
+    state["css_code"] = nodes._parse_css(SCRIPTED_RESPONSES["css"])
+    state["class_contract"] = []
+    state.update(nodes.combine_code_node(state))
+    return state
+
+
+def indented(value) -> str:
+    return json.dumps(value, indent=2)
+
+
+def data_sections(state: dict):
+    """(previous, current) character counts of the data each prompt embeds"""
+    spec = state["design_spec"]
+    images = state["images_detected"]
+    return {
+        "extraction": (len(state["design_analysis"]), len(state["design_analysis"])),
+        "html": (
+            len(state["design_analysis"]) + len(indented(state["layout_structure"])) + len(indented(images)),
+            len(spec_json(spec)) + len(nodes._compact_json(images)),
+        ),
+        "css": (
+            sum(len(indented(state[f])) for f in ("color_palette", "typography", "layout_structure")),
+            sum(len(nodes._compact_json(spec.get(f, {}))) for f in ("colors", "typography", "layout", "spacing")),
+        ),
+        "refine": (
+            len(state["html_code"]) + len(state["design_analysis"]),
+            len(compact_markup(state["html_code"])) + len(spec_json(spec)),
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prompt token report per node")
+    parser.add_argument("--analysis", help="recorded design analysis text (default: the fake provider's)")
+    parser.add_argument("--iterations", type=int, default=1, help="refinement passes to count")
+    args = parser.parse_args()
+
+    analysis = SCRIPTED_RESPONSES["analysis"]
+    if args.analysis:
+        with open(args.analysis, "r", encoding="utf-8") as f:
+            analysis = f.read()
+    state = pipeline_state(analysis)
+    contract = derive_class_contract(state["layout_structure"], state["images_detected"])
+
+    prompts = {
+        "extraction": nodes._extraction_messages(state),
+        "html": nodes._html_messages(state, contract),
+        "css": nodes._css_messages(state, contract),
+        "refine": nodes._refinement_messages(state),
+    }
+    sections = data_sections(state)
+    totals = [0, 0]
+    print(f"{'node':<12} {'before':>8} {'after':>8}  saved")
+    for node, messages in prompts.items():
+        after = estimate_tokens(sum(len(m.content) for m in messages))
+        previous, current = sections[node]
+        before = after + estimate_tokens(previous) - estimate_tokens(current)
+        calls = args.iterations if node == "refine" else 1
+        totals[0] += before * calls
+        totals[1] += after * calls
+        print(f"{node:<12} {before:>8} {after:>8}  {1 - after / before:6.1%}" + (f"  (x{calls})" if calls > 1 else ""))
+    print(f"{'total':<12} {totals[0]:>8} {totals[1]:>8}  {1 - totals[1] / totals[0]:6.1%}")
+
+
+if __name__ == "__main__":
+    main()
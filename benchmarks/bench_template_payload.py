@@ -0,0 +1,89 @@
+"""
+Benchmark: template payload size and vision-call latency per preprocessing setting
+
+Encodes a template (a synthetic 3840x2160 design by default) with the full-fidelity
+PNG path and several downscale/re-encode settings, and reports payload bytes and
+encode time. With --provider, each payload is also sent through
+analyze_design_node to measure end-to-end latency against the live provider.
+
+Usage:
+    python -m benchmarks.bench_template_payload [--image design.png] [--provider gemini]
+"""
+import argparse
+import time
+from PIL import Image, ImageDraw
+from utils.image_utils import prepare_template_image
+
+SETTINGS = [
+    ("full fidelity PNG", dict(full_fidelity=True)),
+    ("PNG  @ 1568", dict(full_fidelity=False, format="PNG", max_edge=1568)),
+    ("JPEG q85 @ 1568", dict(full_fidelity=False, format="JPEG", quality=85, max_edge=1568)),
+    ("WEBP q80 @ 1568", dict(full_fidelity=False, format="WEBP", quality=80, max_edge=1568)),
+    ("JPEG q80 @ 1024", dict(full_fidelity=False, format="JPEG", quality=80, max_edge=1024)),
+]
+
+
+def synthetic_template(width: int = 3840, height: int = 2160) -> Image.Image:
+    """Draw a Canva-like layout: gradient hero, photo block, cards, text bars, transparent corner"""
+    image = Image.new("RGBA", (width, height), (255, 255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    for y in range(height // 2):
+        shade = int(255 * y / (height // 2))
+        draw.line([(0, y), (width, y)], fill=(255, 107, shade, 255))
+    photo = Image.effect_noise((width // 3, height // 3), 64).convert("RGBA")
+    image.paste(photo, (width // 2, height // 10))
+    card_width = width // 4
+    for i in range(3):
+        x = card_width // 4 + i * (card_width + card_width // 4)
+        draw.rounded_rectangle([x, height // 2 + 100, x + card_width, height - 150],
+                               radius=40, fill=(0, 78, 137, 255))
+        for line in range(5):
+            top = height // 2 + 200 + line * 80
+            draw.rectangle([x + 60, top, x + card_width - 60, top + 30], fill=(247, 247, 247, 255))
+    draw.rectangle([width - 300, 0, width, 300], fill=(0, 0, 0, 0))
+    return image
+
+
+def measure_latency(payload: str, mime_type: str, provider: str) -> float:
+    """Run the analysis node once and return its wall time in seconds"""
+    from agents.nodes import analyze_design_node
+    from utils.blob_store import blob_store
+
+    state = {
+        "image_ref": blob_store.put(payload, owner="bench_template_payload"),
+        "image_mime_type": mime_type,
+        "api_provider": provider,
+    }
+    try:
+        start = time.perf_counter()
+        analyze_design_node(state)
+        return time.perf_counter() - start
+    finally:
+        blob_store.release("bench_template_payload")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Template payload benchmark")
+    parser.add_argument("--image", help="template image to encode (default: synthetic 4K design)")
+    parser.add_argument("--provider", help="also measure analyze_design latency with this provider")
+    args = parser.parse_args()
+
+    image = Image.open(args.image) if args.image else synthetic_template()
+    print(f"Template: {image.size[0]}x{image.size[1]} {image.mode}")
+
+    baseline = None
+    for label, options in SETTINGS:
+        start = time.perf_counter()
+        payload, mime_type = prepare_template_image(image, **options)
+        encode_ms = (time.perf_counter() - start) * 1000
+        baseline = baseline or len(payload)
+
+        line = (f"{label:<20} {len(payload) / 1024:10.1f} KiB  "
+                f"({len(payload) / baseline:6.1%})  encode={encode_ms:8.1f} ms")
+        if args.provider:
+            line += f"  latency={measure_latency(payload, mime_type, args.provider):6.2f} s"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -19,10 +19,113 @@ GEMINI_MODEL = "gemini-2.0-flash-exp"
 # Path Configuration
 BASE_DIR = Path(__file__).parent
 OUTPUT_FOLDER = BASE_DIR / "output"
+CACHE_FOLDER = BASE_DIR / "cache"
+RESULT_CACHE_FOLDER = CACHE_FOLDER / "results"
+STAGE_CACHE_FOLDER = CACHE_FOLDER / "stages"
+BLOB_STORE_FOLDER = CACHE_FOLDER / "blobs"
 
 # Create necessary directories
 OUTPUT_FOLDER.mkdir(exist_ok=True)
 
 # Application Settings
-MAX_ITERATIONS = 2
-DEFAULT_API_PROVIDER = "gemini" if GEMINI_API_KEY else "openrouter"
\ No newline at end of file
+MAX_ITERATIONS = 2  # refinement passes at most; the quality check usually stops earlier
+QUALITY_THRESHOLD = 0.9  # documents scoring at least this skip refinement
+REFINE_MODE = "patch"  # "patch": targeted edits applied locally, falling back to "full" regeneration
+PARALLEL_CODEGEN = True  # generate HTML and CSS concurrently against a class contract
+DEFAULT_API_PROVIDER = "gemini" if GEMINI_API_KEY else "openrouter"
+
+# LLM Client Settings
+LLM_TEMPERATURE = 0.7
+HTTP_TIMEOUT = 120.0  # seconds
+HTTP_MAX_CONNECTIONS = 20
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 10
+HTTP_KEEPALIVE_EXPIRY = 60.0  # seconds
+
+# LLM Call Resilience (utils/llm_call.py)
+LLM_RATE_LIMITS = {"openrouter": 20, "gemini": 10}  # requests per minute per provider (absent = unlimited)
+LLM_RATE_BURST = 4  # requests allowed back to back before the rate applies
+LLM_MAX_RETRIES = 4  # retries of transient errors (429, 5xx, timeouts) per provider
+LLM_BACKOFF_BASE = 1.0  # seconds; full-jitter exponential backoff, doubled per retry
+LLM_BACKOFF_MAX = 20.0  # seconds
+LLM_ATTEMPT_TIMEOUT = 90.0  # seconds per attempt
+LLM_CALL_DEADLINE = 240.0  # seconds per call including retries and rate limit waits
+LLM_BREAKER_FAILURES = 5  # consecutive transient failures that open a provider's circuit
+LLM_BREAKER_COOLDOWN = 30.0  # seconds before a trial call is let through
+LLM_FALLBACK_ENABLED = os.getenv("LLM_FALLBACK_ENABLED", "").lower() in ("1", "true", "yes")
+LLM_FALLBACK_PROVIDERS = {"openrouter": "gemini", "gemini": "openrouter"}  # used only when its API key is set
+
+# Design Element Extraction
+EXTRACTION_JSON_MODE = True  # ask providers for native JSON output (response_format / response_mime_type); dropped for a provider that rejects it
+EXTRACTION_MAX_ATTEMPTS = 2  # the extraction call is re-asked with its validation errors until this many attempts
+
+# Prompt Budgets (estimated tokens per prompt; trimmable sections are shrunk to fit)
+PROMPT_TOKEN_BUDGETS = {"extraction": 3000, "html": 2000, "css": 1500, "refine": 8000}
+
+# Hedged Requests (analysis and refinement calls; duplicates go to the fallback provider above)
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = 0.9  # hedge once the primary is slower than this share of its recent calls
+HEDGE_MIN_SAMPLES = 20  # observed calls per provider and stage before the percentile is trusted
+HEDGE_INITIAL_DELAY = 20.0  # seconds, used until enough latencies are observed
+HEDGE_MIN_DELAY = 0.5  # seconds
+HEDGE_WINDOW = 500  # latency samples before older ones are aged out
+
+# Result Cache Settings
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_MAX_ENTRIES = 200
+RESULT_CACHE_MAX_BYTES = 500 * 1024 * 1024  # 500 MB on disk
+
+# Stage Cache Settings (per-node memoization)
+STAGE_CACHE_ENABLED = True
+STAGE_CACHE_MAX_ENTRIES = 1000
+STAGE_CACHE_MAX_BYTES = 200 * 1024 * 1024  # 200 MB on disk
+
+# Blob Store Settings (image payloads referenced from graph state)
+BLOB_STORE_MAX_MEMORY_BYTES = 256 * 1024 * 1024  # spill to disk beyond 256 MB
+
+# Template Image Preprocessing (sent to the vision model)
+TEMPLATE_FULL_FIDELITY = False  # True sends the original resolution as lossless PNG
+TEMPLATE_MAX_EDGE = 1568  # pixels on the long edge
+TEMPLATE_FORMAT = "JPEG"  # JPEG, WEBP or PNG
+TEMPLATE_QUALITY = 85
+TEMPLATE_BACKGROUND = "#FFFFFF"  # used to flatten transparency
+
+# Output Settings
+DEDUPE_IMAGES = False  # embed images used more than once a single time (needs JavaScript for <img> tags)
+OUTPUT_RETENTION_MAX_AGE = 24 * 3600  # seconds a saved template-<hash> output is kept (0 = no limit)
+OUTPUT_RETENTION_MAX_BYTES = 1024 * 1024 * 1024  # oldest outputs are evicted beyond this total (0 = no limit)
+SAVE_DEBOUNCE_SECONDS = 1.0  # quiet period after the last edit before the download file is rewritten
+
+# User Image Encoding (embedded in the output)
+RESPONSIVE_IMAGES = True  # resize user images to their slot and re-encode them
+USER_IMAGE_SLOT_SIZES = {"large": 1600, "medium": 960, "small": 480}  # longest edge in pixels
+USER_IMAGE_FORMATS = ["WEBP", "JPEG"]  # first format Pillow can encode wins; add "AVIF" where supported
+USER_IMAGE_QUALITY = 80
+USER_IMAGE_SRCSET = False  # also embed a half-size variant and a srcset on <img> tags
+USER_IMAGE_WORKERS = min(4, os.cpu_count() or 1)  # encoding processes
+
+# Streaming Settings
+STREAM_UPDATE_INTERVAL = 0.1  # seconds between UI updates while tokens stream in
+
+# Job Scheduler Settings
+MAX_CONCURRENT_JOBS = 4
+PROVIDER_CONCURRENCY = {"gemini": 4, "openrouter": 2}
+MAX_QUEUE_DEPTH = 20  # waiting jobs beyond this are rejected
+SCHEDULER_POLL_INTERVAL = 1.0  # seconds between queue position updates
+SCHEDULER_MAX_WAIT = 600  # seconds a non-streaming job may wait in the queue
+SCHEDULER_INITIAL_RUN_ESTIMATE = 60.0  # seconds, seeds the ETA until jobs complete
+
+# Fake Provider Settings (offline benchmarks, no API key needed)
+FAKE_LLM_MODEL = "fake-model"
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.0"))  # seconds before the first token
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "0"))  # 0 = instant
+FAKE_LLM_RESPONSES = os.getenv("FAKE_LLM_RESPONSES") or None  # JSON file of recorded responses per stage
+FAKE_LLM_FAILURE_RATE = float(os.getenv("FAKE_LLM_FAILURE_RATE", "0"))  # share of calls that fail
+FAKE_LLM_FAILURE_KINDS = ["rate_limit", "server_error", "timeout"]  # injected failures, picked at random
+FAKE_LLM_HANG_SECONDS = float(os.getenv("FAKE_LLM_HANG_SECONDS", "5.0"))  # "timeout" failures hang this long
+FAKE_LLM_SEED = os.getenv("FAKE_LLM_SEED") or None  # makes injected failures reproducible
+
+# Instrumentation Settings
+TRACE_LOG_FILE = os.getenv("TRACE_LOG_FILE") or None  # opt-in per-job traces (JSONL), e.g. logs/traces.jsonl
+TRACE_LOG_MAX_BYTES = int(os.getenv("TRACE_LOG_MAX_BYTES", str(50 * 1024 * 1024)))  # rotate the trace log at this size
+TRACE_LOG_BACKUPS = 3  # rotated trace logs kept (traces.jsonl.1 ... .3)
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE") or None  # Prometheus text written after each job
@@ -1,7 +1,9 @@
 """
 Main application entry point for Canva to HTML Generator
 """
+import time
 from ui.gradio_interface import create_ui
+from agents.workflow import get_agent_graph
 import config
 
 def main():
@@ -13,11 +15,23 @@ def main():
     print(f"OpenRouter API Key: {'Set' if config.OPENROUTER_API_KEY else 'Not Set'}")
     print(f"Gemini API Key: {'Set' if config.GEMINI_API_KEY else 'Not Set'}")
     print(f"Output Folder: {config.OUTPUT_FOLDER}")
+    print(f"Max Concurrent Jobs: {config.MAX_CONCURRENT_JOBS} (per provider: {config.PROVIDER_CONCURRENCY})")
     print("=" * 50)
     print("Images will be embedded as base64 (no external files)")
+
+    # Compile the workflow once before serving requests
+    start = time.perf_counter()
+    get_agent_graph()
+    print(f"Workflow compiled in {(time.perf_counter() - start) * 1000:.1f} ms")
     print("=" * 50)
 
     demo = create_ui()
+    # The job scheduler enforces the real limits; Gradio only needs enough
+    # workers for running plus queued jobs so their positions can be reported
+    demo.queue(
+        default_concurrency_limit=config.MAX_CONCURRENT_JOBS + config.MAX_QUEUE_DEPTH,
+        max_size=config.MAX_QUEUE_DEPTH * 2,
+    )
     demo.launch(
         server_name="0.0.0.0",
         server_port=7860,
@@ -1,23 +1,27 @@
 """
 Agent state definitions for the LangGraph workflow
 """
-from typing import TypedDict, Annotated, List, Dict, Any
-import operator
+from typing import TypedDict, List, Dict, Any
 
 class AgentState(TypedDict):
     """State for the Canva to HTML generation workflow"""
-    image_base64: str
+    job_id: str  # keys per-job side channels: progress events, token stream, trace
+    image_ref: str  # blob store reference of the base64 template image
+    image_mime_type: str
     design_analysis: str
     color_palette: Dict[str, Any]
     layout_structure: Dict[str, Any]
     typography: Dict[str, Any]
     images_detected: List[Dict[str, Any]]
+    design_spec: Dict[str, Any]  # compact schema-validated spec used by the codegen prompts instead of the prose analysis
+    extraction_used_defaults: bool  # extraction fell back to default elements; such results are never cached
     html_code: str
     css_code: str
-    refinement_notes: List[str]
+    class_contract: List[str]  # BEM classes shared by parallel HTML/CSS generation
+    refinement_notes: List[str]  # issues found by the quality check, fed to the refinement prompt
+    quality_scores: List[float]  # quality check score after combining and after each refinement
+    best_html_ref: str  # blob store reference of the best-scoring document so far
     iteration_count: int
-    messages: Annotated[List[str], operator.add]
-    progress_log: str
     api_provider: str
-    user_images_base64: Dict[str, str]  # filename: base64 data URI (stored separately, not in LLM context)
+    user_image_refs: Dict[str, str]  # filename: blob store reference of the data URI (not in LLM context)
     user_images_count: int  # Just the count for LLM to know how many images available
\ No newline at end of file
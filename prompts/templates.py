@@ -36,5 +36,24 @@ Extract and provide in JSON format:
    - "purpose": what the image is for (e.g., "hero-background", "team-member", "product-showcase")
    - "size": approximate dimensions (e.g., "large", "medium", "small")
    - "description": brief description of what should be shown
-
-Return ONLY valid JSON, no additional text or markdown code blocks."""
\ No newline at end of file
+6. **style**: One sentence describing the overall design style
+7. **sections**: Array of objects, one per section in page order, with:
+   - "name": section name matching the layout (e.g., "header", "hero")
+   - "content": array of the visible texts in that section (headings, copy, button labels), verbatim
+
+Return ONLY valid JSON, no additional text or markdown code blocks."""
+EXTRACTION_RETRY_PROMPT = """That response is not valid JSON for the requested structure:
+{problems}
+
+Return ONLY the corrected JSON object with the fields colors, typography, layout, spacing, images, style and sections."""
+
+REFINE_PATCH_FORMAT = """Return ONLY a JSON object {"edits": [...]}, no markdown code blocks. Each edit is one of:
+- {"op": "css_rule", "selector": ".hero__title", "declarations": "font-size: 56px; color: #1A1A1A;", "media": "(max-width: 768px)"}: replace or add the CSS rule with exactly this selector ("media" optional)
+- {"op": "css_remove", "selector": ".old", "media": "(max-width: 768px)"}: remove a CSS rule ("media" optional)
+- {"op": "replace_element", "target": "section.hero", "html": "<section class=\\"hero\\">...</section>"}: replace the whole element
+- {"op": "replace_inner", "target": "#pricing", "html": "..."}: replace the element's content
+- {"op": "set_attribute", "target": "a.hero__button", "name": "href", "value": "#signup"}
+- {"op": "insert_before" | "insert_after", "target": ".features", "html": "<section>...</section>"}
+- {"op": "remove_element", "target": ".unused"}
+Targets are simple selectors: tag, .class, #id, tag.class or tag#id. When a target matches several elements, add "index" (0-based) or "all": true.
+Keep every image placeholder token ({{USER_IMAGE_X}}) exactly as it is. Return {"edits": []} if nothing needs to change."""
@@ -0,0 +1,209 @@
+"""
+Batch conversion of many templates through GeneratorService
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Dict, List, Optional
+from PIL import Image
+from services.generator_service import GeneratorService
+from services.scheduler import scheduler
+from utils.export import export_linked_assets
+from utils.rate_limit import per_minute
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".gif", ".bmp"}
+
+
+@dataclass
+class BatchJob:
+    """One template to convert"""
+    name: str
+    template: Path
+    user_images: List[Path] = field(default_factory=list)
+    api_provider: Optional[str] = None
+
+
+def _list_images(folder: Path) -> List[Path]:
+    """Image files directly inside folder, sorted by name"""
+    if not folder or not folder.is_dir():
+        return []
+    return sorted(p for p in folder.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def discover_jobs(input_dir: Path, shared_images_dir: Path = None) -> List[BatchJob]:
+    """
+    One job per image in input_dir. User images come from a sibling folder named
+    after the template (`<stem>/` or `<stem>_images/`), else from shared_images_dir.
+    """
+    shared_images = _list_images(shared_images_dir)
+    jobs = []
+    for template in _list_images(input_dir):
+        own_images = _list_images(input_dir / template.stem) or _list_images(input_dir / f"{template.stem}_images")
+        jobs.append(BatchJob(template.stem, template, own_images or shared_images))
+    return jobs
+
+
+def load_manifest(manifest_path: Path) -> List[BatchJob]:
+    """
+    Read a JSON manifest: a list of {"template": ..., "images": [...], "name": ..., "provider": ...}.
+    Relative paths are resolved against the manifest's folder.
+    """
+    base = manifest_path.parent
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+
+    jobs = []
+    for entry in entries:
+        template = base / entry["template"]
+        jobs.append(BatchJob(
+            name=entry.get("name", template.stem),
+            template=template,
+            user_images=[base / image for image in entry.get("images", [])],
+            api_provider=entry.get("provider"),
+        ))
+    return jobs
+
+
+def _write_atomic(path: Path, text: str):
+    """Write via a temp file so interrupted runs never leave partial outputs"""
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def _export_bundle_atomic(html_code: str, folder: Path):
+    """Export a linked-assets bundle into a temp sibling folder, then rename it into place"""
+    tmp_folder = Path(tempfile.mkdtemp(prefix=f".{folder.name}.", suffix=".tmp", dir=folder.parent))
+    try:
+        export_linked_assets(html_code, tmp_folder)
+        if folder.exists():  # --force, or a bundle left incomplete by an older run
+            old_folder = Path(tempfile.mkdtemp(prefix=f".{folder.name}.", suffix=".old", dir=folder.parent))
+            os.replace(folder, old_folder)
+            shutil.rmtree(old_folder, ignore_errors=True)
+        os.replace(tmp_folder, folder)
+    except BaseException:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        raise
+
+
+class BatchRunner:
+    """Runs batch jobs on a worker pool with per-provider start-rate limits"""
+
+    def __init__(self, output_dir: Path, api_provider: str, workers: int = 4,
+                 rate_limits: Dict[str, float] = None, force: bool = False, linked_assets: bool = False):
+        self.output_dir = Path(output_dir)
+        self.api_provider = api_provider
+        self.workers = workers
+        self.force = force
+        self.linked_assets = linked_assets
+        self._buckets = {provider: per_minute(rpm) for provider, rpm in (rate_limits or {}).items()}
+        self._print_lock = threading.Lock()
+
+    def output_path(self, job: BatchJob) -> Path:
+        if self.linked_assets:
+            return self.output_dir / job.name / "index.html"
+        return self.output_dir / f"{job.name}.html"
+
+    def _log(self, message: str):
+        with self._print_lock:
+            print(message, flush=True)
+
+    def run_job(self, job: BatchJob) -> Dict:
+        """Convert one template and return its summary record"""
+        provider = job.api_provider or self.api_provider
+        output_path = self.output_path(job)
+        record = {"name": job.name, "template": str(job.template), "provider": provider,
+                  "output": str(output_path), "user_images": len(job.user_images)}
+
+        if output_path.exists() and not self.force:
+            record.update(status="skipped", seconds=0.0)
+            return record
+
+        start = time.perf_counter()
+        try:
+            bucket = self._buckets.get(provider)
+            if bucket:
+                bucket.acquire()
+            rate_wait = time.perf_counter() - start
+
+            with Image.open(job.template) as template:
+                template.load()
+                user_images = []
+                for path in job.user_images:
+                    with Image.open(path) as img:
+                        img.load()
+                        user_images.append(img)
+
+                result = GeneratorService.run_job(template, user_images, provider)
+
+            if not result.html_code:
+                record.update(status="failed", error=result.progress_log.strip())
+            else:
+                if self.linked_assets:
+                    output_path.parent.parent.mkdir(parents=True, exist_ok=True)
+                    _export_bundle_atomic(result.html_code, output_path.parent)
+                else:
+                    _write_atomic(output_path, result.html_code)
+                cached = "Loaded result from cache" in result.progress_log
+                record.update(status="cached" if cached else "ok", html_bytes=len(result.html_code.encode("utf-8")))
+            record["rate_limit_wait_seconds"] = round(rate_wait, 3)
+            if result.trace is not None:
+                record["trace"] = {"job_id": result.trace.job_id, "queue_wait_ms": result.trace.queue_wait_ms,
+                                   "nodes": result.trace.node_summary()}
+        except Exception as e:
+            record.update(status="failed", error=str(e))
+
+        record["seconds"] = round(time.perf_counter() - start, 3)
+        return record
+
+    def run(self, jobs: List[BatchJob]) -> Dict:
+        """Run all jobs and write summary.json next to the outputs"""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        # Let the scheduler run every worker at once, on any provider, for the duration of the batch
+        previous_limits = scheduler.limits()
+        scheduler.configure(
+            max_concurrent=max(self.workers, previous_limits["max_concurrent"]),
+            provider_limits={provider: max(limit, self.workers)
+                             for provider, limit in previous_limits["provider_limits"].items()},
+            max_queue_depth=max(len(jobs), previous_limits["max_queue_depth"]),
+        )
+        try:
+            return self._run(jobs)
+        finally:
+            scheduler.configure(**previous_limits)
+
+    def _run(self, jobs: List[BatchJob]) -> Dict:
+        started = time.perf_counter()
+        records = []
+
+        def run_and_report(job: BatchJob) -> Dict:
+            record = self.run_job(job)
+            self._log(f"[{record['status']:>7}] {job.name} ({record['seconds']:.1f}s)"
+                      + (f" - {record['error']}" if record.get("error") else ""))
+            return record
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for record in executor.map(run_and_report, jobs):
+                records.append(record)
+
+        counts = {}
+        for record in records:
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+
+        summary = {
+            "total_jobs": len(jobs),
+            "counts": counts,
+            "wall_seconds": round(time.perf_counter() - started, 3),
+            "workers": self.workers,
+            "jobs": records,
+        }
+        with open(self.output_dir / "summary.json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        return summary
@@ -1,11 +1,55 @@
 """
 Service layer for the Canva to HTML generation process
 """
+import asyncio
+import contextvars
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional
 from models.state import AgentState
-from agents.workflow import create_agent_graph
-from utils.image_utils import image_to_base64, pil_to_base64_data_uri
+from agents.workflow import get_agent_graph
+from utils.image_utils import prepare_template_image, pil_to_base64_data_uri, image_fingerprint
+from utils.llm_factory import default_model
+from utils.blob_store import blob_store
+from utils.image_pipeline import map_images
+from utils.cache import hash_parts, result_cache
+from utils.output_files import write_output, export_output
+from utils.events import emit, open_event_log, close_event_log
+from utils.instrumentation import JobTrace, open_trace, close_trace
+from utils.streaming import open_stream, close_stream
+from services.scheduler import scheduler, QueueFullError
 import config
 
+# State fields stored in the result cache
+CACHED_RESULT_FIELDS = [
+    "html_code", "css_code", "design_analysis", "color_palette",
+    "typography", "layout_structure", "images_detected",
+]
+
+_abandoned_tasks = set()  # graph tasks still running after their consumer went away
+
+
+def _forget_abandoned(task: asyncio.Task):
+    """Drop a finished abandoned graph task; nobody is left to see its error"""
+    _abandoned_tasks.discard(task)
+    if not task.cancelled():
+        task.exception()
+
+
+@dataclass
+class GenerationResult:
+    """Outputs of one job and its trace (None for cache hits and jobs that never started)"""
+    progress_log: str
+    html_code: str = ""
+    design_analysis: str = ""
+    trace: Optional[JobTrace] = None
+
+    def as_tuple(self):
+        """The (progress_log, html_code, design_analysis) outputs shown in the UI"""
+        return self.progress_log, self.html_code, self.design_analysis
+
 
 class GeneratorService:
     """Service class for handling the generation process"""
@@ -13,75 +57,441 @@ class GeneratorService:
     @staticmethod
     def process_image(image, user_images_list, api_provider):
         """Process the uploaded image and generate HTML/CSS with user-provided images"""
+        return GeneratorService.run_job(image, user_images_list, api_provider).as_tuple()
+
+    @staticmethod
+    async def aprocess_image(image, user_images_list, api_provider):
+        """Async variant of process_image: runs the graph on the event loop with ainvoke"""
+        result = await GeneratorService.arun_job(image, user_images_list, api_provider)
+        return result.as_tuple()
+
+    @staticmethod
+    def run_job(image, user_images_list, api_provider) -> GenerationResult:
+        """Run one generation job and return its outputs together with its trace"""
+        error = GeneratorService._check_inputs(image, api_provider)
+        if error:
+            return GenerationResult(error)
+
+        trace = None
+        try:
+            job = GeneratorService._prepare_job(image, user_images_list, api_provider)
+            if job["cached"] is not None:
+                return GenerationResult(*job["cached"])
+
+            ticket = scheduler.submit(api_provider)
+            try:
+                if not scheduler.wait_to_start(ticket, timeout=config.SCHEDULER_MAX_WAIT):
+                    return GenerationResult("Timed out waiting in the job queue. Please try again.")
+                trace = GeneratorService._start_job(job, ticket)
+
+                agent = get_agent_graph()
+                final_state = agent.invoke(job["state"])
+            finally:
+                scheduler.finish(ticket)
+
+            return GeneratorService._finish_job(final_state, job["cache_key"], trace)
+
+        except QueueFullError as e:
+            return GenerationResult(str(e))
+
+        except Exception as e:
+            GeneratorService._end_job(trace, "error")
+            error_msg = f"Error: {str(e)}\n\nPlease check your API keys in environment variables."
+            return GenerationResult(error_msg, trace=trace)
+
+    @staticmethod
+    async def arun_job(image, user_images_list, api_provider) -> GenerationResult:
+        """Async variant of run_job"""
+        error = GeneratorService._check_inputs(image, api_provider)
+        if error:
+            return GenerationResult(error)
+
+        trace = None
+        try:
+            # Image encoding is CPU-bound, keep it off the event loop
+            job = await asyncio.to_thread(GeneratorService._prepare_job, image, user_images_list, api_provider)
+            if job["cached"] is not None:
+                return GenerationResult(*job["cached"])
+
+            ticket = scheduler.submit(api_provider)
+            try:
+                if not await scheduler.await_start(ticket, timeout=config.SCHEDULER_MAX_WAIT):
+                    return GenerationResult("Timed out waiting in the job queue. Please try again.")
+                trace = GeneratorService._start_job(job, ticket)
+
+                agent = get_agent_graph()
+                final_state = await agent.ainvoke(job["state"])
+            finally:
+                scheduler.finish(ticket)
+
+            return GeneratorService._finish_job(final_state, job["cache_key"], trace)
+
+        except QueueFullError as e:
+            return GenerationResult(str(e))
+
+        except Exception as e:
+            GeneratorService._end_job(trace, "error")
+            error_msg = f"Error: {str(e)}\n\nPlease check your API keys in environment variables."
+            return GenerationResult(error_msg, trace=trace)
+
+    @staticmethod
+    def process_image_stream(image, user_images_list, api_provider):
+        """
+        Generator variant of process_image for the UI: yields (progress_log, html_code,
+        design_analysis) while the pipeline runs, including partial LLM tokens.
+        """
+        error = GeneratorService._check_inputs(image, api_provider)
+        if error:
+            yield error, "", ""
+            return
+
+        try:
+            job = GeneratorService._prepare_job(image, user_images_list, api_provider)
+        except Exception as e:
+            yield f"Error: {str(e)}\n\nPlease check your API keys in environment variables.", "", ""
+            return
+        if job["cached"] is not None:
+            yield job["cached"]
+            return
+
+        try:
+            ticket = scheduler.submit(api_provider)
+        except QueueFullError as e:
+            yield str(e), "", ""
+            return
+
+        worker = None
+        trace = None
+        try:
+            while not scheduler.wait_to_start(ticket, timeout=config.SCHEDULER_POLL_INTERVAL):
+                yield GeneratorService._queue_status(ticket), "", ""
+            initial_state = job["state"]
+            stream = open_stream(initial_state["job_id"])
+            trace = GeneratorService._start_job(job, ticket)
+            outcome = {}
+            handoff = threading.Lock()
+
+            def run_graph():
+                try:
+                    for values in get_agent_graph().stream(initial_state, stream_mode="values"):
+                        outcome["final_state"] = values
+                        if outcome.get("abandoned"):
+                            break  # the consumer went away: stop at this step boundary
+                except Exception as e:
+                    outcome["error"] = e
+                finally:
+                    stream.close()
+                    scheduler.finish(ticket)
+                    with handoff:
+                        outcome["done"] = True
+                        abandoned = outcome.get("abandoned", False)
+                    if abandoned:
+                        # The consumer went away mid-run; free the job's blobs now the graph is done with them
+                        GeneratorService._end_job(trace, "cancelled")
+
+            worker = threading.Thread(target=contextvars.copy_context().run, args=(run_graph,), daemon=True)
+            worker.start()
+
+            try:
+                version = -1
+                while not stream.closed:
+                    stream.wait(version, timeout=1.0)
+                    snapshot = stream.snapshot()
+                    if snapshot[0] != version:
+                        version = snapshot[0]
+                        yield snapshot[1:]
+                        time.sleep(config.STREAM_UPDATE_INTERVAL)  # throttle UI updates
+                worker.join()
+            finally:
+                close_stream(initial_state["job_id"])
+
+            if "error" in outcome:
+                GeneratorService._end_job(trace, "error")
+                yield f"Error: {str(outcome['error'])}\n\nPlease check your API keys in environment variables.", "", ""
+            else:
+                yield GeneratorService._finish_job(outcome["final_state"], job["cache_key"], trace).as_tuple()
+
+        finally:
+            # A running worker releases its own slot and ends its job when the graph finishes
+            abandoned = False
+            if worker is not None:
+                with handoff:
+                    abandoned = outcome["abandoned"] = not outcome.get("done", False)
+            if not abandoned:
+                scheduler.finish(ticket)
+                GeneratorService._end_job(trace, "cancelled")  # no-op once the job has finished
+
+    @staticmethod
+    async def aprocess_image_stream(image, user_images_list, api_provider):
+        """Async generator variant of process_image_stream, driving the graph with astream"""
+        error = GeneratorService._check_inputs(image, api_provider)
+        if error:
+            yield error, "", ""
+            return
+
+        try:
+            job = await asyncio.to_thread(GeneratorService._prepare_job, image, user_images_list, api_provider)
+        except Exception as e:
+            yield f"Error: {str(e)}\n\nPlease check your API keys in environment variables.", "", ""
+            return
+        if job["cached"] is not None:
+            yield job["cached"]
+            return
+
+        try:
+            ticket = scheduler.submit(api_provider)
+        except QueueFullError as e:
+            yield str(e), "", ""
+            return
+
+        trace = None
+        outcome = {}
+        try:
+            while not await scheduler.await_start(ticket, timeout=config.SCHEDULER_POLL_INTERVAL):
+                yield GeneratorService._queue_status(ticket), "", ""
+            initial_state = job["state"]
+            stream = open_stream(initial_state["job_id"])
+            trace = GeneratorService._start_job(job, ticket)
+
+            async def run_graph():
+                # Not cancelled when the consumer goes away: a sync node may still be running in an
+                # executor thread, so the graph stops at the next step boundary and ends its own job
+                steps = get_agent_graph().astream(initial_state, stream_mode="values")
+                try:
+                    final_state = None
+                    async for values in steps:
+                        final_state = values
+                        if outcome.get("abandoned"):
+                            break
+                    return final_state
+                finally:
+                    await steps.aclose()
+                    stream.close()
+                    if outcome.get("abandoned"):
+                        scheduler.finish(ticket)
+                        GeneratorService._end_job(trace, "cancelled")
+
+            task = asyncio.create_task(run_graph())
+            try:
+                version = -1
+                while not stream.closed:
+                    await asyncio.sleep(config.STREAM_UPDATE_INTERVAL)
+                    snapshot = stream.snapshot()
+                    if snapshot[0] != version:
+                        version = snapshot[0]
+                        yield snapshot[1:]
+                final_state = await task
+            except Exception as e:
+                GeneratorService._end_job(trace, "error")
+                yield f"Error: {str(e)}\n\nPlease check your API keys in environment variables.", "", ""
+                return
+            finally:
+                # Both sides run on the event loop, so the hand-off needs no lock
+                outcome["abandoned"] = not task.done()
+                if outcome["abandoned"]:
+                    _abandoned_tasks.add(task)  # the loop only keeps weak references to tasks
+                    task.add_done_callback(_forget_abandoned)
+                close_stream(initial_state["job_id"])
+
+            yield GeneratorService._finish_job(final_state, job["cache_key"], trace).as_tuple()
+
+        finally:
+            # A running graph task releases its own slot and ends its job when it stops
+            if not outcome.get("abandoned"):
+                scheduler.finish(ticket)
+                GeneratorService._end_job(trace, "cancelled")  # no-op once the job has finished
+
+    @staticmethod
+    def _queue_status(ticket):
+        """Queue position and ETA message for a waiting job"""
+        return (
+            f"⏳ Waiting in queue: position {scheduler.position(ticket)}, "
+            f"estimated start in ~{scheduler.eta(ticket):.0f}s\n"
+        )
+
+    @staticmethod
+    def _queue_summary(ticket):
+        """Progress line recorded once a job leaves the queue"""
+        return f"Started after {ticket.wait_time:.1f}s in queue"
+
+    @staticmethod
+    def _start_job(job, ticket) -> JobTrace:
+        """Store the job's blobs and open its event log and trace once it leaves the queue"""
+        state = job["state"]
+        GeneratorService._store_blobs(job)
+        open_event_log(state["job_id"])
+        for message in job["intro"]:
+            emit(state["job_id"], message)
+        emit(state["job_id"], GeneratorService._queue_summary(ticket))
+
+        trace = open_trace(state["job_id"], state["api_provider"])
+        trace.queue_wait_ms = ticket.wait_time * 1000
+        return trace
+
+    @staticmethod
+    def _store_blobs(job):
+        """Move the job's image payloads into the blob store and reference them from the state"""
+        state, payloads = job["state"], job["payloads"]
+        state["image_ref"] = blob_store.put(payloads["image"], owner=state["job_id"])
+        state["user_image_refs"] = {
+            filename: blob_store.put(data_uri, owner=state["job_id"])
+            for filename, data_uri in payloads["user_images"].items()
+        }
+
+    @staticmethod
+    def _end_job(trace, status):
+        """Close a started job's trace and event log, free its blobs and return its progress log"""
+        if trace is None:
+            return ""
+        close_trace(trace.job_id, status)
+        blob_store.release(trace.job_id)
+        log = close_event_log(trace.job_id)
+        return log.text() if log is not None else ""
+
+    @staticmethod
+    def _trace_summary(trace):
+        """Progress line summarizing where a finished job spent its time"""
+        nodes = trace.node_summary().values()
+        llm_seconds = sum(node["llm_ms"] for node in nodes) / 1000
+        llm_calls = sum(node["llm_calls"] for node in nodes)
+        tokens = sum(node["prompt_tokens"] + node["response_tokens"] for node in nodes)
+        return (
+            f"Finished in {trace.wall_ms / 1000:.1f}s "
+            f"({llm_calls} LLM calls, {llm_seconds:.1f}s in LLM, ~{tokens} tokens)\n"
+        )
+
+    @staticmethod
+    def _check_inputs(image, api_provider):
+        """Return an error message if the job cannot start, otherwise None"""
         if image is None:
-            return "Please upload a design template image!", "", ""
+            return "Please upload a design template image!"
 
         # Check API keys
         if api_provider == "gemini" and not config.GEMINI_API_KEY:
-            return "GEMINI_API_KEY environment variable is not set!", "", ""
+            return "GEMINI_API_KEY environment variable is not set!"
         elif api_provider == "openrouter" and not config.OPENROUTER_API_KEY:
-            return "OPENROUTER_API_KEY environment variable is not set!", "", ""
+            return "OPENROUTER_API_KEY environment variable is not set!"
 
-        try:
-            # Convert template image to base64
-            image_base64 = image_to_base64(image)
-
-            # Process user-uploaded images - store separately from LLM context
-            user_images_base64 = {}
-            if user_images_list:
-                for idx, img in enumerate(user_images_list):
-                    if img is not None:
-                        # Ensure img is a PIL Image, not a tuple
-                        if isinstance(img, tuple):
-                            img = img[0] if img[0] is not None else img[1]
-
-                        # Generate filename
-                        filename = f"user_image_{idx}"
-                        # Convert to base64 data URI (stored separately, NOT sent to LLM)
-                        data_uri = pil_to_base64_data_uri(img)
-                        user_images_base64[filename] = data_uri
-
-            images_msg = f"🖼️ {len(user_images_base64)} user images ready (will be reused if needed)\n" if user_images_base64 else "⚠️ No user images provided, will use placeholders\n"
-
-            initial_state = {
-                "image_base64": image_base64,
-                "design_analysis": "",
-                "color_palette": {},
-                "layout_structure": {},
-                "typography": {},
-                "images_detected": [],
-                "html_code": "",
-                "css_code": "",
-                "refinement_notes": [],
-                "iteration_count": 0,
-                "messages": [],
-                "progress_log": f"Starting generation process with {api_provider.upper()}...\n{images_msg}",
-                "api_provider": api_provider,
-                "user_images_base64": user_images_base64,  # Stored separately
-                "user_images_count": len(user_images_base64)  # Only count sent to LLM
+        return None
+
+    @staticmethod
+    def _prepare_job(image, user_images_list, api_provider):
+        """Encode the inputs, look up the result cache and build the initial graph state"""
+        # Process user-uploaded images - store separately from LLM context
+        images = {}
+        if user_images_list:
+            for idx, img in enumerate(user_images_list):
+                if img is not None:
+                    # Ensure img is a PIL Image, not a tuple
+                    if isinstance(img, tuple):
+                        img = img[0] if img[0] is not None else img[1]
+
+                    # Generate filename
+                    images[f"user_image_{idx}"] = img
+
+        # Convert to base64 data URIs (stored separately, NOT sent to LLM), across processes
+        data_uris = map_images(pil_to_base64_data_uri, list(images.values()))
+        user_images_base64 = dict(zip(images, data_uris))
+
+        images_msg = f"🖼️ {len(user_images_base64)} user images ready (will be reused if needed)" if user_images_base64 else "⚠️ No user images provided, will use placeholders"
+        intro = [f"Starting generation process with {api_provider.upper()}...", images_msg]
+
+        cache_key = GeneratorService.result_cache_key(image, user_images_base64, api_provider)
+        cached = result_cache.get(cache_key) if config.RESULT_CACHE_ENABLED else None
+        if cached is not None:
+            stats = result_cache.stats()
+            progress_log = "".join(f"{line}\n" for line in intro) + (
+                f"Loaded result from cache (hits: {stats['hits']}, misses: {stats['misses']})\n"
+            )
+            return {
+                "cache_key": cache_key,
+                "cached": (progress_log, cached["html_code"], cached["design_analysis"]),
+                "intro": intro,
+                "state": None,
             }
 
-            agent = create_agent_graph()
-            final_state = agent.invoke(initial_state)
+        # Downscale and encode the template for the vision model
+        image_base64, image_mime_type = prepare_template_image(image)
 
-            progress_log = final_state.get("progress_log", "")
-            html_code = final_state.get("html_code", "")
-            design_analysis = final_state.get("design_analysis", "")
+        initial_state = {
+            "job_id": uuid.uuid4().hex,
+            "image_ref": "",  # set by _store_blobs when the job starts
+            "image_mime_type": image_mime_type,
+            "design_analysis": "",
+            "color_palette": {},
+            "layout_structure": {},
+            "typography": {},
+            "images_detected": [],
+            "design_spec": {},
+            "extraction_used_defaults": False,
+            "html_code": "",
+            "css_code": "",
+            "class_contract": [],
+            "refinement_notes": [],
+            "quality_scores": [],
+            "best_html_ref": "",
+            "iteration_count": 0,
+            "api_provider": api_provider,
+            "user_image_refs": {},  # Stored separately, in the blob store
+            "user_images_count": len(user_images_base64)  # Only count sent to LLM
+        }
 
-            return progress_log, html_code, design_analysis
+        return {
+            "cache_key": cache_key,
+            "cached": None,
+            "intro": intro,
+            "state": initial_state,
+            "payloads": {"image": image_base64, "user_images": user_images_base64},
+        }
 
-        except Exception as e:
-            error_msg = f"Error: {str(e)}\n\nPlease check your API keys in environment variables."
-            return error_msg, "", ""
+    @staticmethod
+    def _finish_job(final_state, cache_key, trace=None) -> GenerationResult:
+        """Store a successful result in the cache, end the job and return the outputs"""
+        # Results built on default design elements are not cached, so the next request asks the model again
+        cacheable = final_state.get("html_code") and not final_state.get("extraction_used_defaults")
+        if config.RESULT_CACHE_ENABLED and cacheable:
+            result_cache.put(cache_key, {field: final_state.get(field) for field in CACHED_RESULT_FIELDS})
+
+        html_code = final_state.get("html_code", "")
+        design_analysis = final_state.get("design_analysis", "")
+
+        progress_log = GeneratorService._end_job(trace, "ok")
+        if trace is not None:
+            progress_log += GeneratorService._trace_summary(trace)
+
+        return GenerationResult(progress_log, html_code, design_analysis, trace)
+
+    @staticmethod
+    def result_cache_key(image, user_images_base64, api_provider):
+        """Content hash of the template pixels, user image set, provider, model and output mode"""
+        return hash_parts(
+            image_fingerprint(image),
+            [hash_parts(data_uri) for data_uri in user_images_base64.values()],
+            api_provider,
+            default_model(api_provider),
+            {
+                "dedupe_images": config.DEDUPE_IMAGES,
+                "responsive_images": config.RESPONSIVE_IMAGES,
+                "slot_sizes": config.USER_IMAGE_SLOT_SIZES,
+                "formats": config.USER_IMAGE_FORMATS,
+                "quality": config.USER_IMAGE_QUALITY,
+                "srcset": config.USER_IMAGE_SRCSET,
+            },
+        )
 
     @staticmethod
     def save_html(html_code):
-        """Save HTML code to a file"""
+        """Save HTML code to a content-hash named file and return its path"""
         if not html_code:
             return None
 
-        output_file = config.OUTPUT_FOLDER / "generated_template.html"
-        with open(output_file, "w", encoding="utf-8") as f:
-            f.write(html_code)
+        output_file = write_output(html_code)
+        return str(output_file)  # Convert Path to string for Gradio
+
+    @staticmethod
+    def export_assets(html_code, as_zip=True):
+        """Export the page as linked assets (index.html, styles.css, images/) in a zip or folder"""
+        if not html_code:
+            return None
 
-        return str(output_file)  # Convert Path to string for Gradio
\ No newline at end of file
+        return str(export_output(html_code, as_zip=as_zip))
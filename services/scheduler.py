@@ -0,0 +1,182 @@
+"""
+Job scheduler for generation requests: global and per-provider concurrency,
+bounded queue, queue position/ETA and wait/run metrics
+"""
+import asyncio
+import itertools
+import math
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+import config
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue is at its depth limit"""
+
+
+@dataclass
+class JobTicket:
+    """A job's place in the scheduler"""
+    job_number: int
+    api_provider: str
+    enqueued_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None
+    finished: bool = False
+
+    @property
+    def wait_time(self) -> float:
+        end = self.started_at if self.started_at is not None else time.monotonic()
+        return end - self.enqueued_at
+
+
+class JobScheduler:
+    """
+    FIFO scheduler. A waiting job starts when a global slot and a slot for its
+    provider are free and no earlier waiting job could take them first.
+    """
+
+    def __init__(self, max_concurrent: int, provider_limits: Dict[str, int], max_queue_depth: int):
+        self.max_concurrent = max_concurrent
+        self.provider_limits = provider_limits
+        self.max_queue_depth = max_queue_depth
+        self._waiting = []
+        self._running: Dict[str, int] = {}
+        self._counter = itertools.count(1)
+        self._changed = threading.Condition()
+
+        # Metrics
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+        self.max_wait = 0.0
+        self.avg_run = config.SCHEDULER_INITIAL_RUN_ESTIMATE  # EMA used for ETAs
+
+    def configure(self, max_concurrent: int = None, provider_limits: Dict[str, int] = None,
+                  max_queue_depth: int = None):
+        """Adjust limits at runtime (e.g. for a batch run)"""
+        with self._changed:
+            if max_concurrent is not None:
+                self.max_concurrent = max_concurrent
+            if provider_limits is not None:
+                self.provider_limits = provider_limits
+            if max_queue_depth is not None:
+                self.max_queue_depth = max_queue_depth
+            self._changed.notify_all()
+
+    def limits(self) -> Dict:
+        """Current limits, as keyword arguments for configure()"""
+        with self._changed:
+            return {"max_concurrent": self.max_concurrent, "provider_limits": dict(self.provider_limits),
+                    "max_queue_depth": self.max_queue_depth}
+
+    def _running_total(self) -> int:
+        return sum(self._running.values())
+
+    def _has_capacity(self, api_provider: str) -> bool:
+        limit = self.provider_limits.get(api_provider, self.max_concurrent)
+        return self._running_total() < self.max_concurrent and self._running.get(api_provider, 0) < limit
+
+    def submit(self, api_provider: str) -> JobTicket:
+        """Enqueue a job, or raise QueueFullError if the queue is full"""
+        with self._changed:
+            if len(self._waiting) >= self.max_queue_depth:
+                self.rejected += 1
+                raise QueueFullError(
+                    f"Server busy: {len(self._waiting)} jobs already queued. Please try again shortly."
+                )
+            ticket = JobTicket(next(self._counter), api_provider)
+            self._waiting.append(ticket)
+            return ticket
+
+    def try_start(self, ticket: JobTicket) -> bool:
+        """Start the job if it is next in line for a free slot"""
+        with self._changed:
+            if ticket.started_at is not None:
+                return True
+            for waiting in self._waiting:
+                if not self._has_capacity(waiting.api_provider):
+                    continue
+                if waiting is not ticket:
+                    return False
+                self._waiting.remove(ticket)
+                ticket.started_at = time.monotonic()
+                self._running[ticket.api_provider] = self._running.get(ticket.api_provider, 0) + 1
+                return True
+            return False
+
+    def wait_to_start(self, ticket: JobTicket, timeout: float) -> bool:
+        """Block up to timeout seconds for the job to start"""
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while not self.try_start(ticket):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+            return True
+
+    async def await_start(self, ticket: JobTicket, timeout: float) -> bool:
+        """Async variant of wait_to_start (polls so the event loop stays free)"""
+        deadline = time.monotonic() + timeout
+        while not self.try_start(ticket):
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(min(config.SCHEDULER_POLL_INTERVAL, timeout))
+        return True
+
+    def finish(self, ticket: JobTicket):
+        """Release the job's slot (or drop it from the queue if it never started)"""
+        with self._changed:
+            if ticket.finished:
+                return
+            ticket.finished = True
+            if ticket.started_at is None:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+            else:
+                self._running[ticket.api_provider] -= 1
+                run_time = time.monotonic() - ticket.started_at
+                self.completed += 1
+                self.total_wait += ticket.wait_time
+                self.total_run += run_time
+                self.max_wait = max(self.max_wait, ticket.wait_time)
+                self.avg_run = 0.8 * self.avg_run + 0.2 * run_time
+            self._changed.notify_all()
+
+    def position(self, ticket: JobTicket) -> int:
+        """1-based position among waiting jobs (0 once started)"""
+        with self._changed:
+            if ticket in self._waiting:
+                return self._waiting.index(ticket) + 1
+            return 0
+
+    def eta(self, ticket: JobTicket) -> float:
+        """Rough seconds until the job starts, from the average run time"""
+        position = self.position(ticket)
+        if position == 0:
+            return 0.0
+        return math.ceil(position / self.max_concurrent) * self.avg_run
+
+    def stats(self) -> Dict[str, float]:
+        """Queue depth, running jobs and wait/run time metrics"""
+        with self._changed:
+            completed = self.completed or 1
+            return {
+                "running": self._running_total(),
+                "waiting": len(self._waiting),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait_seconds": self.total_wait / completed,
+                "avg_run_seconds": self.total_run / completed,
+                "max_wait_seconds": self.max_wait,
+            }
+
+
+scheduler = JobScheduler(
+    max_concurrent=config.MAX_CONCURRENT_JOBS,
+    provider_limits=config.PROVIDER_CONCURRENCY,
+    max_queue_depth=config.MAX_QUEUE_DEPTH,
+)
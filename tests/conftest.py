@@ -0,0 +1,43 @@
+"""
+Shared pytest setup: run from the repository root without API keys or trace files
+"""
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault("TRACE_LOG_FILE", "")
+
+import pytest
+import config
+
+
+@pytest.fixture
+def no_caches(monkeypatch):
+    """Disable the persistent result and stage caches for a test"""
+    monkeypatch.setattr(config, "RESULT_CACHE_ENABLED", False)
+    monkeypatch.setattr(config, "STAGE_CACHE_ENABLED", False)
+
+
+class MemoryCache:
+    """In-memory stand-in for the persistent stage cache"""
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, value):
+        self.entries[key] = value
+
+
+@pytest.fixture
+def stage_cache(monkeypatch):
+    """Enable stage memoization against a fresh in-memory cache"""
+    from agents import workflow
+    cache = MemoryCache()
+    monkeypatch.setattr(config, "STAGE_CACHE_ENABLED", True)
+    monkeypatch.setattr(workflow, "stage_cache", cache)
+    return cache
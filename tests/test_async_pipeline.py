@@ -0,0 +1,65 @@
+"""
+Async execution path: the compiled graph serves ainvoke with the a*_node variants and jobs share one event loop
+"""
+import asyncio
+import time
+import pytest
+from PIL import Image
+from agents import nodes
+from services.generator_service import GeneratorService
+from utils import llm_factory
+import config
+
+
+@pytest.fixture
+def llm_paths(no_caches, monkeypatch):
+    """Record whether each LLM call went through the sync or the async helper"""
+    paths = []
+    call_llm, acall_llm = nodes._call_llm, nodes._acall_llm
+
+    async def arecording(*args, **kwargs):
+        paths.append("async")
+        return await acall_llm(*args, **kwargs)
+
+    monkeypatch.setattr(nodes, "_call_llm", lambda *args, **kwargs: paths.append("sync") or call_llm(*args, **kwargs))
+    monkeypatch.setattr(nodes, "_acall_llm", arecording)
+    return paths
+
+
+@pytest.fixture
+def slow_fake(monkeypatch):
+    """Fake provider with a fixed per-call latency"""
+    monkeypatch.setattr(config, "FAKE_LLM_LATENCY", 0.1)
+    llm_factory.clear_llm_registry()
+    yield
+    llm_factory.clear_llm_registry()
+
+
+def inputs(color="red"):
+    return Image.new("RGB", (64, 48), "white"), [Image.new("RGB", (16, 16), color)]
+
+
+def test_async_job_matches_the_sync_job(llm_paths):
+    sync_result = GeneratorService.run_job(*inputs(), "fake")
+    assert llm_paths and set(llm_paths) == {"sync"}
+    llm_paths.clear()
+
+    async_result = asyncio.run(GeneratorService.arun_job(*inputs(), "fake"))
+    assert llm_paths and set(llm_paths) == {"async"}
+    assert async_result.html_code == sync_result.html_code
+    assert "Error" not in async_result.progress_log
+
+
+def test_concurrent_async_jobs_overlap_their_llm_waits(llm_paths, slow_fake):
+    started = time.perf_counter()
+    asyncio.run(GeneratorService.arun_job(*inputs(), "fake"))
+    one_job = time.perf_counter() - started
+
+    async def three_jobs():
+        return await asyncio.gather(*(GeneratorService.arun_job(*inputs(color), "fake")
+                                      for color in ("red", "green", "blue")))
+
+    started = time.perf_counter()
+    results = asyncio.run(three_jobs())
+    assert all(result.html_code for result in results)
+    assert time.perf_counter() - started < 2 * one_job
@@ -0,0 +1,75 @@
+"""
+Batch runner: atomic linked-assets output, resume behavior and scheduler limits
+"""
+import pytest
+from PIL import Image
+from services import batch_service
+from services.batch_service import BatchJob, BatchRunner
+from services.generator_service import GenerationResult
+from services.scheduler import scheduler
+
+HTML = "<!DOCTYPE html><html><head><style>body { margin: 0; }</style></head><body><p>Hi</p></body></html>"
+
+
+@pytest.fixture
+def template(tmp_path):
+    path = tmp_path / "design.png"
+    Image.new("RGB", (32, 32), "white").save(path)
+    return path
+
+
+@pytest.fixture
+def generated(monkeypatch):
+    monkeypatch.setattr(batch_service.GeneratorService, "run_job",
+                        staticmethod(lambda template, images, provider: GenerationResult("done", HTML)))
+
+
+def test_interrupted_linked_assets_export_leaves_no_output(tmp_path, template, generated, monkeypatch):
+    runner = BatchRunner(tmp_path / "out", "fake", workers=1, linked_assets=True)
+    job = BatchJob("design", template)
+    real_export = batch_service.export_linked_assets
+
+    def interrupted(html_code, destination, as_zip=False):
+        (destination / "index.html").write_text(html_code[:10])
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(batch_service, "export_linked_assets", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        runner.run_job(job)
+    assert not runner.output_path(job).exists()
+    assert list((tmp_path / "out").iterdir()) == []  # temp folder cleaned up
+
+    monkeypatch.setattr(batch_service, "export_linked_assets", real_export)
+    record = runner.run_job(job)
+    assert record["status"] == "ok"
+    assert "styles.css" in runner.output_path(job).read_text()
+    assert runner.run_job(job)["status"] == "skipped"
+
+
+def test_force_replaces_an_existing_bundle(tmp_path, template, generated):
+    runner = BatchRunner(tmp_path / "out", "fake", workers=1, linked_assets=True, force=True)
+    job = BatchJob("design", template)
+    stale = runner.output_path(job).parent / "stale.png"
+    stale.parent.mkdir(parents=True)
+    stale.write_bytes(b"old")
+    assert runner.run_job(job)["status"] == "ok"
+    assert not stale.exists()
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == ["design"]
+
+
+def test_run_raises_provider_limits_to_the_worker_count_and_restores_them(tmp_path, template, monkeypatch):
+    before = scheduler.limits()
+    seen = {}
+
+    def run_job(template_image, images, provider):
+        seen.update(scheduler.limits())
+        return GenerationResult("done", HTML)
+
+    monkeypatch.setattr(batch_service.GeneratorService, "run_job", staticmethod(run_job))
+    runner = BatchRunner(tmp_path / "out", "openrouter", workers=8)
+    summary = runner.run([BatchJob("design", template)])
+
+    assert summary["counts"] == {"ok": 1}
+    assert seen["max_concurrent"] >= 8
+    assert all(limit >= 8 for limit in seen["provider_limits"].values())
+    assert scheduler.limits() == before
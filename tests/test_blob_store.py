@@ -0,0 +1,58 @@
+"""
+Blob store: content addressing, shared ownership and spill-to-disk
+"""
+import os
+import pytest
+from utils import blob_store
+from utils.blob_store import BlobStore
+
+
+def test_identical_blobs_share_a_reference_until_the_last_owner_releases(tmp_path):
+    store = BlobStore(tmp_path, max_memory_bytes=1024)
+    ref = store.put("payload", owner="job-1")
+    assert store.put("payload", owner="job-2") == ref
+    assert store.stats()["blobs"] == 1
+    store.release("job-1")
+    assert store.get(ref) == "payload"
+    store.release("job-2")
+    with pytest.raises(KeyError):
+        store.get(ref)
+    assert store.stats() == {"blobs": 0, "memory_bytes": 0, "on_disk": 0, "spills": 0, "jobs": 0}
+
+
+def test_least_recently_used_blobs_spill_to_disk_and_are_deleted_on_release(tmp_path):
+    store = BlobStore(tmp_path, max_memory_bytes=10)
+    first = store.put("a" * 8, owner="job")
+    second = store.put("b" * 8, owner="job")
+    assert store.stats()["spills"] == 1
+    assert (store.folder / f"{first}.blob").exists()
+    assert store.get(first) == "a" * 8  # read back from disk
+    assert store.get(second) == "b" * 8
+    store.release("job")
+    assert list(store.folder.glob("*.blob")) == []
+
+
+def test_releasing_an_unknown_job_is_a_no_op(tmp_path):
+    store = BlobStore(tmp_path, max_memory_bytes=10)
+    store.release("never-stored")
+    assert store.stats()["jobs"] == 0
+
+
+def test_spills_left_by_exited_processes_are_swept_on_startup(tmp_path, monkeypatch):
+    crashed = tmp_path / "999999"
+    crashed.mkdir()
+    (crashed / "abc.blob").write_text("orphan")
+    restarted = tmp_path / str(os.getpid())  # an earlier process that had our pid
+    restarted.mkdir()
+    (restarted / "def.blob").write_text("orphan")
+    (tmp_path / "legacy.blob").write_text("orphan")
+    running = tmp_path / "4242"
+    running.mkdir()
+    (running / "ghi.blob").write_text("in use")
+    monkeypatch.setattr(blob_store, "_process_alive", lambda pid: pid == 4242)
+
+    store = BlobStore(tmp_path, max_memory_bytes=10)
+    assert store.swept == 3
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["4242"]
+    store.put("a" * 20, owner="job")
+    assert len(list(store.folder.glob("*.blob"))) == 1
@@ -0,0 +1,70 @@
+"""
+Content-addressed LRU cache and the result cache of whole jobs
+"""
+import os
+import time
+from PIL import Image
+from agents import nodes
+from services import generator_service
+from services.generator_service import GeneratorService
+from utils.cache import LRUCache, hash_parts
+import config
+
+
+def test_hash_parts_is_stable_and_length_prefixed():
+    assert hash_parts("ab", "c") != hash_parts("a", "bc")
+    assert hash_parts({"b": 1, "a": 2}) == hash_parts({"a": 2, "b": 1})
+    assert hash_parts(b"x") == hash_parts("x")
+
+
+def test_lru_evicts_least_recently_used_and_counts_hits():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", {"v": 1})
+    cache.put("b", {"v": 2})
+    assert cache.get("a") == {"v": 1}  # "b" is now the least recently used
+    cache.put("c", {"v": 3})
+    assert cache.get("b") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["entries"]) == (1, 1, 1, 2)
+
+
+def test_byte_limit_is_enforced(tmp_path):
+    cache = LRUCache(tmp_path, max_entries=100, max_bytes=40)
+    for index in range(5):
+        cache.put(str(index), {"payload": "x" * 10})
+    assert cache.stats()["bytes"] <= 40
+    assert cache.get("0") is None and cache.get("4") == {"payload": "x" * 10}
+
+
+def test_persisted_entries_survive_a_restart_in_recency_order(tmp_path):
+    cache = LRUCache(tmp_path, max_entries=2)
+    cache.put("old", {"v": 1})
+    cache.put("new", {"v": 2})
+    past = time.time() - 60
+    os.utime(tmp_path / "new.json", (past, past))  # "old" was used more recently
+    restarted = LRUCache(tmp_path, max_entries=2)
+    restarted.put("third", {"v": 3})
+    assert restarted.get("new") is None
+    assert restarted.get("old") == {"v": 1}
+
+
+def test_repeated_job_is_served_from_the_result_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "RESULT_CACHE_ENABLED", True)
+    monkeypatch.setattr(config, "STAGE_CACHE_ENABLED", False)
+    monkeypatch.setattr(generator_service, "result_cache", LRUCache(tmp_path))
+    calls = []
+    call_llm = nodes._call_llm
+    monkeypatch.setattr(nodes, "_call_llm", lambda *args, **kwargs: calls.append(args[2]) or call_llm(*args, **kwargs))
+    template = Image.new("RGB", (64, 48), "white")
+    photos = [Image.new("RGB", (16, 16), "red")]
+
+    first = GeneratorService.run_job(template, photos, "fake")
+    assert first.html_code and calls
+    llm_calls = len(calls)
+    second = GeneratorService.run_job(template, photos, "fake")
+    assert len(calls) == llm_calls  # no LLM calls
+    assert second.html_code == first.html_code
+    assert "Loaded result from cache" in second.progress_log
+
+    GeneratorService.run_job(template, [Image.new("RGB", (16, 16), "blue")], "fake")
+    assert len(calls) > llm_calls  # a different image set is a different key
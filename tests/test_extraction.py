@@ -0,0 +1,51 @@
+"""
+Design element extraction: re-asking on invalid JSON, per-field defaults, no caching of degraded results
+"""
+import json
+import pytest
+from langchain_core.messages import AIMessage
+from agents import nodes, workflow
+from utils.fake_llm import SCRIPTED_RESPONSES
+import config
+
+STATE = {"job_id": None, "design_analysis": "A landing page", "user_images_count": 2, "api_provider": "fake"}
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    """Script the extraction call's answers; returns the list of prompts it received"""
+    prompts = []
+
+    def script(*answers):
+        def call(state, messages, channel, hedge=False, json_mode=False):
+            assert json_mode == config.EXTRACTION_JSON_MODE
+            prompts.append(messages)
+            return AIMessage(content=answers[min(len(prompts), len(answers)) - 1])
+        monkeypatch.setattr(nodes, "_call_llm", call)
+        return prompts
+    return script
+
+
+def test_invalid_json_is_re_asked_once_with_its_errors(responses, stage_cache):
+    prompts = responses("Sorry, I cannot help with that.", "```json\n" + SCRIPTED_RESPONSES["extraction"] + "\n```")
+    update = workflow.memoize_stage("extract_elements", nodes.extract_design_elements_node)(STATE)
+    assert len(prompts) == 2
+    assert "no JSON object or array found" in prompts[1][-1].content
+    assert update["extraction_used_defaults"] is False
+    assert update["color_palette"]["primary"] == "#FF6B35"
+    assert len(update["images_detected"]) == 3
+    assert len(stage_cache.entries) == 1
+
+
+def test_fields_still_invalid_fall_back_to_defaults_and_are_not_cached(responses, stage_cache):
+    elements = json.loads(SCRIPTED_RESPONSES["extraction"])
+    elements["colors"] = "orange"
+    elements["images"].append("not an object")
+    prompts = responses(json.dumps(elements))
+    update = workflow.memoize_stage("extract_elements", nodes.extract_design_elements_node)(STATE)
+    assert len(prompts) == config.EXTRACTION_MAX_ATTEMPTS
+    assert update["extraction_used_defaults"] is True
+    assert update["color_palette"] == nodes.DEFAULT_ELEMENTS["colors"]
+    assert update["typography"] == elements["typography"]  # valid fields are kept
+    assert len(update["images_detected"]) == 3
+    assert stage_cache.entries == {}
@@ -0,0 +1,71 @@
+"""
+Deterministic fake provider: stage recognition, replayed responses and injected failures
+"""
+import asyncio
+import json
+import time
+import pytest
+from langchain_core.messages import HumanMessage
+from utils.fake_llm import SCRIPTED_RESPONSES, FakeChatModel, FakeProviderError, detect_stage
+from utils.llm_factory import initialize_llm
+
+ANALYSIS = [HumanMessage(content=[{"type": "text", "text": "You are an expert design analyst. Describe it."},
+                                  {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA"}}])]
+EXTRACTION = [HumanMessage(content="Extract and provide in JSON format the design elements")]
+REFINE = [HumanMessage(content="Review and refine this HTML/CSS code.\n\nCurrent Code:\n<p>kept</p>\n\nDesign Spec:\n{}")]
+
+
+def test_stage_is_recognized_from_the_prompt():
+    assert detect_stage(ANALYSIS) == "analysis"
+    assert detect_stage(EXTRACTION) == "extraction"
+    assert detect_stage(REFINE) == "refine"
+    assert detect_stage([HumanMessage(content="Hello")]) == "unknown"
+
+
+def test_scripted_responses_are_replayed_on_every_path():
+    model = initialize_llm("fake")
+    assert isinstance(model, FakeChatModel)
+    expected = SCRIPTED_RESPONSES["extraction"]
+    assert model.invoke(EXTRACTION).content == expected
+    assert asyncio.run(model.ainvoke(EXTRACTION)).content == expected
+    assert "".join(chunk.content for chunk in model.stream(EXTRACTION)) == expected
+    assert model.invoke(REFINE).content == "<p>kept</p>"  # full refinement echoes the current code
+    assert model.calls == {"extraction": 3, "refine": 1}
+
+
+def test_recorded_responses_cycle_in_order(tmp_path):
+    recorded = tmp_path / "responses.json"
+    recorded.write_text(json.dumps({"extraction": ["first", "second"], "refine": "<p>recorded</p>"}))
+    model = FakeChatModel(responses_path=str(recorded))
+    assert [model.invoke(EXTRACTION).content for _ in range(3)] == ["first", "second", "first"]
+    assert model.invoke(REFINE).content == "<p>recorded</p>"
+    assert model.invoke(ANALYSIS).content == SCRIPTED_RESPONSES["analysis"]
+
+
+def outcomes(model: FakeChatModel, calls: int):
+    results = []
+    for _ in range(calls):
+        try:
+            model.invoke(EXTRACTION)
+            results.append("ok")
+        except FakeProviderError as e:
+            results.append(e.status_code)
+    return results
+
+
+def test_seeded_failures_are_reproducible():
+    def model():
+        return FakeChatModel(failure_rate=0.5, failure_kinds=["rate_limit", "server_error"], seed="bench")
+
+    first = outcomes(model(), 40)
+    assert first == outcomes(model(), 40)
+    assert {"ok", 429, 503} == set(first)
+
+
+def test_injected_hang_is_cut_short_by_the_bound_timeout():
+    model = FakeChatModel(failure_rate=1.0, failure_kinds=["timeout"], hang_seconds=30)
+    started = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        model.bind(timeout=0.05).invoke(EXTRACTION)
+    assert time.perf_counter() - started < 1
+    assert model.failures == {"timeout": 1}
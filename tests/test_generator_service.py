@@ -0,0 +1,90 @@
+"""
+Streaming generation: a consumer that disconnects mid-run leaves the job to its graph worker
+"""
+import asyncio
+import threading
+import time
+import pytest
+from PIL import Image
+from services import generator_service
+from services.generator_service import GeneratorService
+from utils.blob_store import blob_store
+from utils.streaming import get_stream
+
+
+class BlockingGraph:
+    """Two-step graph stand-in whose first step reads the template blob only once unblocked"""
+
+    def __init__(self):
+        self.proceed = threading.Event()
+        self.result = {}
+
+    def first_step(self, state):
+        get_stream(state["job_id"]).append_progress("graph started\n")
+        self.proceed.wait(timeout=5)
+        try:
+            self.result["image"] = blob_store.get(state["image_ref"])
+        except KeyError as e:
+            self.result["error"] = e
+
+    def stream(self, state, stream_mode):
+        self.first_step(state)
+        yield state
+        self.result["second_step"] = True
+        yield state
+
+    async def astream(self, state, stream_mode):
+        await asyncio.to_thread(self.first_step, state)  # a sync node in an executor thread
+        yield state
+        self.result["second_step"] = True
+        yield state
+
+
+def wait_for_release(jobs_while_running: int):
+    deadline = time.monotonic() + 5
+    while blob_store.stats()["jobs"] >= jobs_while_running and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def graph(no_caches, monkeypatch):
+    graph = BlockingGraph()
+    monkeypatch.setattr(generator_service, "get_agent_graph", lambda: graph)
+    return graph
+
+
+def template():
+    return Image.new("RGB", (32, 32), "white")
+
+
+def test_disconnected_consumer_does_not_free_blobs_under_the_worker(graph):
+    updates = GeneratorService.process_image_stream(template(), None, "fake")
+    for progress_log, _, _ in updates:
+        if "graph started" in progress_log:
+            break
+    updates.close()  # the browser tab went away
+    jobs_while_running = blob_store.stats()["jobs"]
+    graph.proceed.set()
+
+    wait_for_release(jobs_while_running)
+    assert "error" not in graph.result and graph.result["image"]
+    assert "second_step" not in graph.result  # stopped at the next step boundary
+    assert blob_store.stats()["jobs"] == jobs_while_running - 1  # the worker released them afterwards
+
+
+def test_disconnected_async_consumer_does_not_free_blobs_under_the_graph_task(graph):
+    async def scenario():
+        updates = GeneratorService.aprocess_image_stream(template(), None, "fake")
+        async for progress_log, _, _ in updates:
+            if "graph started" in progress_log:
+                break
+        await updates.aclose()  # the browser tab went away
+        jobs_while_running = blob_store.stats()["jobs"]
+        graph.proceed.set()
+        await asyncio.to_thread(wait_for_release, jobs_while_running)
+        return jobs_while_running
+
+    jobs_while_running = asyncio.run(scenario())
+    assert "error" not in graph.result and graph.result["image"]
+    assert "second_step" not in graph.result
+    assert blob_store.stats()["jobs"] == jobs_while_running - 1
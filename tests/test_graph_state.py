@@ -0,0 +1,75 @@
+"""
+Graph state stays constant-size across refinement iterations (fake provider, no API keys)
+"""
+import json
+import pytest
+from PIL import Image
+from agents import nodes, workflow
+from agents.workflow import create_agent_graph
+from services.generator_service import GeneratorService
+from utils.blob_store import blob_store
+from utils.quality import QualityReport
+
+
+def state_size(state) -> int:
+    return len(json.dumps(state, default=str).encode("utf-8"))
+
+
+def run_graph(iterations: int):
+    """Run the graph with `iterations` refinement passes; returns the state sizes after each step"""
+    template = Image.new("RGB", (320, 240), "white")
+    user_images = [Image.new("RGB", (64, 64), color) for color in ("red", "green", "blue")]
+    job = GeneratorService._prepare_job(template, user_images, "fake")
+    GeneratorService._store_blobs(job)
+    state = dict(job["state"])
+    sizes = []
+    try:
+        agent = create_agent_graph(max_refinements=iterations)
+        for update in agent.stream(job["state"], stream_mode="updates"):
+            for output in update.values():
+                state.update(output or {})
+                sizes.append(state_size(state))
+    finally:
+        blob_store.release(job["state"]["job_id"])
+    return state, sizes
+
+
+@pytest.fixture
+def always_improving(monkeypatch):
+    """Quality scores that keep improving without reaching the threshold, so every pass runs"""
+    calls = []
+
+    def check_quality(html_code, images_detected=None, color_palette=None):
+        calls.append(html_code)
+        return QualityReport(checks={"stub": 0.5 + 0.05 * len(calls)}, issues=["stub issue"])
+
+    monkeypatch.setattr(nodes, "check_quality", check_quality)
+
+
+def test_state_size_does_not_grow_with_refinement_iterations(no_caches, always_improving):
+    one_state, one_sizes = run_graph(1)
+    many_state, many_sizes = run_graph(5)
+    assert one_state["iteration_count"] == 1
+    assert many_state["iteration_count"] == 5
+    # Only the per-pass quality score (a float) accumulates
+    assert max(many_sizes) - max(one_sizes) < 100
+    assert "progress_log" not in many_state and "messages" not in many_state
+
+
+def test_regressed_refinement_keeps_the_best_document(no_caches, monkeypatch):
+    checked = []
+    scores = [0.5, 0.7, 0.6]
+
+    def check_quality(html_code, images_detected=None, color_palette=None):
+        checked.append(html_code)
+        return QualityReport(checks={"stub": scores[len(checked) - 1]}, issues=["stub issue"])
+
+    monkeypatch.setattr(nodes, "check_quality", check_quality)
+    monkeypatch.setattr(workflow, "refine_code_node", lambda state: {
+        "html_code": state["html_code"].replace("</body>", f"<p>pass {state['iteration_count'] + 1}</p></body>"),
+        "iteration_count": state["iteration_count"] + 1,
+    })
+    state, _ = run_graph(5)
+    assert state["quality_scores"] == scores
+    assert "pass 1" in checked[1] and "pass 2" in checked[2]
+    assert "pass 1" in state["html_code"] and "pass 2" not in state["html_code"]
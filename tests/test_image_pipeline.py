@@ -0,0 +1,54 @@
+"""
+Slot-sized encoding of user images and the srcset written for their <img> tags
+"""
+import pytest
+from PIL import Image
+from utils.image_pipeline import _decode_data_uri, add_srcset, available_formats, build_variants, slot_targets
+from utils.image_utils import image_to_base64
+import config
+
+
+@pytest.fixture(autouse=True)
+def in_process(monkeypatch):
+    """Encode in the test process; the pool only changes where the work runs"""
+    monkeypatch.setattr(config, "USER_IMAGE_WORKERS", 1)
+    monkeypatch.setattr(config, "USER_IMAGE_FORMATS", ["WEBP", "JPEG"])
+
+
+def data_uri(width: int, height: int) -> str:
+    return "data:image/png;base64," + image_to_base64(Image.effect_noise((width, height), 40).convert("RGB"))
+
+
+def test_each_image_targets_the_largest_slot_it_fills():
+    detected = [
+        {"url": "{{USER_IMAGE_0}}", "size": "small"},
+        {"url": "{{USER_IMAGE_0}}", "size": "Medium"},
+        {"url": "{{USER_IMAGE_1}}", "size": "small"},
+        {"url": "{{IMAGE_PLACEHOLDER_SVG}}", "size": "large"},
+    ]
+    assert slot_targets(detected, 3) == {0: 960, 1: 480, 2: 1600}  # image 2 has no detected slot
+
+
+def test_variants_are_resized_to_their_slot():
+    images = {"hero.png": data_uri(2400, 1200), "icon.png": data_uri(300, 300)}
+    variants = build_variants(images, {0: 960, 1: 480}, srcset=True)
+
+    assert [width for _, width in variants[0]] == [480, 960]
+    large = _decode_data_uri(variants[0][-1][0])
+    assert large.format == available_formats(config.USER_IMAGE_FORMATS)[0] and large.size == (960, 480)
+    assert len(variants[0][-1][0]) < len(images["hero.png"])
+    assert [width for _, width in variants[1]] == [240, 300]  # never upscaled past the original
+
+    single = build_variants(images, {0: 960, 1: 480})
+    assert [len(entries) for entries in single.values()] == [1, 1]
+
+
+def test_srcset_lists_every_variant_and_keeps_the_largest_as_a_token():
+    variants = {0: [("data:image/webp;base64,SMALL", 480), ("data:image/webp;base64,LARGE", 960)],
+                1: [("data:image/webp;base64,ONLY", 300)]}
+    html = '<img src="{{USER_IMAGE_0}}" alt="Hero"><img src="{{USER_IMAGE_1}}"><div style="background: url({{USER_IMAGE_0}})">'
+    assert add_srcset(html, variants) == (
+        '<img src="data:image/webp;base64,SMALL" srcset="data:image/webp;base64,SMALL 480w, {{USER_IMAGE_0}} 960w" '
+        'sizes="(max-width: 960px) 100vw, 960px" alt="Hero"><img src="{{USER_IMAGE_1}}">'
+        '<div style="background: url({{USER_IMAGE_0}})">'
+    )
@@ -0,0 +1,87 @@
+"""
+Template preprocessing for the vision call, image placeholder substitution and shared-image deduplication
+"""
+import base64
+import io
+import pytest
+from PIL import Image
+from utils.image_utils import (DEDUPE_BOOTSTRAP_SCRIPT, PLACEHOLDER_SVG_DATA_URI, dedupe_image_placeholders,
+                               image_to_base64, iter_image_substitutions, prepare_template_image,
+                               replace_image_placeholders)
+
+IMAGES = {"a.png": "data:image/png;base64,AAAA", "b.png": "data:image/png;base64,BBBB"}
+
+
+def test_every_token_is_replaced_in_one_pass():
+    html = '<img src="{{USER_IMAGE_0}}"><img src="{{USER_IMAGE_1}}"><img src="{{USER_IMAGE_0}}"><img src="{{IMAGE_PLACEHOLDER_SVG}}">'
+    assert replace_image_placeholders(html, IMAGES) == (
+        '<img src="data:image/png;base64,AAAA"><img src="data:image/png;base64,BBBB">'
+        f'<img src="data:image/png;base64,AAAA"><img src="{PLACEHOLDER_SVG_DATA_URI}">'
+    )
+
+
+def test_tokens_without_an_uploaded_image_are_left_alone():
+    html = '<img src="{{USER_IMAGE_5}}">'
+    assert replace_image_placeholders(html, IMAGES) == html
+    assert "".join(iter_image_substitutions(html, {})) == html
+
+
+def test_shared_images_are_embedded_once():
+    images = {"a.png": "data:image/png;base64," + "A" * 4000, "b.png": "data:image/png;base64," + "B" * 4000}
+    html = ('<html><head></head><body><img src="{{USER_IMAGE_0}}"><img src="{{USER_IMAGE_1}}">'
+            '<div style="background: url(\'{{USER_IMAGE_0}}\')"></div><img src="{{USER_IMAGE_0}}"></body></html>')
+    deduped, report = dedupe_image_placeholders(html, images)
+    inline = replace_image_placeholders(html, images)
+    final = replace_image_placeholders(deduped, images)
+
+    assert final.count(images["a.png"]) == 1 and final.count(images["b.png"]) == 1
+    assert '--user-image-0: url("' + images["a.png"] in final
+    assert "background: var(--user-image-0)" in final
+    assert final.count('data-user-image="0"') == 2 and DEDUPE_BOOTSTRAP_SCRIPT + "</body>" in final
+    assert report["shared_images"] == 1 and report["shared_references"] == 3
+    assert report["inline_bytes"] == len(inline) and report["deduped_bytes"] == len(final)
+    assert report["bytes_saved"] == len(inline) - len(final) > 7000
+
+
+def test_single_references_stay_inline():
+    html = '<img src="{{USER_IMAGE_0}}"><img src="{{USER_IMAGE_1}}">'
+    deduped, report = dedupe_image_placeholders(html, IMAGES)
+    assert deduped == html
+    assert report["shared_images"] == 0 and report["bytes_saved"] == 0
+
+
+def decode(payload: str) -> Image.Image:
+    return Image.open(io.BytesIO(base64.b64decode(payload)))
+
+
+@pytest.fixture
+def canva_export():
+    """A 4K-wide RGBA export carrying EXIF metadata"""
+    image = Image.new("RGBA", (4000, 2000), (255, 0, 0, 0))
+    image.paste((0, 0, 255, 255), (0, 0, 2000, 2000))
+    exif = Image.Exif()
+    exif[0x010F] = "Camera maker"
+    image.info["exif"] = exif.tobytes()
+    return image
+
+
+def test_template_is_downscaled_flattened_and_stripped(canva_export):
+    payload, mime_type = prepare_template_image(canva_export, max_edge=1568, format="JPEG", quality=85,
+                                                full_fidelity=False)
+    prepared = decode(payload)
+    assert mime_type == "image/jpeg" and prepared.format == "JPEG"
+    assert prepared.size == (1568, 784)
+    assert prepared.getpixel((1500, 400))[:3] == pytest.approx((255, 255, 255), abs=8)  # transparency on white
+    assert not prepared.getexif()
+    assert len(payload) < len(image_to_base64(canva_export))
+
+
+def test_full_fidelity_keeps_the_original_png(canva_export):
+    payload, mime_type = prepare_template_image(canva_export, full_fidelity=True)
+    assert mime_type == "image/png"
+    assert decode(payload).size == (4000, 2000)
+
+
+def test_unknown_format_falls_back_to_png(canva_export):
+    payload, mime_type = prepare_template_image(canva_export, max_edge=800, format="BMP", full_fidelity=False)
+    assert mime_type == "image/png" and decode(payload).size == (800, 400)
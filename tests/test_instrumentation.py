@@ -0,0 +1,32 @@
+"""
+Job trace export: opt-in JSONL log with size-based rotation
+"""
+import json
+from utils.instrumentation import close_trace, open_trace
+import config
+
+
+def finish_job(job_id: str):
+    open_trace(job_id, "fake")
+    close_trace(job_id, "ok")
+
+
+def test_traces_are_not_written_by_default(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "TRACE_LOG_FILE", None)
+    monkeypatch.chdir(tmp_path)
+    finish_job("job-default")
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_trace_log_rotates_at_its_size_limit(tmp_path, monkeypatch):
+    path = tmp_path / "logs" / "traces.jsonl"
+    monkeypatch.setattr(config, "TRACE_LOG_FILE", str(path))
+    monkeypatch.setattr(config, "TRACE_LOG_MAX_BYTES", 1)  # every write finds the file full
+    monkeypatch.setattr(config, "TRACE_LOG_BACKUPS", 2)
+    for index in range(4):
+        finish_job(f"job-{index}")
+
+    assert sorted(p.name for p in path.parent.iterdir()) == ["traces.jsonl", "traces.jsonl.1", "traces.jsonl.2"]
+    job_ids = [json.loads(p.read_text())["job_id"] for p in (path, path.with_name("traces.jsonl.1"),
+                                                             path.with_name("traces.jsonl.2"))]
+    assert job_ids == ["job-3", "job-2", "job-1"]
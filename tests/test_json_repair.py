@@ -0,0 +1,45 @@
+"""
+Tolerant JSON parsing of model output
+"""
+import pytest
+from utils.json_repair import JSONRepairError, loads_tolerant, repair_json
+
+
+def test_valid_json_is_parsed_without_repair():
+    assert loads_tolerant('  {"a": [1, 2.5, null]}  ') == ({"a": [1, 2.5, None]}, False)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('Here you go:\n```json\n{"a": [1, 2,], "b": {"c": 1},}\n```\nThanks', {"a": [1, 2], "b": {"c": 1}}),
+    ("{'colors': {'primary': '#fff'}, 'ok': True, 'n': None}", {"colors": {"primary": "#fff"}, "ok": True, "n": None}),
+    ('{"a": 1 "b": 2}', {"a": 1, "b": 2}),
+    ('{"a": "line\nbreak", "b": "it\'s"}', {"a": "line\nbreak", "b": "it's"}),
+    ('{unquoted: 1, // comment\n /* block */ "x": [true, false]}', {"unquoted": 1, "x": [True, False]}),
+    ('{"path": "C:\\d"}', {"path": "C:\\d"}),
+    ('{"a": 1, "b"}', {"a": 1, "b": None}),
+    ('{"a": }', {"a": None}),
+])
+def test_common_model_mistakes_are_repaired(text, expected):
+    value, repaired = loads_tolerant(text)
+    assert repaired
+    assert value == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"colors": {"primary": "#FF6B35", "secondary": "#F7', {"colors": {"primary": "#FF6B35", "secondary": "#F7"}}),
+    ('{"images": [{"location": "hero"}, {"location"', {"images": [{"location": "hero"}, {}]}),
+    ('{"a": 1, "b": ', {"a": 1}),
+    ("[1, 2, [3", [1, 2, [3]]),
+    ("{", {}),
+])
+def test_truncated_output_keeps_complete_values(text, expected):
+    assert loads_tolerant(text)[0] == expected
+
+
+def test_text_after_the_value_is_ignored():
+    assert repair_json('{"a": 1} and also {"b": 2}') == '{"a":1}'
+
+
+def test_text_without_json_raises():
+    with pytest.raises(JSONRepairError):
+        loads_tolerant("Sorry, I cannot help with that.")
@@ -0,0 +1,340 @@
+"""
+Circuit breaker transitions, attempt bookkeeping and hedging of the resilient LLM call layer
+"""
+import asyncio
+import dataclasses
+import sys
+import threading
+import time
+import types
+from concurrent.futures import Future, ThreadPoolExecutor
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from utils import llm_call, llm_factory
+from utils.fake_llm import FakeChatModel, FakeProviderError
+from utils.llm_call import CircuitBreaker, HedgeLost, _Call, _acall_provider, _call_provider, call_llm
+import config
+
+MESSAGES = [HumanMessage(content="hello")]
+
+
+class ScriptedModel:
+    """Model whose calls run the given functions in turn (the last one repeats)"""
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+        self.calls = 0
+
+    def bind(self, **kwargs):
+        return self
+
+    def invoke(self, messages, **kwargs):
+        step = self.steps[min(self.calls, len(self.steps) - 1)]
+        self.calls += 1
+        return step()
+
+
+def answer():
+    return AIMessage(content="ok")
+
+
+def server_error():
+    raise FakeProviderError(503, "unavailable")
+
+
+def bad_request():
+    raise FakeProviderError(400, "bad request")
+
+
+def json_mode_refused():
+    raise FakeProviderError(400, "Unknown field for GenerationConfig: response_mime_type")
+
+
+class JsonRefusingModel(ScriptedModel):
+    """Answers normally, but its JSON-mode binding is refused by the provider"""
+
+    def bind(self, **kwargs):
+        return ScriptedModel(json_mode_refused) if "response_format" in kwargs else self
+
+
+@pytest.fixture(autouse=True)
+def fresh_guards(monkeypatch):
+    llm_call.reset_guards()
+    monkeypatch.setattr(config, "LLM_BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(config, "LLM_FALLBACK_ENABLED", False)
+    monkeypatch.setattr(config, "HEDGE_ENABLED", False)
+    monkeypatch.setattr(llm_factory, "_json_mode_rejected", set())
+    yield
+    llm_call.reset_guards()
+
+
+def half_open_breaker(cooldown: float = 0.01) -> CircuitBreaker:
+    """The fake provider's breaker, opened and past its cooldown"""
+    breaker = llm_call.get_guard("fake").breaker = CircuitBreaker(1, cooldown)
+    assert breaker.record_failure()
+    time.sleep(cooldown * 2)
+    assert breaker.state == "half_open"
+    return breaker
+
+
+def test_breaker_opens_after_threshold_and_closes_on_success():
+    breaker = CircuitBreaker(2, 60)
+    assert not breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    assert breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_half_open_lets_one_trial_through_and_failure_reopens():
+    breaker = half_open_breaker()
+    assert breaker.allow()
+    assert not breaker.allow()  # only one trial at a time
+    assert breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+
+
+def test_non_retryable_trial_error_releases_the_trial(monkeypatch):
+    breaker = half_open_breaker()
+    monkeypatch.setattr(llm_call, "get_llm", lambda provider: ScriptedModel(bad_request))
+    with pytest.raises(FakeProviderError):
+        call_llm(MESSAGES, "fake")
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def test_cancelled_hedge_branch_releases_the_trial(monkeypatch):
+    breaker = half_open_breaker()
+
+    def slow_failure():
+        time.sleep(0.2)
+        server_error()
+
+    monkeypatch.setattr(llm_call, "get_llm", lambda provider: ScriptedModel(slow_failure))
+    loser = _Call(MESSAGES, None, None)
+    result = {}
+
+    def run():
+        try:
+            _call_provider(loser, "fake")
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    time.sleep(0.05)
+    loser.cancelled.set()  # the other provider answered first
+    thread.join(timeout=5)
+    assert isinstance(result["error"], HedgeLost)
+    assert breaker.allow()
+
+
+def test_cancelled_async_trial_releases_the_trial(monkeypatch):
+    breaker = half_open_breaker()
+    monkeypatch.setattr(llm_call, "get_llm", lambda provider: FakeChatModel(latency=5.0))
+
+    async def cancel_midway():
+        task = asyncio.create_task(_acall_provider(_Call(MESSAGES, None, None), "fake"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_midway())
+    assert breaker.allow()
+
+
+def test_transient_errors_are_retried(monkeypatch):
+    model = ScriptedModel(server_error, server_error, answer)
+    monkeypatch.setattr(llm_call, "get_llm", lambda provider: model)
+    assert call_llm(MESSAGES, "fake").content == "ok"
+    assert model.calls == 3
+    assert llm_call.get_guard("fake").breaker.state == "closed"
+
+
+def test_attempt_timeout_starts_when_the_attempt_starts(monkeypatch):
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(llm_call, "_attempt_pool", pool)
+    monkeypatch.setattr(config, "LLM_ATTEMPT_TIMEOUT", 0.2)
+    monkeypatch.setattr(config, "LLM_MAX_RETRIES", 0)
+    monkeypatch.setattr(llm_call, "get_llm", lambda provider: ScriptedModel(answer))
+    pool.submit(time.sleep, 0.3)  # the only worker is busy longer than the attempt timeout
+    assert call_llm(MESSAGES, "fake").content == "ok"
+    pool.shutdown()
+
+
+class LatePool:
+    """Executor whose worker takes each attempt (so it can't be cancelled) but runs it only after `delay`"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_running_or_notify_cancel()
+
+        def run():
+            time.sleep(self.delay)
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+
+def test_attempt_picked_up_after_the_deadline_fails_instead_of_hanging(monkeypatch):
+    breaker = half_open_breaker()
+    monkeypatch.setattr(llm_call, "_attempt_pool", LatePool(0.3))
+    monkeypatch.setattr(config, "LLM_CALL_DEADLINE", 0.1)
+    monkeypatch.setattr(llm_call, "get_llm", lambda provider: ScriptedModel(answer))
+    result = {}
+
+    def run():
+        try:
+            call_llm(MESSAGES, "fake")
+        except Exception as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert isinstance(result["error"], llm_call.CallDeadlineExceeded)
+    assert breaker.allow()  # the trial never reached the provider
+
+
+def test_abandoned_attempt_is_bounded_by_the_client_timeout(monkeypatch):
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(llm_call, "_attempt_pool", pool)
+    monkeypatch.setattr(config, "LLM_ATTEMPT_TIMEOUT", 0.1)
+    monkeypatch.setattr(config, "LLM_MAX_RETRIES", 0)
+    hanging = FakeChatModel(failure_rate=1.0, failure_kinds=["timeout"], hang_seconds=30.0)
+    monkeypatch.setattr(llm_call, "get_llm", lambda provider: hanging)
+    with pytest.raises(TimeoutError):
+        call_llm(MESSAGES, "fake")
+    started = time.perf_counter()
+    pool.submit(lambda: None).result(timeout=5)  # the worker was freed, not held for 30s
+    assert time.perf_counter() - started < 1.0
+    pool.shutdown()
+
+
+def test_rejected_json_mode_is_retried_once_without_it(monkeypatch):
+    model = JsonRefusingModel(answer)
+    monkeypatch.setattr(llm_call, "get_llm", lambda provider: model)
+    assert call_llm(MESSAGES, "fake", json_mode=True).content == "ok"
+    assert model.calls == 1
+    assert not llm_factory.supports_json_mode("fake")  # later calls skip the option
+    assert llm_call.get_guard("fake").breaker.state == "closed"
+
+
+@pytest.mark.parametrize("fields, supported", [(["temperature"], False), (["temperature", "response_mime_type"], True)])
+def test_gemini_json_mode_is_feature_detected(monkeypatch, fields, supported):
+    generation_types = types.ModuleType("google.generativeai.types")
+    generation_types.GenerationConfig = dataclasses.make_dataclass("GenerationConfig", fields)
+    for name in ("google", "google.generativeai"):
+        monkeypatch.setitem(sys.modules, name, types.ModuleType(name))
+    monkeypatch.setitem(sys.modules, "google.generativeai.types", generation_types)
+    assert llm_factory.supports_json_mode("gemini") is supported
+
+
+class SlowModel:
+    """Primary provider that answers only after `latency`, noting whether its async call was cancelled"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.cancelled = False
+
+    def bind(self, **kwargs):
+        return self
+
+    def invoke(self, messages, **kwargs):
+        time.sleep(self.latency)
+        return AIMessage(content="slow")
+
+    async def ainvoke(self, messages, **kwargs):
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return AIMessage(content="slow")
+
+
+class TimedModel(ScriptedModel):
+    """Secondary provider answering at once, remembering when it was called"""
+
+    def __init__(self):
+        super().__init__(answer)
+        self.called_at = []
+
+    def invoke(self, messages, **kwargs):
+        self.called_at.append(time.perf_counter())
+        return super().invoke(messages, **kwargs)
+
+    async def ainvoke(self, messages, **kwargs):
+        return self.invoke(messages, **kwargs)
+
+
+@pytest.fixture
+def hedging(monkeypatch):
+    """Hedge gemini calls to openrouter once gemini is slower than its observed p90 of ~50ms"""
+    monkeypatch.setattr(config, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(config, "OPENROUTER_API_KEY", "key")
+    monkeypatch.setattr(config, "LLM_FALLBACK_PROVIDERS", {"gemini": "openrouter"})
+    monkeypatch.setattr(config, "HEDGE_INITIAL_DELAY", 30.0)  # never reached once enough samples exist
+    monkeypatch.setattr(config, "HEDGE_MIN_DELAY", 0.01)
+    histogram = llm_call.get_guard("gemini").latency_histogram("css")
+    for _ in range(config.HEDGE_MIN_SAMPLES):
+        histogram.observe(0.05)
+    records = []
+    monkeypatch.setattr(llm_call, "record_llm_call",
+                        lambda provider, error=None, **kwargs: records.append((provider, error)))
+
+    def providers(primary, secondary):
+        monkeypatch.setattr(llm_call, "get_llm", {"gemini": primary, "openrouter": secondary}.get)
+        return records
+
+    return providers
+
+
+def test_hedge_delay_uses_the_latency_histogram_once_it_has_enough_samples(hedging):
+    assert 0.04 <= llm_call.hedge_delay("gemini", "css") <= 0.06
+    assert llm_call.hedge_delay("gemini", "html") == 30.0  # no samples on this channel yet
+
+
+def test_slow_primary_is_hedged_after_the_threshold_and_loses(hedging):
+    primary, secondary = SlowModel(1.0), TimedModel()
+    records = hedging(primary, secondary)
+    started = time.perf_counter()
+    assert call_llm(MESSAGES, "gemini", channel="css", hedge=True).content == "ok"
+    assert 0.04 <= secondary.called_at[0] - started < 0.5
+    assert ("openrouter", None) in records
+    assert ("gemini", "HedgeLost: openrouter answered first") in records
+    assert llm_call.get_guard("gemini").breaker.state == "closed"
+
+
+def test_fast_primary_is_not_hedged(hedging):
+    secondary = TimedModel()
+    hedging(ScriptedModel(answer), secondary)
+    assert call_llm(MESSAGES, "gemini", channel="css", hedge=True).content == "ok"
+    assert secondary.calls == 0
+
+
+def test_async_hedge_cancels_the_losing_primary(hedging):
+    primary, secondary = SlowModel(5.0), TimedModel()
+    records = hedging(primary, secondary)
+
+    async def hedged():
+        started = time.perf_counter()
+        response = await llm_call.acall_llm(MESSAGES, "gemini", channel="css", hedge=True)
+        await asyncio.sleep(0)  # let the cancellation reach the losing task
+        return response, time.perf_counter() - started
+
+    response, elapsed = asyncio.run(hedged())
+    assert response.content == "ok" and elapsed < 1.0
+    assert primary.cancelled
+    assert ("gemini", "HedgeLost: openrouter answered first") in records
+    assert llm_call.get_guard("gemini").breaker.allow()
@@ -0,0 +1,38 @@
+"""
+Pooled provider clients: shared HTTP pools are closed when the registry is cleared
+"""
+import asyncio
+import pytest
+from utils import llm_factory
+
+
+@pytest.fixture
+def http_clients():
+    llm_factory.clear_llm_registry()
+    clients = llm_factory._get_http_clients()
+    yield clients
+    llm_factory.clear_llm_registry()
+
+
+def test_clear_closes_both_pools(http_clients):
+    http_client, http_async_client = http_clients
+    llm_factory.clear_llm_registry()
+    assert http_client.is_closed and http_async_client.is_closed
+    assert llm_factory._get_http_clients()[1] is not http_async_client
+
+
+def test_clear_inside_an_event_loop_schedules_the_async_close(http_clients):
+    _, http_async_client = http_clients
+
+    async def clear():
+        llm_factory.clear_llm_registry()
+        await asyncio.sleep(0.01)
+
+    asyncio.run(clear())
+    assert http_async_client.is_closed
+
+
+def test_async_clear_awaits_the_close(http_clients):
+    http_client, http_async_client = http_clients
+    asyncio.run(llm_factory.aclear_llm_registry())
+    assert http_client.is_closed and http_async_client.is_closed
@@ -0,0 +1,58 @@
+"""
+Content-addressed output files: identical saves reuse the file, retention evicts old outputs
+"""
+import os
+import time
+from utils import output_files
+from utils.output_files import OUTPUT_PREFIX, enforce_retention, export_output, write_output
+import config
+
+HTML = "<!DOCTYPE html><html><body><p>Hi</p></body></html>"
+
+
+def test_identical_saves_reuse_the_existing_file(tmp_path):
+    path = write_output(HTML, tmp_path)
+    assert path.name.startswith(OUTPUT_PREFIX) and path.read_text() == HTML
+    old = time.time() - 600
+    os.utime(path, (old, old))
+    inode = path.stat().st_ino
+
+    assert write_output(HTML, tmp_path) == path
+    assert path.stat().st_ino == inode  # not rewritten and renamed over
+    assert path.stat().st_mtime > old + 1  # but marked recent for retention
+    assert write_output(HTML + " ", tmp_path) != path
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_retention_evicts_old_outputs_and_stale_temp_files(tmp_path):
+    old = write_output("old", tmp_path)
+    new = write_output("new", tmp_path)
+    stale_temp = tmp_path / ".abc.html.tmp"
+    stale_temp.write_text("partial")
+    for path in (old, stale_temp):
+        os.utime(path, (time.time() - 7200, time.time() - 7200))
+    enforce_retention(tmp_path, max_age=3600, max_bytes=0)
+    assert sorted(tmp_path.iterdir()) == [new]
+
+
+def test_output_removed_by_a_concurrent_retention_pass_is_written_again(tmp_path, monkeypatch):
+    path = write_output(HTML, tmp_path)
+    real_utime = os.utime
+
+    def retention_got_there_first(target, *args, **kwargs):
+        if target == path and path.exists():
+            path.unlink()
+        return real_utime(target, *args, **kwargs)
+
+    monkeypatch.setattr(output_files.os, "utime", retention_got_there_first)
+    assert write_output(HTML, tmp_path) == path
+    assert path.read_text() == HTML
+
+
+def test_retention_never_evicts_the_output_just_saved(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "OUTPUT_RETENTION_MAX_BYTES", 1)
+    path = write_output(HTML, tmp_path)
+    assert path.exists()
+    assert write_output(HTML, tmp_path).exists()
+    bundle = export_output(HTML, tmp_path, as_zip=True)
+    assert bundle.exists() and not path.exists()  # older outputs still go
@@ -0,0 +1,94 @@
+"""
+Refinement patch engine: element and CSS edits, validation and response parsing
+"""
+import pytest
+from utils.patching import PatchError, apply_patches, find_elements, parse_patch_response
+
+DOCUMENT = """<!DOCTYPE html>
+<html>
+<head>
+<style>
+.hero { color: #000; }
+@media (max-width: 768px) { .hero { padding: 8px; } }
+</style>
+</head>
+<body>
+<section class="hero" id="top"><h1 class="hero__title">Title</h1><img src="{{USER_IMAGE_0}}" alt=""></section>
+<article class="card">One</article>
+<article class="card">Two</article>
+</body>
+</html>"""
+
+
+def test_replace_inner_and_replace_element():
+    html = apply_patches(DOCUMENT, [
+        {"op": "replace_inner", "target": "h1.hero__title", "html": "New <em>title</em>"},
+        {"op": "replace_element", "target": "article", "index": 1, "html": "<aside>Two</aside>"},
+    ])
+    assert '<h1 class="hero__title">New <em>title</em></h1>' in html
+    assert "<aside>Two</aside>" in html and "<article class=\"card\">Two</article>" not in html
+
+
+def test_insert_and_remove():
+    html = apply_patches(DOCUMENT, [
+        {"op": "insert_after", "target": "#top", "html": "<nav>Menu</nav>"},
+        {"op": "insert_before", "target": "section", "html": "<header>Brand</header>"},
+        {"op": "remove_element", "target": ".card", "all": True},
+    ])
+    assert '<header>Brand</header><section class="hero"' in html
+    assert "</section><nav>Menu</nav>" in html
+    assert "article" not in html
+
+
+def test_set_attribute_escapes_the_value():
+    html = apply_patches(DOCUMENT, [{"op": "set_attribute", "target": "#top", "name": "data-x", "value": 'a"b'}])
+    assert '<section class="hero" id="top" data-x="a&quot;b">' in html
+
+
+def test_css_rule_replaces_adds_and_removes():
+    html = apply_patches(DOCUMENT, [
+        {"op": "css_rule", "selector": ".hero", "declarations": "color: #fff;"},
+        {"op": "css_rule", "selector": ".hero", "media": "(max-width: 768px)", "declarations": "padding: 4px;"},
+        {"op": "css_rule", "selector": ".card", "declarations": "margin: 0;"},
+    ])
+    assert ".hero { color: #fff; }" in html
+    assert "@media (max-width: 768px) { .hero { padding: 4px; } }" in html
+    assert ".card { margin: 0; }" in html
+    html = apply_patches(html, [{"op": "css_remove", "selector": ".card"}])
+    assert ".card" not in html.split("</style>")[0]
+
+
+@pytest.mark.parametrize("edit, message", [
+    ({"op": "replace_inner", "target": ".missing", "html": "x"}, "no element matches"),
+    ({"op": "replace_inner", "target": "article", "html": "x"}, "matches 2 elements"),
+    ({"op": "replace_inner", "target": "article", "index": 5, "html": "x"}, "no match at index 5"),
+    ({"op": "replace_inner", "target": "div > p", "html": "x"}, "unsupported selector"),
+    ({"op": "replace_inner", "target": "#top", "html": "<div>unclosed"}, "malformed"),
+    ({"op": "remove_element", "target": "img"}, "image placeholders"),
+    ({"op": "css_rule", "selector": ".hero", "declarations": "} body {"}, "must not contain braces"),
+    ({"op": "css_remove", "selector": ".missing"}, "no CSS rule"),
+    ({"op": "rewrite"}, "unknown op"),
+])
+def test_invalid_edits_raise_patch_error(edit, message):
+    with pytest.raises(PatchError, match=message):
+        apply_patches(DOCUMENT, [edit])
+
+
+@pytest.mark.parametrize("separator", ["\r", "\u2028", "\x0b", "\x85", "\r\n"])
+def test_offsets_survive_non_newline_line_separators(separator):
+    html = f'<body>\n<p>a{separator}b</p>\n<div class="t">old</div>\n</body>'
+    patched = apply_patches(html, [{"op": "replace_inner", "target": ".t", "html": "new"}])
+    assert patched == html.replace(">old<", ">new<")
+    element = find_elements(html, "div.t")[0]
+    assert html[element.start:element.inner_start] == '<div class="t">'
+
+
+def test_parse_patch_response_accepts_fenced_and_bare_lists():
+    assert parse_patch_response('```json\n{"edits": [{"op": "css_remove", "selector": ".a"}]}\n```') == [
+        {"op": "css_remove", "selector": ".a"}]
+    assert parse_patch_response('[{"op": "remove_element", "target": "p"},]') == [
+        {"op": "remove_element", "target": "p"}]
+    with pytest.raises(PatchError):
+        parse_patch_response("I could not find anything to change.")
+    with pytest.raises(PatchError):
+        parse_patch_response('{"changes": []}')
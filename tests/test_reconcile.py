@@ -0,0 +1,48 @@
+"""
+Class-contract reconciliation of HTML and CSS generated in parallel
+"""
+from agents.nodes import combine_code_node, quality_check_node
+from utils.html_utils import prune_css_classes, reconcile_classes
+
+CONTRACT = ["page", "hero", "hero__title", "hero__text", "footer", "footer__text"]
+HTML = '<main class="page"><section class="hero"><h1 class="hero__title">Hi</h1><p class="hero-copy">x</p></section></main>'
+CSS = """.page { margin: 0; }
+.hero, .footer { padding: 8px; }
+.hero__title { font-size: 2rem; }
+/* never used */
+.hero__text { color: #333; }
+@media (max-width: 768px) { .footer__text { display: none; } }
+@font-face { font-family: Brand; src: url(brand.woff2); }"""
+
+
+def test_reconcile_prunes_unused_contract_rules_and_reports_off_contract_classes():
+    css, unused, off_contract = reconcile_classes(HTML, CSS, CONTRACT)
+    assert unused == ["footer", "footer__text", "hero__text"]
+    assert off_contract == ["hero-copy"]
+    assert ".hero {" in css and ".footer" not in css
+    assert ".hero__text" not in css and "@media" not in css
+    assert ".page { margin: 0; }" in css and ".hero__title { font-size: 2rem; }" in css
+    assert "@font-face" in css
+
+
+def test_prune_keeps_rules_when_nothing_matches():
+    assert prune_css_classes(CSS, set()) == CSS
+    assert prune_css_classes(".a:not(.b) { x: 1; }", {"b"}) == ""
+
+
+def test_combine_reconciles_and_carries_notes_into_the_first_refinement():
+    state = {"job_id": None, "html_code": HTML, "css_code": CSS, "class_contract": CONTRACT, "refinement_notes": []}
+    update = combine_code_node(state)
+    assert ".hero__text" not in update["html_code"] and ".hero__title" in update["html_code"]
+    assert update["refinement_notes"] == ["HTML classes outside the class contract have no CSS rules: hero-copy"]
+
+    checked = quality_check_node({**state, **update, "quality_scores": []})
+    assert checked["refinement_notes"][0] == update["refinement_notes"][0]
+    assert any("HTML classes without CSS rules" in note for note in checked["refinement_notes"])
+    later = quality_check_node({**state, **update, **checked})
+    assert update["refinement_notes"][0] not in later["refinement_notes"]
+
+
+def test_combine_without_contract_leaves_css_alone():
+    state = {"job_id": None, "html_code": HTML, "css_code": CSS, "class_contract": []}
+    assert ".footer__text" in combine_code_node(state)["html_code"]
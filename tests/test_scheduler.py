@@ -0,0 +1,79 @@
+"""
+Job scheduler: concurrency caps, FIFO order, bounded queue and runtime limits
+"""
+import asyncio
+import threading
+import pytest
+from services.scheduler import JobScheduler, QueueFullError
+
+
+def make_scheduler(**overrides) -> JobScheduler:
+    limits = {"max_concurrent": 2, "provider_limits": {"openrouter": 1}, "max_queue_depth": 3}
+    limits.update(overrides)
+    return JobScheduler(**limits)
+
+
+def test_provider_and_global_caps():
+    scheduler = make_scheduler()
+    first, second = scheduler.submit("openrouter"), scheduler.submit("openrouter")
+    assert scheduler.try_start(first)
+    assert not scheduler.try_start(second)  # openrouter allows one job at a time
+    gemini = scheduler.submit("gemini")
+    assert scheduler.try_start(gemini)  # other providers use the global cap
+    third = scheduler.submit("gemini")
+    assert not scheduler.try_start(third)  # global cap of 2 reached
+    scheduler.finish(gemini)
+    assert scheduler.try_start(third)
+
+
+def test_jobs_start_in_fifo_order():
+    scheduler = make_scheduler(max_concurrent=1, provider_limits={})
+    running = scheduler.submit("gemini")
+    assert scheduler.try_start(running)
+    earlier, later = scheduler.submit("gemini"), scheduler.submit("gemini")
+    scheduler.finish(running)
+    assert not scheduler.try_start(later)
+    assert scheduler.try_start(earlier)
+    assert scheduler.position(later) == 1
+
+
+def test_full_queue_rejects_jobs():
+    scheduler = make_scheduler(max_queue_depth=1)
+    scheduler.submit("gemini")
+    with pytest.raises(QueueFullError):
+        scheduler.submit("gemini")
+    assert scheduler.stats()["rejected"] == 1
+
+
+def test_finishing_a_waiting_job_drops_it_from_the_queue():
+    scheduler = make_scheduler()
+    ticket = scheduler.submit("gemini")
+    scheduler.finish(ticket)
+    scheduler.finish(ticket)  # idempotent
+    assert scheduler.stats()["waiting"] == 0 and scheduler.stats()["completed"] == 0
+
+
+def test_wait_to_start_wakes_when_a_slot_frees():
+    scheduler = make_scheduler(max_concurrent=1)
+    running = scheduler.submit("gemini")
+    scheduler.try_start(running)
+    waiting = scheduler.submit("gemini")
+    assert not scheduler.wait_to_start(waiting, timeout=0.05)
+    threading.Timer(0.05, scheduler.finish, args=(running,)).start()
+    assert scheduler.wait_to_start(waiting, timeout=5)
+
+
+def test_await_start_times_out():
+    scheduler = make_scheduler(max_concurrent=1)
+    scheduler.try_start(scheduler.submit("gemini"))
+    assert not asyncio.run(scheduler.await_start(scheduler.submit("gemini"), timeout=0.05))
+
+
+def test_configure_and_limits_round_trip():
+    scheduler = make_scheduler()
+    before = scheduler.limits()
+    scheduler.configure(max_concurrent=8, provider_limits={"openrouter": 8})
+    waiting = [scheduler.submit("openrouter") for _ in range(2)]
+    assert all(scheduler.try_start(ticket) for ticket in waiting)
+    scheduler.configure(**before)
+    assert scheduler.limits() == before
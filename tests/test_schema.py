@@ -0,0 +1,61 @@
+"""
+Schema validation of model-produced structures and the design spec built from them
+"""
+from utils.design_spec import ELEMENTS_SCHEMA, build_design_spec, shrink_spec, spec_json
+from utils.schema import invalid_fields, validate
+
+SCHEMA = {
+    "type": "object",
+    "required": ["name"],
+    "additionalProperties": False,
+    "properties": {
+        "name": {"type": "string", "maxLength": 5},
+        "kind": {"enum": ["a", "b"]},
+        "count": {"type": "integer"},
+        "tags": {"type": "array", "maxItems": 2, "items": {"type": "string"}},
+        "size": {"type": ["string", "null"]},
+    },
+}
+
+
+def test_valid_value_has_no_errors():
+    assert validate({"name": "x", "kind": "a", "count": 2, "tags": ["t"], "size": None}, SCHEMA) == []
+
+
+def test_each_violation_is_reported_with_its_path():
+    errors = validate({"kind": "c", "count": True, "tags": ["t", 1, "u"], "extra": 1, "size": 3}, SCHEMA)
+    assert "$: missing required field 'name'" in errors
+    assert "$.kind: 'c' is not one of ['a', 'b']" in errors
+    assert "$.count: expected integer, got bool" in errors
+    assert "$.tags: more than 2 items" in errors
+    assert "$.tags[1]: expected string, got int" in errors
+    assert "$: unexpected field 'extra'" in errors
+    assert "$.size: expected ['string', 'null'], got int" in errors
+
+
+def test_invalid_fields_names_the_top_level_fields():
+    errors = validate({"name": "too long", "tags": [1]}, SCHEMA) + validate([], SCHEMA)
+    assert invalid_fields(errors) == {"name", "tags", ""}
+    assert invalid_fields(validate({}, ELEMENTS_SCHEMA)) == {"colors", "typography", "layout", "images"}
+
+
+def test_design_spec_defaults_invalid_fields():
+    spec, errors = build_design_spec({
+        "colors": [{"hex": "#fff", "usage": "background"}],
+        "typography": "Montserrat",
+        "layout": {"type": "grid", "sections": ["hero", {"name": "footer", "content": "© Brand"}]},
+        "style": "Minimal",
+    })
+    assert errors == ["$.typography: expected object, got str"]
+    assert spec["typography"] == {}
+    assert spec["colors"] == {"background": "#fff"}
+    assert spec["layout"] == {"type": "grid"}
+    assert spec["sections"] == [{"name": "hero", "content": []}, {"name": "footer", "content": ["© Brand"]}]
+
+
+def test_shrink_spec_drops_section_text_first():
+    spec, _ = build_design_spec({"layout": {}, "sections": [{"name": "hero", "content": ["x" * 150] * 6}]})
+    text = spec_json(spec)
+    shrunk = shrink_spec(text, len(text) // 2)
+    assert len(shrunk) <= len(text) // 2
+    assert '"name":"hero"' in shrunk
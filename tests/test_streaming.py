@@ -0,0 +1,17 @@
+"""
+Per-job token streams: code preview assembly
+"""
+from utils.streaming import JobStream
+
+
+def test_code_preview_shows_generated_code_then_full_refinements():
+    stream = JobStream()
+    stream.write("html", "<body></body>")
+    stream.write("css", "body { margin: 0; }")
+    assert stream.snapshot()[2] == "<body></body>\n\n/* CSS */\nbody { margin: 0; }"
+    stream.start_channel("refine_patch")
+    stream.write("refine_patch", '{"edits": [')
+    assert stream.snapshot()[2].startswith("<body></body>")  # patch JSON never replaces the preview
+    stream.start_channel("refine")
+    stream.write("refine", "<!DOCTYPE html>")
+    assert stream.snapshot()[2] == "<!DOCTYPE html>"
@@ -0,0 +1,92 @@
+"""
+Compiled graph sharing and stage memoization
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from PIL import Image
+from agents import nodes, workflow
+from services.generator_service import GeneratorService
+import config
+
+STATE = {"job_id": None, "html_code": "<html></html>", "design_spec": {}, "images_detected": [],
+         "refinement_notes": ["x"], "iteration_count": 0, "api_provider": "fake"}
+
+
+def test_compiled_graph_is_shared_per_shape(monkeypatch):
+    compiled = []
+    create = workflow.create_agent_graph
+
+    def counting_create(*args):
+        compiled.append(args)
+        return create(*args)
+
+    monkeypatch.setattr(workflow, "_graph_cache", {})
+    monkeypatch.setattr(workflow, "create_agent_graph", counting_create)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        graphs = list(pool.map(lambda _: workflow.get_agent_graph(2, False), range(16)))
+    assert all(graph is graphs[0] for graph in graphs)
+    assert compiled == [(2, False)]
+
+    assert workflow.get_agent_graph(2, True) is not graphs[0]
+    monkeypatch.setattr(config, "MAX_ITERATIONS", 2)
+    monkeypatch.setattr(config, "PARALLEL_CODEGEN", False)
+    assert workflow.get_agent_graph() is graphs[0]  # defaults resolve to the same shape
+    assert compiled == [(2, False), (2, True)]
+
+
+def test_refine_results_are_cached_per_refine_mode(stage_cache, monkeypatch):
+    calls = []
+
+    def refine(state):
+        calls.append(config.REFINE_MODE)
+        return {"html_code": f"<html>{config.REFINE_MODE}</html>", "iteration_count": 1}
+
+    node = workflow.memoize_stage("refine", refine)
+    for mode in ("patch", "full", "patch", "full"):
+        monkeypatch.setattr(config, "REFINE_MODE", mode)
+        assert node(STATE)["html_code"] == f"<html>{mode}</html>"
+    assert calls == ["patch", "full"]
+    assert len(stage_cache.entries) == 2
+
+
+@pytest.fixture
+def llm_calls(monkeypatch):
+    """Channels of the LLM calls made by graph nodes"""
+    calls = []
+    call_llm, acall_llm = nodes._call_llm, nodes._acall_llm
+
+    async def acounting(*args, **kwargs):
+        calls.append(args[2])
+        return await acall_llm(*args, **kwargs)
+
+    monkeypatch.setattr(nodes, "_call_llm", lambda *args, **kwargs: calls.append(args[2]) or call_llm(*args, **kwargs))
+    monkeypatch.setattr(nodes, "_acall_llm", acounting)
+    return calls
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    monkeypatch.setattr(config, "RESULT_CACHE_ENABLED", False)
+    template = Image.new("RGB", (64, 48), "white")
+    return lambda color: GeneratorService.run_job(template, [Image.new("RGB", (16, 16), color)], "fake")
+
+
+def test_rerun_with_new_user_images_skips_every_llm_stage(stage_cache, llm_calls, jobs):
+    first = jobs("red")
+    assert "analysis" in llm_calls and "extraction" in llm_calls
+    llm_calls.clear()
+    second = jobs("blue")
+    assert llm_calls == []  # images only enter the document in the output node
+    assert "Reused cached analyze_design result" in second.progress_log
+    assert second.html_code != first.html_code
+
+
+def test_changed_input_reruns_only_the_stages_that_depend_on_it(stage_cache, llm_calls):
+    state = {"job_id": None, "design_analysis": "A landing page", "user_images_count": 1, "api_provider": "fake"}
+    node = workflow.memoize_stage("extract_elements", nodes.aextract_design_elements_node)
+    asyncio.run(node(state))
+    asyncio.run(node(state))
+    assert llm_calls == ["extraction"]
+    asyncio.run(node({**state, "user_images_count": 2}))
+    assert llm_calls == ["extraction", "extraction"]
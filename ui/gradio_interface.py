@@ -3,8 +3,20 @@ Gradio UI interface for the Canva to HTML generator
 """
 import gradio as gr
 from services.generator_service import GeneratorService
+from services.scheduler import scheduler
+from utils.instrumentation import metrics
+from utils.output_files import Debouncer
 import config
 
+save_debouncer = Debouncer(config.SAVE_DEBOUNCE_SECONDS)
+
+
+def save_on_change(html_code, request: gr.Request):
+    """Save the download file once edits (or streamed tokens) settle; superseded calls change nothing"""
+    if not save_debouncer.wait(request.session_hash):
+        return gr.update()
+    return GeneratorService.save_html(html_code)
+
 
 def create_ui():
     """Create the Gradio interface"""
@@ -97,6 +109,11 @@ def create_ui():
                     interactive=False
                 )
 
+                with gr.Accordion("📦 Linked Assets Export", open=False):
+                    gr.Markdown("index.html + styles.css + separate image files, for hosting with browser caching.")
+                    export_btn = gr.Button("📦 Export as ZIP", size="sm")
+                    export_file = gr.File(label="Linked assets (ZIP)", interactive=False)
+
                 with gr.Accordion("🔍 Design Analysis", open=False):
                     analysis_output = gr.Textbox(
                         label="AI Design Analysis",
@@ -104,16 +121,39 @@ def create_ui():
                         interactive=False
                     )
 
+                with gr.Accordion("📈 Queue Metrics", open=False):
+                    queue_metrics = gr.JSON(label="Running/waiting jobs and wait vs run time")
+                    pipeline_metrics = gr.Textbox(
+                        label="Pipeline metrics (Prometheus text)",
+                        lines=10,
+                        interactive=False
+                    )
+                    refresh_metrics_btn = gr.Button("🔄 Refresh", size="sm")
+
         generate_btn.click(
-            fn=GeneratorService.process_image,
+            fn=GeneratorService.aprocess_image_stream,
             inputs=[image_input, user_images_input, api_provider],
             outputs=[progress_output, html_output, analysis_output]
         )
 
+        refresh_metrics_btn.click(
+            fn=lambda: (scheduler.stats(), metrics.to_prometheus()),
+            inputs=[],
+            outputs=[queue_metrics, pipeline_metrics]
+        )
+
         html_output.change(
-            fn=GeneratorService.save_html,
+            fn=save_on_change,
+            inputs=[html_output],
+            outputs=[download_btn],
+            trigger_mode="always_last",
+            concurrency_limit=None  # waiting out the debounce must not block other sessions
+        )
+
+        export_btn.click(
+            fn=GeneratorService.export_assets,
             inputs=[html_output],
-            outputs=[download_btn]
+            outputs=[export_file]
         )
 
         gr.Markdown(
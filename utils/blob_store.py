@@ -0,0 +1,145 @@
+"""
+Content-addressed store for large payloads (base64 images) referenced from graph state
+
+The state carries only the SHA-256 reference of each blob, so LangGraph never
+copies megabytes of base64 between steps. Blobs are owned by jobs and freed
+when the last owning job releases them; the least recently used blobs spill
+to disk once the in-memory budget is exceeded. Each process spills into its own
+subfolder; folders left by processes that crashed or restarted are swept when
+a store is created.
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Set
+import config
+
+STALE_SPILL_SECONDS = 7 * 24 * 3600  # where process liveness can't be checked (Windows)
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, owned by another user
+    return True
+
+
+def _abandoned(path: Path) -> bool:
+    """Whether a spill folder (named after its process id) belongs to no running store"""
+    pid = int(path.name)
+    if pid == os.getpid():
+        return True  # an earlier process with our pid, e.g. PID 1 in a restarted container
+    if os.name == "nt":
+        return time.time() - path.stat().st_mtime > STALE_SPILL_SECONDS
+    return not _process_alive(pid)
+
+
+class BlobStore:
+    """Thread-safe, reference-counted blob store with spill-to-disk"""
+
+    def __init__(self, folder: Path, max_memory_bytes: int):
+        self.root = Path(folder)
+        self.folder = self.root / str(os.getpid())
+        self.max_memory_bytes = max_memory_bytes
+        self.spills = 0
+        self._memory = OrderedDict()  # ref -> text (least recently used first)
+        self._memory_bytes = 0
+        self._on_disk: Set[str] = set()
+        self._owners: Dict[str, Set[str]] = {}  # ref -> owning job ids
+        self._owned: Dict[str, Set[str]] = {}  # job id -> refs
+        self._lock = threading.Lock()
+        self.swept = self._sweep()
+
+    def _sweep(self) -> int:
+        """Delete spilled blobs left by processes that exited without releasing them"""
+        swept = 0
+        if not self.root.is_dir():
+            return swept
+        for path in self.root.iterdir():
+            try:
+                if path.is_dir() and path.name.isdigit() and _abandoned(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                elif path.suffix in (".blob", ".tmp"):  # older flat layout
+                    path.unlink()
+                else:
+                    continue
+                swept += 1
+            except FileNotFoundError:
+                continue  # swept concurrently by another process
+        return swept
+
+    def _path(self, ref: str) -> Path:
+        return self.folder / f"{ref}.blob"
+
+    def put(self, text: str, owner: str) -> str:
+        """Store text for a job and return its content hash reference"""
+        ref = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            self._owners.setdefault(ref, set()).add(owner)
+            self._owned.setdefault(owner, set()).add(ref)
+            if ref in self._memory:
+                self._memory.move_to_end(ref)
+            elif ref not in self._on_disk:
+                self._memory[ref] = text
+                self._memory_bytes += len(text)
+                self._spill()
+        return ref
+
+    def _spill(self):
+        """Move least recently used blobs to disk until within the memory budget"""
+        while self._memory and self._memory_bytes > self.max_memory_bytes:
+            ref, text = self._memory.popitem(last=False)
+            self._memory_bytes -= len(text)
+            self.folder.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._path(ref).with_suffix(".tmp")
+            tmp_path.write_text(text, encoding="utf-8")
+            os.replace(tmp_path, self._path(ref))
+            self._on_disk.add(ref)
+            self.spills += 1
+
+    def get(self, ref: str) -> str:
+        """Return the blob for a reference"""
+        with self._lock:
+            text = self._memory.get(ref)
+            if text is not None:
+                self._memory.move_to_end(ref)
+                return text
+            if ref not in self._on_disk:
+                raise KeyError(f"Blob {ref[:12]} is not stored (was its job released?)")
+        return self._path(ref).read_text(encoding="utf-8")
+
+    def release(self, owner: str):
+        """Drop a job's references and free blobs no other job uses"""
+        with self._lock:
+            for ref in self._owned.pop(owner, set()):
+                owners = self._owners.get(ref)
+                owners.discard(owner)
+                if owners:
+                    continue
+                del self._owners[ref]
+                text = self._memory.pop(ref, None)
+                if text is not None:
+                    self._memory_bytes -= len(text)
+                elif ref in self._on_disk:
+                    self._on_disk.discard(ref)
+                    self._path(ref).unlink(missing_ok=True)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "blobs": len(self._owners),
+                "memory_bytes": self._memory_bytes,
+                "on_disk": len(self._on_disk),
+                "spills": self.spills,
+                "jobs": len(self._owned),
+            }
+
+
+blob_store = BlobStore(config.BLOB_STORE_FOLDER, config.BLOB_STORE_MAX_MEMORY_BYTES)
@@ -0,0 +1,150 @@
+"""
+Content-addressed caches for generation results
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+import config
+
+
+def hash_parts(*parts: Any) -> str:
+    """Build a stable SHA-256 key from strings, bytes and JSON-serializable values"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, bytes):
+            data = part
+        elif isinstance(part, str):
+            data = part.encode("utf-8")
+        else:
+            data = json.dumps(part, sort_keys=True, default=str).encode("utf-8")
+        # Length-prefix each part so ("ab", "c") and ("a", "bc") differ
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """
+    Size-bounded LRU cache of JSON-serializable dicts.
+    With a folder, entries are persisted as one JSON file per key and survive
+    restarts (recency is kept in file mtimes); values are read back from disk on hit.
+    Without a folder, values are kept in memory only.
+    """
+
+    def __init__(self, folder: Optional[Path] = None, max_entries: int = 256, max_bytes: int = 0):
+        self.folder = Path(folder) if folder else None
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes  # 0 disables the byte limit
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> size in bytes (oldest first)
+        self._values = {}  # in-memory values when not persisted
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+        if self.folder:
+            self.folder.mkdir(parents=True, exist_ok=True)
+            self._load_index()
+
+    def _path(self, key: str) -> Path:
+        return self.folder / f"{key}.json"
+
+    def _load_index(self):
+        """Rebuild the LRU order from the files on disk"""
+        files = sorted(self.folder.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        for path in files:
+            size = path.stat().st_size
+            self._entries[path.stem] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until within limits"""
+        while self._entries and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes and self._total_bytes > self.max_bytes)
+        ):
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self._values.pop(key, None)
+            self.evictions += 1
+            if self.folder:
+                self._path(key).unlink(missing_ok=True)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached value for key, or None on a miss"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if not self.folder:
+                self.hits += 1
+                return self._values[key]
+
+        try:
+            path = self._path(key)
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+            os.utime(path)  # persist recency for the next restart
+        except (OSError, json.JSONDecodeError):
+            with self._lock:
+                size = self._entries.pop(key, None)
+                if size is not None:
+                    self._total_bytes -= size
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: Dict[str, Any]):
+        """Store a value under key, evicting old entries if needed"""
+        data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+        if self.folder:
+            path = self._path(key)
+            tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            old_size = self._entries.pop(key, None)
+            if old_size is not None:
+                self._total_bytes -= old_size
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            if not self.folder:
+                self._values[key] = value
+            self._evict()
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and current size"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
+
+
+result_cache = LRUCache(
+    config.RESULT_CACHE_FOLDER,
+    max_entries=config.RESULT_CACHE_MAX_ENTRIES,
+    max_bytes=config.RESULT_CACHE_MAX_BYTES,
+)
+
+stage_cache = LRUCache(
+    config.STAGE_CACHE_FOLDER,
+    max_entries=config.STAGE_CACHE_MAX_ENTRIES,
+    max_bytes=config.STAGE_CACHE_MAX_BYTES,
+)
@@ -0,0 +1,147 @@
+"""
+Compact, schema-validated design spec shared by the code generation prompts
+
+Extraction turns the free-text design analysis into this spec once; the
+HTML, CSS and refinement prompts then carry the spec as compact JSON instead
+of re-sending the prose analysis.
+"""
+import json
+from typing import Any, Dict, List, Tuple
+from utils.schema import invalid_fields, validate
+
+MAX_SECTIONS = 12
+MAX_SECTION_ITEMS = 12
+MAX_TEXT_LENGTH = 200
+
+DESIGN_SPEC_SCHEMA = {
+    "type": "object",
+    "required": ["style", "colors", "typography", "layout", "sections"],
+    "additionalProperties": False,
+    "properties": {
+        "style": {"type": "string", "maxLength": MAX_TEXT_LENGTH},
+        "colors": {"type": "object"},
+        "typography": {"type": "object"},
+        "layout": {"type": "object"},
+        "spacing": {"type": "object"},
+        "sections": {
+            "type": "array",
+            "maxItems": MAX_SECTIONS,
+            "items": {
+                "type": "object",
+                "required": ["name"],
+                "properties": {
+                    "name": {"type": "string", "maxLength": 60},
+                    "content": {
+                        "type": "array",
+                        "maxItems": MAX_SECTION_ITEMS,
+                        "items": {"type": "string", "maxLength": MAX_TEXT_LENGTH},
+                    },
+                },
+            },
+        },
+    },
+}
+
+# Shape of the extraction response (ELEMENTS_EXTRACTION_PROMPT) the spec is built from
+ELEMENTS_SCHEMA = {
+    "type": "object",
+    "required": ["colors", "typography", "layout", "images"],
+    "properties": {
+        "colors": {"type": ["object", "array"]},
+        "typography": {"type": "object"},
+        "layout": {"type": "object"},
+        "spacing": {"type": "object"},
+        "style": {"type": "string"},
+        "sections": {"type": "array"},
+        "images": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "location": {"type": "string"},
+                    "type": {"type": "string"},
+                    "purpose": {"type": "string"},
+                    "size": {"type": ["string", "object"]},
+                    "description": {"type": "string"},
+                },
+            },
+        },
+    },
+}
+
+EMPTY_SPEC = {"style": "", "colors": {}, "typography": {}, "layout": {}, "spacing": {}, "sections": []}
+
+
+def _palette(colors: Any) -> Dict[str, str]:
+    """Colors as {usage: hex}, from either a mapping or a list of {hex, usage} objects"""
+    if isinstance(colors, dict):
+        return {str(k): v for k, v in colors.items() if isinstance(v, str)}
+    palette = {}
+    for index, item in enumerate(colors if isinstance(colors, list) else []):
+        if isinstance(item, dict):
+            value = item.get("hex") or item.get("color") or item.get("value")
+            name = item.get("usage") or item.get("name") or item.get("role") or f"color_{index}"
+            if isinstance(value, str):
+                palette[str(name)] = value
+    return palette
+
+
+def _sections(sections: Any, layout: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Sections with their visible text, falling back to the layout's section names"""
+    if not isinstance(sections, list) or not sections:
+        sections = layout.get("sections", []) if isinstance(layout, dict) else []
+    result = []
+    for item in sections[:MAX_SECTIONS] if isinstance(sections, list) else []:
+        if isinstance(item, str):
+            item = {"name": item}
+        if not isinstance(item, dict) or not (item.get("name") or item.get("id")):
+            continue
+        content = item.get("content", [])
+        content = [content] if isinstance(content, str) else content if isinstance(content, list) else []
+        result.append({
+            "name": str(item.get("name") or item.get("id"))[:60],
+            "content": [str(text)[:MAX_TEXT_LENGTH] for text in content[:MAX_SECTION_ITEMS]],
+        })
+    return result
+
+
+def build_design_spec(elements: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Build the spec from the extracted elements JSON. Fields that fail the schema are
+    replaced by empty defaults; returns (spec, schema violations found).
+    """
+    layout = elements.get("layout") if isinstance(elements.get("layout"), dict) else {}
+    spec = {
+        "style": str(elements.get("style", ""))[:MAX_TEXT_LENGTH],
+        "colors": _palette(elements.get("colors", {})),
+        "typography": elements.get("typography", {}),
+        "layout": {key: value for key, value in layout.items() if key != "sections"},
+        "spacing": elements.get("spacing", {}),
+        "sections": _sections(elements.get("sections"), layout),
+    }
+    errors = validate(spec, DESIGN_SPEC_SCHEMA)
+    for field in invalid_fields(errors) & EMPTY_SPEC.keys():
+        spec[field] = EMPTY_SPEC[field]
+    return spec, errors
+
+
+def spec_json(spec: Dict[str, Any]) -> str:
+    """Compact JSON rendering of the spec for prompts"""
+    return json.dumps(spec or EMPTY_SPEC, separators=(",", ":"), ensure_ascii=False)
+
+
+def shrink_spec(text: str, max_chars: int) -> str:
+    """Trim a rendered spec towards max_chars by dropping section text, then spacing, then sections"""
+    try:
+        spec = json.loads(text)
+    except json.JSONDecodeError:
+        return text[:max_chars]
+    for keep in (6, 3, 1, 0):
+        for section in spec.get("sections", []):
+            section["content"] = section.get("content", [])[:keep]
+        if len(spec_json(spec)) <= max_chars:
+            return spec_json(spec)
+    spec.pop("spacing", None)
+    if len(spec_json(spec)) > max_chars:
+        spec["sections"] = [{"name": section["name"]} for section in spec.get("sections", [])]
+    return spec_json(spec)
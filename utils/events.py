@@ -0,0 +1,79 @@
+"""
+Append-only progress event logs kept outside the graph state
+
+Nodes emit progress lines here instead of growing a string in AgentState, so
+the state LangGraph copies between steps stays the same size for the whole job.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from utils.streaming import get_stream
+
+
+@dataclass(frozen=True)
+class ProgressEvent:
+    """One progress line of a job"""
+    at: float
+    message: str
+
+
+class EventLog:
+    """Thread-safe append-only list of a job's progress events"""
+
+    def __init__(self):
+        self._events: List[ProgressEvent] = []
+        self._lock = threading.Lock()
+
+    def append(self, message: str) -> ProgressEvent:
+        event = ProgressEvent(at=time.time(), message=message)
+        with self._lock:
+            self._events.append(event)
+        return event
+
+    def events(self) -> List[ProgressEvent]:
+        with self._lock:
+            return list(self._events)
+
+    def text(self) -> str:
+        """The progress log shown in the UI, one line per event"""
+        return "".join(f"{event.message}\n" for event in self.events())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._events)
+
+
+_logs: Dict[str, EventLog] = {}
+_logs_lock = threading.Lock()
+
+
+def open_event_log(job_id: str) -> EventLog:
+    """Register an event log for a job"""
+    log = EventLog()
+    with _logs_lock:
+        _logs[job_id] = log
+    return log
+
+
+def get_event_log(job_id: Optional[str]) -> Optional[EventLog]:
+    if not job_id:
+        return None
+    with _logs_lock:
+        return _logs.get(job_id)
+
+
+def close_event_log(job_id: str) -> Optional[EventLog]:
+    """Unregister a job's event log and return it"""
+    with _logs_lock:
+        return _logs.pop(job_id, None)
+
+
+def emit(job_id: Optional[str], message: str):
+    """Record a progress line for a job and forward it to the job's stream, if any"""
+    log = get_event_log(job_id)
+    if log is not None:
+        log.append(message)
+    stream = get_stream(job_id)
+    if stream is not None:
+        stream.append_progress(f"{message}\n")
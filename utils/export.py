@@ -0,0 +1,126 @@
+"""
+Linked-assets export: index.html + styles.css + content-hashed image files
+
+Turns a self-contained page into a folder (or zip) the browser can cache and
+download in parallel. Base64 data URIs are decoded to images/<hash>.<ext> and
+<style> blocks move to styles.css. Output is written piece by piece, so the
+bundle is never assembled in memory.
+"""
+import base64
+import hashlib
+import re
+import zipfile
+from pathlib import Path
+from typing import Dict, Set
+
+DATA_URI_PATTERN = re.compile(r"data:(image/[\w.+-]+);base64,([A-Za-z0-9+/=]+)")
+STYLE_BLOCK_PATTERN = re.compile(r"<style[^>]*>(.*?)</style>\s*", re.DOTALL | re.IGNORECASE)
+IMAGE_EXTENSIONS = {
+    "image/png": "png", "image/jpeg": "jpg", "image/jpg": "jpg", "image/webp": "webp",
+    "image/gif": "gif", "image/avif": "avif", "image/svg+xml": "svg",
+}
+STYLESHEET_LINK = '<link rel="stylesheet" href="styles.css">\n'
+
+
+class _DirectoryWriter:
+    """Writes bundle files into a folder"""
+
+    def __init__(self, folder: Path):
+        self.folder = folder
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+    def open(self, name: str, compress: bool = True):
+        path = self.folder / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return open(path, "wb")
+
+    def close(self):
+        pass
+
+
+class _ZipWriter:
+    """Writes bundle files as entries of a zip archive (one entry open at a time)"""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.archive = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+
+    def open(self, name: str, compress: bool = True):
+        info = zipfile.ZipInfo(name)
+        # Encoded images don't deflate; store them as-is
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        return self.archive.open(info, "w")
+
+    def close(self):
+        self.archive.close()
+
+
+class _AssetBundle:
+    """Extracts data URIs to image files, each distinct image once"""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.images: Dict[str, str] = {}  # data URI hash -> relative path
+        self.written: Set[str] = set()
+        self.bytes_written = 0
+        self.image_bytes = 0
+
+    def extract_images(self, text: str):
+        """Write every distinct image behind the data URIs in text"""
+        for match in DATA_URI_PATTERN.finditer(text):
+            key = hashlib.sha256(match.group(2).encode("ascii")).hexdigest()
+            if key in self.images:
+                continue
+            data = base64.b64decode(match.group(2))
+            name = f"images/{hashlib.sha256(data).hexdigest()[:16]}.{IMAGE_EXTENSIONS.get(match.group(1), 'bin')}"
+            if name not in self.written:
+                with self.writer.open(name, compress=False) as f:
+                    f.write(data)
+                self.written.add(name)
+                self.bytes_written += len(data)
+                self.image_bytes += len(data)
+            self.images[key] = name
+
+    def write_text(self, f, text: str):
+        """Write text to an open bundle file with its data URIs replaced by image paths"""
+        position = 0
+        for match in DATA_URI_PATTERN.finditer(text):
+            self._write(f, text[position:match.start()])
+            self._write(f, self.images[hashlib.sha256(match.group(2).encode("ascii")).hexdigest()])
+            position = match.end()
+        self._write(f, text[position:])
+
+    def _write(self, f, text: str):
+        data = text.encode("utf-8")
+        f.write(data)
+        self.bytes_written += len(data)
+
+
+def export_linked_assets(html_code: str, destination: Path, as_zip: bool = False) -> Dict[str, int]:
+    """
+    Write html_code as a linked-assets bundle to a folder, or to a zip file when as_zip.
+    Returns counts: images, image bytes and total bytes written.
+    """
+    destination = Path(destination)
+    writer = _ZipWriter(destination) if as_zip else _DirectoryWriter(destination)
+    bundle = _AssetBundle(writer)
+    try:
+        bundle.extract_images(html_code)
+        style_blocks = list(STYLE_BLOCK_PATTERN.finditer(html_code))
+
+        with writer.open("styles.css") as css_file:
+            for match in style_blocks:
+                bundle.write_text(css_file, match.group(1).strip() + "\n")
+
+        with writer.open("index.html") as html_file:
+            position = 0
+            for idx, match in enumerate(style_blocks):
+                bundle.write_text(html_file, html_code[position:match.start()])
+                if idx == 0:
+                    bundle.write_text(html_file, STYLESHEET_LINK)
+                position = match.end()
+            bundle.write_text(html_file, html_code[position:])
+    finally:
+        writer.close()
+
+    return {"images": len(bundle.written), "image_bytes": bundle.image_bytes, "bytes_written": bundle.bytes_written}
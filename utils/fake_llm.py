@@ -0,0 +1,291 @@
+"""
+Deterministic fake chat model for offline benchmarks and tests of the pipeline
+
+Recognizes which node is calling from its prompt and replays a recorded or
+scripted response for that stage, after a configurable latency. A share of
+calls can be made to fail (rate limits, server errors, hangs) to exercise
+the retry and fallback paths.
+"""
+import asyncio
+import json
+import random
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+# Prompt markers used to recognize the calling stage
+STAGE_MARKERS = [
+    ("refine_patch", "return targeted edits as JSON"),
+    ("refine", "Review and refine this HTML/CSS code"),
+    ("extraction", "Extract and provide in JSON format"),
+    ("css", "You are an expert CSS developer"),
+    ("html", "You are an expert frontend developer"),
+    ("analysis", "You are an expert design analyst"),
+]
+
+SCRIPTED_RESPONSES = {
+    "analysis": """**Overall Design Style**: Modern, minimal landing page with bold hero typography.
+**Color Palette**: #FF6B35 (primary), #004E89 (accent), #F7F7F7 (secondary), #FFFFFF (background), #1A1A1A (text).
+**Layout Structure**: Full-width header, hero section with a large photo on the right, three feature cards, footer.
+**Typography**: Headings in Montserrat bold 48/32px, body in Open Sans 16px.
+**Images Detected**:
+- Hero section: large product photo, right half of the hero
+- Feature cards: three small illustrations, one per card
+**Spacing & Alignment**: 24px grid, 80px section padding, centered content max-width 1200px.""",
+    "extraction": json.dumps({
+        "colors": {"primary": "#FF6B35", "secondary": "#F7F7F7", "accent": "#004E89",
+                   "background": "#FFFFFF", "text": "#1A1A1A"},
+        "typography": {"heading": {"family": "Montserrat, sans-serif", "weight": "700", "size": "48px"},
+                       "body": {"family": "Open Sans, sans-serif", "weight": "400", "size": "16px"}},
+        "layout": {"type": "grid", "columns": 12, "sections": ["header", "hero", "features", "footer"]},
+        "spacing": {"section": "80px", "gutter": "24px"},
+        "style": "Modern, minimal landing page with bold hero typography",
+        "sections": [
+            {"name": "header", "content": ["Brand"]},
+            {"name": "hero", "content": ["Build something great",
+                                         "A short description of the product and its value.", "Get started"]},
+            {"name": "features", "content": ["Fast", "Simple"]},
+            {"name": "footer", "content": ["© Brand"]},
+        ],
+        "images": [
+            {"location": "hero", "type": "product", "purpose": "hero-image", "size": "large",
+             "description": "Product photo"},
+            {"location": "features", "type": "abstract", "purpose": "feature-icon", "size": "small",
+             "description": "Feature illustration 1"},
+            {"location": "features", "type": "abstract", "purpose": "feature-icon", "size": "small",
+             "description": "Feature illustration 2"},
+        ],
+    }),
+    "html": """```html
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Landing Page</title>
+</head>
+<body class="page">
+    <header class="header"><div class="header__container"><h1 class="header__title">Brand</h1></div></header>
+    <section class="hero">
+        <div class="hero__container">
+            <h2 class="hero__title">Build something great</h2>
+            <p class="hero__text">A short description of the product and its value.</p>
+            <a class="hero__button" href="#">Get started</a>
+            <img class="hero__image" src="{{USER_IMAGE_0}}" alt="Product photo">
+        </div>
+    </section>
+    <section class="features">
+        <div class="features__container">
+            <article><img class="features__image" src="{{USER_IMAGE_1}}" alt="Feature 1"><h3 class="features__title">Fast</h3></article>
+            <article><img class="features__image" src="{{USER_IMAGE_2}}" alt="Feature 2"><h3 class="features__title">Simple</h3></article>
+        </div>
+    </section>
+    <footer class="footer"><div class="footer__container"><p class="footer__text">&copy; Brand</p></div></footer>
+</body>
+</html>
+```""",
+    "css": """```css
+:root { --primary: #FF6B35; --accent: #004E89; --secondary: #F7F7F7; --text: #1A1A1A; }
+.page { margin: 0; font-family: 'Open Sans', sans-serif; color: var(--text); }
+.header, .hero, .features, .footer { padding: 80px 24px; }
+.header__container, .hero__container, .features__container, .footer__container { max-width: 1200px; margin: 0 auto; }
+.header__title, .hero__title, .features__title { font-family: 'Montserrat', sans-serif; font-weight: 700; }
+.hero { background: var(--primary); color: #FFFFFF; }
+.hero__button { background: var(--accent); color: #FFFFFF; padding: 12px 24px; transition: opacity .2s; }
+.hero__button:hover { opacity: .85; }
+.hero__image, .features__image { max-width: 100%; height: auto; object-fit: cover; }
+.features__container { display: grid; grid-template-columns: repeat(auto-fit, minmax(240px, 1fr)); gap: 24px; }
+.footer { background: var(--secondary); }
+@media (max-width: 768px) { .header, .hero, .features, .footer { padding: 40px 16px; } }
+```""",
+    "refine_patch": json.dumps({"edits": [
+        {"op": "css_rule", "selector": ".hero__text", "declarations": "font-size: 18px; max-width: 560px; opacity: .9;"},
+        {"op": "css_rule", "selector": ".footer__text", "declarations": "margin: 0; text-align: center;"},
+        {"op": "css_rule", "selector": ".hero__container", "media": "(max-width: 768px)",
+         "declarations": "display: flex; flex-direction: column;"},
+        {"op": "set_attribute", "target": "a.hero__button", "name": "href", "value": "#features"},
+    ]}),
+}
+
+class FakeProviderError(Exception):
+    """Injected provider failure carrying an HTTP-like status code"""
+
+    def __init__(self, status_code: int, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+CURRENT_CODE_PATTERN = re.compile(r"Current Code:\n(.*?)\n\nDesign Spec:", re.DOTALL)
+
+
+def _prompt_text(messages: List) -> str:
+    """Flatten message contents (including multimodal parts) into one string"""
+    parts = []
+    for message in messages:
+        content = message.content
+        if isinstance(content, list):
+            parts.extend(part.get("text", "") for part in content if isinstance(part, dict))
+        else:
+            parts.append(str(content))
+    return "\n".join(parts)
+
+
+def detect_stage(messages: List) -> str:
+    """Return the pipeline stage a prompt belongs to"""
+    text = _prompt_text(messages)
+    for stage, marker in STAGE_MARKERS:
+        if marker in text:
+            return stage
+    return "unknown"
+
+
+class FakeChatModel:
+    """
+    Chat model stand-in implementing invoke/ainvoke/stream/astream.
+    Responses come from a JSON file of {stage: text or [texts]} when given
+    (lists are replayed in order, cycling), otherwise from SCRIPTED_RESPONSES.
+    Full refinement echoes the current code back unless a response is recorded.
+    """
+
+    def __init__(self, model: str = "fake-model", latency: float = 0.0,
+                 tokens_per_second: float = 0.0, responses_path: Optional[str] = None,
+                 failure_rate: float = 0.0, failure_kinds: Optional[List[str]] = None,
+                 hang_seconds: float = 5.0, seed: Optional[str] = None):
+        self.model = model
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.failure_rate = failure_rate
+        self.failure_kinds = failure_kinds or ["rate_limit", "server_error", "timeout"]
+        self.hang_seconds = hang_seconds
+        self.failures: Dict[str, int] = {}
+        self._random = random.Random(seed)
+        self.responses: Dict[str, list] = {}
+        self.calls: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        if responses_path:
+            with open(Path(responses_path), "r", encoding="utf-8") as f:
+                recorded = json.load(f)
+            self.responses = {stage: value if isinstance(value, list) else [value]
+                              for stage, value in recorded.items()}
+
+    def _failure(self) -> Optional[str]:
+        """Pick the failure to inject into this call, if any"""
+        with self._lock:
+            if not self.failure_rate or self._random.random() >= self.failure_rate:
+                return None
+            kind = self._random.choice(self.failure_kinds)
+            self.failures[kind] = self.failures.get(kind, 0) + 1
+            return kind
+
+    @staticmethod
+    def _raise(kind: str):
+        if kind == "rate_limit":
+            raise FakeProviderError(429, "Injected rate limit", retry_after=0.0)
+        if kind == "timeout":
+            raise TimeoutError("Injected timeout")
+        raise FakeProviderError(503, "Injected server error")
+
+    def _respond(self, messages: List) -> str:
+        stage = detect_stage(messages)
+        with self._lock:
+            count = self.calls.get(stage, 0)
+            self.calls[stage] = count + 1
+
+        if stage in self.responses:
+            recorded = self.responses[stage]
+            return recorded[count % len(recorded)]
+        if stage == "refine":
+            match = CURRENT_CODE_PATTERN.search(_prompt_text(messages))
+            return match.group(1) if match else ""
+        return SCRIPTED_RESPONSES.get(stage, "")
+
+    def _message(self, content: str) -> AIMessage:
+        return AIMessage(content=content, response_metadata={"model_name": self.model})
+
+    def _generation_delay(self, content: str) -> float:
+        """Latency plus simulated decoding time (~4 characters per token)"""
+        if not self.tokens_per_second:
+            return self.latency
+        return self.latency + len(content) / 4 / self.tokens_per_second
+
+    def bind(self, **kwargs):
+        """Bind call options; response formats don't change replayed output, a timeout bounds hangs"""
+        return _FakeBinding(self, kwargs)
+
+    def _failure_delay(self, failure: str, kwargs) -> float:
+        """How long a failing call takes; an injected hang is cut short by the request timeout"""
+        if failure != "timeout":
+            return self.latency
+        timeout = kwargs.get("timeout")
+        return min(self.hang_seconds, timeout) if timeout else self.hang_seconds
+
+    def invoke(self, messages: List, **kwargs) -> AIMessage:
+        failure = self._failure()
+        if failure:
+            time.sleep(self._failure_delay(failure, kwargs))
+            self._raise(failure)
+        content = self._respond(messages)
+        time.sleep(self._generation_delay(content))
+        return self._message(content)
+
+    async def ainvoke(self, messages: List, **kwargs) -> AIMessage:
+        failure = self._failure()
+        if failure:
+            await asyncio.sleep(self._failure_delay(failure, kwargs))
+            self._raise(failure)
+        content = self._respond(messages)
+        await asyncio.sleep(self._generation_delay(content))
+        return self._message(content)
+
+    def stream(self, messages: List, **kwargs):
+        failure = self._failure()
+        if failure:
+            time.sleep(self._failure_delay(failure, kwargs))
+            self._raise(failure)
+        content = self._respond(messages)
+        chunks = [content[i:i + 16] for i in range(0, len(content), 16)] or [""]
+        delay = self._generation_delay(content)
+        time.sleep(self.latency)
+        for chunk in chunks:
+            time.sleep((delay - self.latency) / len(chunks))
+            yield AIMessageChunk(content=chunk)
+
+    async def astream(self, messages: List, **kwargs):
+        failure = self._failure()
+        if failure:
+            await asyncio.sleep(self._failure_delay(failure, kwargs))
+            self._raise(failure)
+        content = self._respond(messages)
+        chunks = [content[i:i + 16] for i in range(0, len(content), 16)] or [""]
+        delay = self._generation_delay(content)
+        await asyncio.sleep(self.latency)
+        for chunk in chunks:
+            await asyncio.sleep((delay - self.latency) / len(chunks))
+            yield AIMessageChunk(content=chunk)
+
+
+class _FakeBinding:
+    """A FakeChatModel with call options bound, like a langchain RunnableBinding"""
+
+    def __init__(self, model: FakeChatModel, kwargs: Dict):
+        self.model = model
+        self.kwargs = kwargs
+
+    def bind(self, **kwargs):
+        return _FakeBinding(self.model, {**self.kwargs, **kwargs})
+
+    def invoke(self, messages: List, **kwargs) -> AIMessage:
+        return self.model.invoke(messages, **{**self.kwargs, **kwargs})
+
+    async def ainvoke(self, messages: List, **kwargs) -> AIMessage:
+        return await self.model.ainvoke(messages, **{**self.kwargs, **kwargs})
+
+    def stream(self, messages: List, **kwargs):
+        return self.model.stream(messages, **{**self.kwargs, **kwargs})
+
+    def astream(self, messages: List, **kwargs):
+        return self.model.astream(messages, **{**self.kwargs, **kwargs})
@@ -0,0 +1,120 @@
+"""
+HTML/CSS helpers: class-name extraction, the layout-derived class contract and its reconciliation
+"""
+import re
+from typing import Any, Dict, List, Set, Tuple
+
+CLASS_ATTR_PATTERN = re.compile(r'''class\s*=\s*["']([^"']*)["']''', re.IGNORECASE)
+CSS_CLASS_PATTERN = re.compile(r'\.(-?[_a-zA-Z]+[_a-zA-Z0-9-]*)')
+CSS_COMMENT_PATTERN = re.compile(r'/\*.*?\*/', re.DOTALL)
+CSS_PRELUDE_PATTERN = re.compile(r'([^{};]+)\{')
+CSS_RULE_PATTERN = re.compile(r'([^{}]*)\{([^{}]*)\}')  # innermost rules only
+EMPTY_AT_RULE_PATTERN = re.compile(r'\s*@[^{};]+\{\s*\}')
+
+DEFAULT_BLOCKS = ["header", "hero", "content", "footer"]
+BLOCK_ELEMENTS = ["container", "title", "subtitle", "text", "button"]
+
+
+def extract_html_classes(html: str) -> Set[str]:
+    """Return every class name used in HTML class attributes"""
+    classes = set()
+    for match in CLASS_ATTR_PATTERN.finditer(html or ""):
+        classes.update(match.group(1).split())
+    return classes
+
+
+def extract_css_classes(css: str) -> Set[str]:
+    """Return every class name that appears in a CSS selector"""
+    css = CSS_COMMENT_PATTERN.sub("", css or "")
+    classes = set()
+    # Only the text before each "{" is a selector (or an at-rule prelude)
+    for prelude in CSS_PRELUDE_PATTERN.findall(css):
+        if not prelude.strip().startswith("@"):
+            classes.update(CSS_CLASS_PATTERN.findall(prelude))
+    return classes
+
+
+def _slug(value: str) -> str:
+    """Normalize a free-form section name into a BEM block name"""
+    value = re.sub(r'[^a-z0-9]+', '-', str(value).lower()).strip('-')
+    value = re.sub(r'-\d+$', '', value)  # "gallery-item-1" -> "gallery-item"
+    return value
+
+
+def _section_names(layout_structure: Any) -> List[str]:
+    """Collect section names from the loosely structured layout JSON"""
+    names = []
+    if isinstance(layout_structure, dict):
+        for key in ("sections", "components", "regions"):
+            value = layout_structure.get(key)
+            if isinstance(value, dict):
+                names.extend(value.keys())
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, str):
+                        names.append(item)
+                    elif isinstance(item, dict):
+                        name = item.get("name") or item.get("id") or item.get("type")
+                        if name:
+                            names.append(name)
+    return names
+
+
+def derive_class_contract(layout_structure: Dict[str, Any], images_detected: List[Dict[str, Any]]) -> List[str]:
+    """
+    Derive the BEM class names that both the HTML and the CSS generator must use.
+    Blocks come from the extracted layout sections and image locations.
+    """
+    blocks = []
+    for name in _section_names(layout_structure) + [img.get("location", "") for img in images_detected or []]:
+        block = _slug(name)
+        if block and block not in blocks:
+            blocks.append(block)
+    if not blocks:
+        blocks = list(DEFAULT_BLOCKS)
+
+    contract = ["page"]
+    for block in blocks:
+        contract.append(block)
+        contract.extend(f"{block}__{element}" for element in BLOCK_ELEMENTS)
+
+    image_blocks = {_slug(img.get("location", "")) for img in images_detected or []}
+    contract.extend(f"{block}__image" for block in blocks if block in image_blocks)
+    return contract
+
+
+def prune_css_classes(css: str, classes: Set[str]) -> str:
+    """Drop the selectors that reference any of `classes`; rules (and at-rule blocks) left empty go too"""
+    if not classes:
+        return css
+
+    def prune(match):
+        prelude, body = match.group(1), match.group(2)
+        if prelude.strip().startswith("@"):
+            return match.group(0)  # @font-face, @page...
+        selectors = prelude.split(",")
+        kept = [selector for selector in selectors if not set(CSS_CLASS_PATTERN.findall(selector)) & classes]
+        if len(kept) == len(selectors):
+            return match.group(0)
+        lead = prelude[:len(prelude) - len(prelude.lstrip())]
+        if not kept:
+            return lead.rstrip(" \t")
+        return f"{lead}{', '.join(selector.strip() for selector in kept)} {{{body}}}"
+
+    css = CSS_RULE_PATTERN.sub(prune, CSS_COMMENT_PATTERN.sub("", css))
+    while EMPTY_AT_RULE_PATTERN.search(css):
+        css = EMPTY_AT_RULE_PATTERN.sub("", css)
+    return css
+
+
+def reconcile_classes(html: str, css: str, class_contract: List[str]) -> Tuple[str, List[str], List[str]]:
+    """
+    Reconcile HTML and CSS generated in parallel against their class contract.
+    Returns the CSS without rules for contract classes the HTML never uses, those
+    classes, and the HTML classes outside the contract that no CSS rule styles.
+    """
+    html_classes = extract_html_classes(html)
+    css_classes = extract_css_classes(css)
+    unused = sorted((css_classes & set(class_contract)) - html_classes)
+    off_contract = sorted(html_classes - css_classes - set(class_contract))
+    return prune_css_classes(css, set(unused)), unused, off_contract
@@ -0,0 +1,140 @@
+"""
+Slot-sized, modern-format encoding of the user images embedded in the output
+
+Each user image is resized to the largest slot it fills (the "size" the
+extraction stage assigns to every detected image) and encoded in the first
+available preferred format (WebP/AVIF), falling back to JPEG. Encoding work
+across images runs in a shared process pool.
+"""
+import base64
+import io
+import multiprocessing
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from PIL import Image
+from utils.image_utils import MIME_TYPES, flatten_alpha
+import config
+
+USER_IMAGE_TOKEN = re.compile(r"\{\{USER_IMAGE_(\d+)\}\}")
+IMG_SRC_PATTERN = re.compile(r"""\bsrc\s*=\s*(["'])\{\{USER_IMAGE_(\d+)\}\}\1""")
+ENCODED_MIME_TYPES = {**MIME_TYPES, "AVIF": "image/avif"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Shared worker pool, started on first use (spawned, so it is safe next to threads)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=config.USER_IMAGE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def map_images(fn: Callable, items: List) -> List:
+    """Apply fn to every item, in the process pool when there is more than one"""
+    if len(items) <= 1 or config.USER_IMAGE_WORKERS <= 1:
+        return [fn(item) for item in items]
+    return list(_get_pool().map(fn, items))
+
+
+def available_formats(preferred: List[str]) -> List[str]:
+    """The preferred formats this Pillow build can encode, always ending with JPEG"""
+    Image.init()
+    formats = [fmt for fmt in preferred if fmt in Image.SAVE and fmt in ENCODED_MIME_TYPES]
+    return formats if "JPEG" in formats else formats + ["JPEG"]
+
+
+def _decode_data_uri(data_uri: str) -> Image.Image:
+    _, _, payload = data_uri.partition(",")
+    return Image.open(io.BytesIO(base64.b64decode(payload)))
+
+
+def encode_variant(job: Tuple[str, int, List[str], int]) -> Tuple[str, Tuple[int, int]]:
+    """
+    Resize one data URI image to fit max_edge and encode it in the first format that
+    works. Returns (data URI, (width, height)). Runs in pool workers.
+    """
+    data_uri, max_edge, formats, quality = job
+    image = _decode_data_uri(data_uri)
+    image.load()
+    if max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    for fmt in formats:
+        try:
+            # Only WebP/AVIF/PNG keep transparency; JPEG gets a flattened copy
+            prepared = flatten_alpha(image, config.TEMPLATE_BACKGROUND) if fmt == "JPEG" else image
+            if prepared.mode not in ("RGB", "RGBA", "L", "LA"):
+                prepared = prepared.convert("RGBA" if "transparency" in prepared.info else "RGB")
+            buffered = io.BytesIO()
+            prepared.save(buffered, format=fmt, quality=quality)
+        except (OSError, ValueError, KeyError):
+            continue
+        payload = base64.b64encode(buffered.getvalue()).decode("ascii")
+        return f"data:{ENCODED_MIME_TYPES[fmt]};base64,{payload}", image.size
+    return data_uri, image.size
+
+
+def slot_targets(images_detected: List[Dict], user_images_count: int) -> Dict[int, int]:
+    """Longest edge each user image needs: the largest slot it is placed in"""
+    sizes = config.USER_IMAGE_SLOT_SIZES
+    default_edge = max(sizes.values())
+    targets = {}
+    for img in images_detected:
+        match = USER_IMAGE_TOKEN.fullmatch(str(img.get("url", "")))
+        if not match:
+            continue
+        index = int(match.group(1))
+        edge = sizes.get(str(img.get("size", "")).lower(), default_edge)
+        targets[index] = max(targets.get(index, 0), edge)
+    # Images the HTML uses without a detected slot get the largest size
+    for index in range(user_images_count):
+        targets.setdefault(index, default_edge)
+    return targets
+
+
+def build_variants(user_images_base64: Dict[str, str], targets: Dict[int, int],
+                   srcset: bool = False) -> Dict[int, List[Tuple[str, int]]]:
+    """
+    Encode every user image for its slot. Returns index -> [(data URI, width), ...]
+    ordered from smallest to largest; with srcset a half-size variant is added.
+    """
+    formats = available_formats(config.USER_IMAGE_FORMATS)
+    jobs, keys = [], []
+    for index, data_uri in enumerate(user_images_base64.values()):
+        edge = targets.get(index, max(config.USER_IMAGE_SLOT_SIZES.values()))
+        edges = [edge // 2, edge] if srcset else [edge]
+        for variant_edge in edges:
+            jobs.append((data_uri, variant_edge, formats, config.USER_IMAGE_QUALITY))
+            keys.append(index)
+
+    variants: Dict[int, List[Tuple[str, int]]] = {}
+    for index, (data_uri, size) in zip(keys, map_images(encode_variant, jobs)):
+        entries = variants.setdefault(index, [])
+        if not any(width == size[0] for _, width in entries):  # small originals yield one variant
+            entries.append((data_uri, size[0]))
+    return variants
+
+
+def add_srcset(html_code: str, variants: Dict[int, List[Tuple[str, int]]]) -> str:
+    """
+    Give <img> tags whose src is still a placeholder a srcset of the image's variants.
+    The smallest variant becomes the src; the largest stays a token and is embedded later.
+    """
+    def rewrite(match):
+        entries = variants.get(int(match.group(2)), [])
+        if len(entries) < 2:
+            return match.group(0)
+        smallest = entries[0][0]
+        candidates = [f"{uri} {width}w" for uri, width in entries[:-1]]
+        candidates.append(f"{{{{USER_IMAGE_{match.group(2)}}}}} {entries[-1][1]}w")
+        return f'src="{smallest}" srcset="{", ".join(candidates)}" sizes="(max-width: {entries[-1][1]}px) 100vw, {entries[-1][1]}px"'
+
+    return IMG_SRC_PATTERN.sub(rewrite, html_code)
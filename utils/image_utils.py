@@ -2,9 +2,18 @@
 Image processing utilities for the Canva to HTML generator
 """
 import base64
+import hashlib
 import io
+import re
 from PIL import Image
-from typing import Dict, Set
+from typing import Dict, Iterator, Set, Tuple
+import config
+
+MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+# {{USER_IMAGE_n}} and {{IMAGE_PLACEHOLDER_SVG}} tokens left in the HTML by the LLM stages
+PLACEHOLDER_PATTERN = re.compile(r"\{\{(?:USER_IMAGE_(\d+)|IMAGE_PLACEHOLDER_SVG)\}\}")
+PLACEHOLDER_SVG_DATA_URI = "data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' width='800' height='600'%3E%3Crect width='800' height='600' fill='%23ddd'/%3E%3Ctext x='50%25' y='50%25' text-anchor='middle' fill='%23999' font-size='24'%3EImage Placeholder%3C/text%3E%3C/svg%3E"
 
 def image_to_base64(image: Image.Image) -> str:
     """Convert PIL Image to base64 string"""
@@ -12,6 +21,64 @@ def image_to_base64(image: Image.Image) -> str:
     image.save(buffered, format="PNG")
     return base64.b64encode(buffered.getvalue()).decode('utf-8')
 
+def flatten_alpha(image: Image.Image, background: str = "#FFFFFF") -> Image.Image:
+    """Composite a transparent image onto a solid background, returning RGB"""
+    if image.mode == "P" and "transparency" in image.info:
+        image = image.convert("RGBA")
+    if image.mode in ("RGBA", "LA"):
+        base = Image.new("RGB", image.size, background)
+        base.paste(image, mask=image.getchannel("A"))
+        return base
+    return image.convert("RGB") if image.mode != "RGB" else image
+
+def prepare_template_image(
+        image: Image.Image,
+        max_edge: int = None,
+        format: str = None,
+        quality: int = None,
+        full_fidelity: bool = None,
+) -> Tuple[str, str]:
+    """
+    Downscale and re-encode the template before it is sent to the vision model.
+    Returns (base64 payload, MIME type). With full fidelity enabled the image is
+    sent at its original resolution as a lossless PNG.
+    """
+    full_fidelity = config.TEMPLATE_FULL_FIDELITY if full_fidelity is None else full_fidelity
+    if full_fidelity:
+        return image_to_base64(image), "image/png"
+
+    max_edge = max_edge or config.TEMPLATE_MAX_EDGE
+    format = (format or config.TEMPLATE_FORMAT).upper()
+    quality = quality or config.TEMPLATE_QUALITY
+    if format not in MIME_TYPES:
+        format = "PNG"
+
+    # Alpha is flattened for every lossy target, and the pixel copy drops
+    # EXIF/ICC/text metadata that Pillow would otherwise write back out
+    if format == "PNG":
+        prepared = image.copy()
+    else:
+        prepared = flatten_alpha(image, config.TEMPLATE_BACKGROUND).copy()
+    prepared.info = {}
+
+    if max(prepared.size) > max_edge:
+        prepared.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    buffered = io.BytesIO()
+    if format == "PNG":
+        prepared.save(buffered, format="PNG", optimize=True)
+    else:
+        prepared.save(buffered, format=format, quality=quality)
+
+    return base64.b64encode(buffered.getvalue()).decode('utf-8'), MIME_TYPES[format]
+
+def image_fingerprint(image: Image.Image) -> str:
+    """Hash the decoded pixels of an image (independent of file encoding)"""
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}".encode("utf-8"))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
 def pil_to_base64_data_uri(image: Image.Image, format: str = "PNG") -> str:
     """Convert PIL Image to base64 data URI for embedding in HTML"""
     buffered = io.BytesIO()
@@ -55,18 +122,103 @@ def get_next_user_image_placeholder(image_index: int, used_count: int, total_ima
     actual_index = image_index % total_images
     return f"{{{{USER_IMAGE_{actual_index}}}}}"
 
+def iter_image_substitutions(html_code: str, user_images_base64: Dict[str, str]) -> Iterator[str]:
+    """
+    Yield the HTML in chunks with every placeholder token replaced, in a single pass.
+    Data URIs are yielded as-is rather than spliced into a new copy of the document;
+    tokens for images that weren't uploaded are left untouched.
+    """
+    data_uris = list(user_images_base64.values())
+    position = 0
+    for match in PLACEHOLDER_PATTERN.finditer(html_code):
+        index = match.group(1)
+        if index is None:
+            replacement = PLACEHOLDER_SVG_DATA_URI
+        elif int(index) < len(data_uris):
+            replacement = data_uris[int(index)]
+        else:
+            continue
+        yield html_code[position:match.start()]
+        yield replacement
+        position = match.end()
+    yield html_code[position:]
+
 def replace_image_placeholders(html_code: str, user_images_base64: Dict[str, str]) -> str:
     """
     Replace placeholder tokens with actual base64 data URIs in the final HTML.
     This happens AFTER all LLM processing to keep context small.
     """
-    # Replace SVG placeholder
-    svg_placeholder = "data:image/svg+xml,%3Csvg xmlns='http://www.w3.org/2000/svg' width='800' height='600'%3E%3Crect width='800' height='600' fill='%23ddd'/%3E%3Ctext x='50%25' y='50%25' text-anchor='middle' fill='%23999' font-size='24'%3EImage Placeholder%3C/text%3E%3C/svg%3E"
-    html_code = html_code.replace("{{IMAGE_PLACEHOLDER_SVG}}", svg_placeholder)
+    return "".join(iter_image_substitutions(html_code, user_images_base64))
+
+# <img src> and CSS url() references to a user image, the two places a shared copy can serve
+IMAGE_REFERENCE_PATTERN = re.compile(
+    r"""(?P<src>\bsrc\s*=\s*(?P<q1>["'])\{\{USER_IMAGE_(?P<i1>\d+)\}\}(?P=q1))"""
+    r"""|(?P<url>url\(\s*(?P<q2>["']?)\{\{USER_IMAGE_(?P<i2>\d+)\}\}(?P=q2)\s*\))"""
+)
+TRANSPARENT_PIXEL = "data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7"
+DEDUPE_BOOTSTRAP_SCRIPT = """<script>
+document.querySelectorAll("img[data-user-image]").forEach(function (img) {
+  var value = getComputedStyle(document.documentElement).getPropertyValue("--user-image-" + img.dataset.userImage).trim();
+  var match = value.match(/^url\\(["']?(.*?)["']?\\)$/);
+  if (match) img.src = match[1];
+});
+</script>
+"""
+
+def _embedded_length(html_code: str, data_uris: list) -> int:
+    """UTF-8 size of html_code once its placeholder tokens are replaced (without building it)"""
+    length = len(html_code.encode("utf-8"))  # tokens and data URIs are ASCII
+    for match in PLACEHOLDER_PATTERN.finditer(html_code):
+        index = match.group(1)
+        if index is None:
+            length += len(PLACEHOLDER_SVG_DATA_URI) - len(match.group(0))
+        elif int(index) < len(data_uris):
+            length += len(data_uris[int(index)]) - len(match.group(0))
+    return length
+
+def dedupe_image_placeholders(html_code: str, user_images_base64: Dict[str, str]) -> Tuple[str, Dict[str, int]]:
+    """
+    Rewrite the placeholder HTML so every image referenced more than once is embedded
+    exactly once, as a --user-image-n custom property on :root. CSS url() references
+    become var(--user-image-n); <img> tags get a 1px placeholder src and a small
+    bootstrap script copies the shared image into them. Single references stay inline.
+    Returns the rewritten HTML (still holding tokens) and a size report.
+    """
+    data_uris = list(user_images_base64.values())
+    uses = {}
+    for match in IMAGE_REFERENCE_PATTERN.finditer(html_code):
+        index = int(match.group("i1") or match.group("i2"))
+        if index < len(data_uris):
+            uses[index] = uses.get(index, 0) + 1
+    shared = sorted(index for index, count in uses.items() if count > 1)
+
+    deduped = html_code
+    if shared:
+        def rewrite(match):
+            index = int(match.group("i1") or match.group("i2"))
+            if index not in shared:
+                return match.group(0)
+            if match.group("src"):
+                return f'src="{TRANSPARENT_PIXEL}" data-user-image="{index}"'
+            return f"var(--user-image-{index})"
 
-    # Replace user image placeholders with actual base64
-    for idx, (filename, data_uri) in enumerate(user_images_base64.items()):
-        placeholder = f"{{{{USER_IMAGE_{idx}}}}}"
-        html_code = html_code.replace(placeholder, data_uri)
+        deduped = IMAGE_REFERENCE_PATTERN.sub(rewrite, html_code)
+        definitions = " ".join(f'--user-image-{index}: url("{{{{USER_IMAGE_{index}}}}}");' for index in shared)
+        style_tag = f"<style>:root {{ {definitions} }}</style>\n"
+        deduped = deduped.replace("</head>", f"{style_tag}</head>", 1) if "</head>" in deduped else style_tag + deduped
+        if "data-user-image=" in deduped:
+            if "</body>" in deduped:
+                deduped = deduped.replace("</body>", f"{DEDUPE_BOOTSTRAP_SCRIPT}</body>", 1)
+            else:
+                deduped += DEDUPE_BOOTSTRAP_SCRIPT
 
-    return html_code
\ No newline at end of file
+    inline_bytes = _embedded_length(html_code, data_uris)
+    deduped_bytes = _embedded_length(deduped, data_uris)
+    report = {
+        "shared_images": len(shared),
+        "shared_references": sum(uses[index] for index in shared),
+        "inline_bytes": inline_bytes,
+        "deduped_bytes": deduped_bytes,
+        "bytes_saved": inline_bytes - deduped_bytes,
+    }
+    return deduped, report
@@ -0,0 +1,345 @@
+"""
+Per-job traces and process-wide metrics for the generation pipeline
+
+Graph nodes run inside a span (see agents.workflow.instrument_node); LLM calls
+made while a span is active are recorded on it. Every observation also feeds
+the aggregated counters/histograms, which export as Prometheus text.
+"""
+import bisect
+import contextvars
+import json
+import threading
+import time
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import config
+
+HISTOGRAM_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0]
+
+
+def estimate_tokens(text_chars: int) -> int:
+    """Rough token count when the provider doesn't report usage (~4 chars per token)"""
+    return (text_chars + 3) // 4
+
+
+@dataclass
+class LLMCall:
+    """One model call made inside a node"""
+    provider: str
+    latency_ms: float
+    prompt_chars: int
+    response_chars: int
+    prompt_tokens: int
+    response_tokens: int
+    tokens_estimated: bool
+    image_bytes: int = 0
+    retries: int = 0
+    error: Optional[str] = None
+
+
+@dataclass
+class NodeSpan:
+    """Wall time and LLM calls of one node execution"""
+    node: str
+    started_ms: float
+    wall_ms: float = 0.0
+    cache_hit: bool = False
+    llm_calls: List[LLMCall] = field(default_factory=list)
+
+
+@dataclass
+class JobTrace:
+    """Structured trace of one generation job"""
+    job_id: str
+    api_provider: str
+    started_at: float = field(default_factory=time.time)
+    wall_ms: float = 0.0
+    queue_wait_ms: float = 0.0
+    status: str = "running"
+    spans: List[NodeSpan] = field(default_factory=list)
+    _start: float = field(default_factory=time.perf_counter, repr=False)
+    _lock: Any = field(default_factory=threading.Lock, repr=False)
+
+    def start_span(self, node: str) -> NodeSpan:
+        span = NodeSpan(node=node, started_ms=(time.perf_counter() - self._start) * 1000)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def finish(self, status: str):
+        self.status = status
+        self.wall_ms = (time.perf_counter() - self._start) * 1000
+
+    def node_summary(self) -> Dict[str, Dict[str, float]]:
+        """Totals per node: wall time, LLM time, calls and tokens"""
+        summary = {}
+        for span in self.spans:
+            entry = summary.setdefault(span.node, {"runs": 0, "wall_ms": 0.0, "llm_ms": 0.0, "llm_calls": 0,
+                                                   "prompt_tokens": 0, "response_tokens": 0, "retries": 0})
+            entry["runs"] += 1
+            entry["wall_ms"] += span.wall_ms
+            for call in span.llm_calls:
+                entry["llm_calls"] += 1
+                entry["llm_ms"] += call.latency_ms
+                entry["prompt_tokens"] += call.prompt_tokens
+                entry["response_tokens"] += call.response_tokens
+                entry["retries"] += call.retries
+        return summary
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "api_provider": self.api_provider,
+            "started_at": self.started_at,
+            "wall_ms": self.wall_ms,
+            "queue_wait_ms": self.queue_wait_ms,
+            "status": self.status,
+            "nodes": self.node_summary(),
+            "spans": [asdict(span) for span in self.spans],
+        }
+
+
+class Metrics:
+    """Thread-safe counters and histograms with Prometheus text export"""
+
+    def __init__(self, prefix: str = "canva"):
+        self.prefix = prefix
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], List[float]] = {}  # bucket counts + [sum, count]
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1.0, help: str = "", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ("counter", help))
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, help: str = "", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ("histogram", help))
+            buckets = self._histograms.setdefault(key, [0.0] * (len(HISTOGRAM_BUCKETS) + 2))
+            index = bisect.bisect_left(HISTOGRAM_BUCKETS, value)
+            if index < len(HISTOGRAM_BUCKETS):
+                buckets[index] += 1
+            buckets[-2] += value
+            buckets[-1] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Plain-dict view of all series"""
+        with self._lock:
+            return {
+                "counters": {f"{name}{dict(labels)}": value for (name, labels), value in self._counters.items()},
+                "histograms": {f"{name}{dict(labels)}": {"sum": values[-2], "count": values[-1]}
+                               for (name, labels), values in self._histograms.items()},
+            }
+
+    def to_prometheus(self) -> str:
+        """Render all series in the Prometheus text exposition format"""
+        def fmt_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            for name, (kind, help) in sorted(self._help.items()):
+                metric = f"{self.prefix}_{name}"
+                if help:
+                    lines.append(f"# HELP {metric} {help}")
+                lines.append(f"# TYPE {metric} {kind}")
+                if kind == "counter":
+                    for (series, labels), value in self._counters.items():
+                        if series == name:
+                            lines.append(f"{metric}{fmt_labels(labels)} {value}")
+                else:
+                    for (series, labels), values in self._histograms.items():
+                        if series != name:
+                            continue
+                        cumulative = 0.0
+                        for bound, count in zip(HISTOGRAM_BUCKETS, values):
+                            cumulative += count
+                            lines.append(f"{metric}_bucket{fmt_labels(labels, [('le', bound)])} {cumulative}")
+                        lines.append(f"{metric}_bucket{fmt_labels(labels, [('le', '+Inf')])} {values[-1]}")
+                        lines.append(f"{metric}_sum{fmt_labels(labels)} {values[-2]}")
+                        lines.append(f"{metric}_count{fmt_labels(labels)} {values[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: Path):
+        """Write the exposition text atomically (node_exporter textfile collector)"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        tmp_path.write_text(self.to_prometheus(), encoding="utf-8")
+        tmp_path.replace(path)
+
+
+metrics = Metrics()
+
+_traces: Dict[str, JobTrace] = {}
+_traces_lock = threading.Lock()
+_current_span: contextvars.ContextVar[Optional[NodeSpan]] = contextvars.ContextVar("current_span", default=None)
+_jsonl_lock = threading.Lock()
+
+
+def open_trace(job_id: str, api_provider: str) -> JobTrace:
+    """Start tracing a job"""
+    trace = JobTrace(job_id=job_id, api_provider=api_provider)
+    with _traces_lock:
+        _traces[job_id] = trace
+    return trace
+
+
+def get_trace(job_id: Optional[str]) -> Optional[JobTrace]:
+    if not job_id:
+        return None
+    with _traces_lock:
+        return _traces.get(job_id)
+
+
+def _rotate_if_full(path: Path, max_bytes: int, backups: int):
+    """Shift path -> path.1 -> ... -> path.<backups> once it reaches max_bytes; the oldest is dropped"""
+    try:
+        if not max_bytes or path.stat().st_size < max_bytes:
+            return
+    except FileNotFoundError:
+        return
+    for index in range(backups - 1, 0, -1):
+        older = path.with_name(f"{path.name}.{index}")
+        if older.exists():
+            older.replace(path.with_name(f"{path.name}.{index + 1}"))
+    if backups:
+        path.replace(path.with_name(f"{path.name}.1"))
+    else:
+        path.unlink()
+
+
+def close_trace(job_id: str, status: str) -> Optional[JobTrace]:
+    """Finish a job's trace, update job metrics and export it"""
+    with _traces_lock:
+        trace = _traces.pop(job_id, None)
+    if trace is None:
+        return None
+
+    trace.finish(status)
+    metrics.inc("jobs_total", help="Generation jobs by final status", provider=trace.api_provider, status=status)
+    metrics.observe("job_seconds", trace.wall_ms / 1000, help="Job wall time", provider=trace.api_provider)
+
+    if config.TRACE_LOG_FILE:
+        path = Path(config.TRACE_LOG_FILE)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with _jsonl_lock:
+            _rotate_if_full(path, config.TRACE_LOG_MAX_BYTES, config.TRACE_LOG_BACKUPS)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(trace.to_dict()) + "\n")
+    if config.METRICS_TEXTFILE:
+        metrics.write_prometheus(config.METRICS_TEXTFILE)
+    return trace
+
+
+class node_span:
+    """Context manager timing a node and making its span current for LLM call records"""
+
+    def __init__(self, job_id: Optional[str], node: str):
+        self.trace = get_trace(job_id)
+        self.node = node
+        self.span = None
+        self._token = None
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        if self.trace is not None:
+            self.span = self.trace.start_span(self.node)
+            self._token = _current_span.set(self.span)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        if self.span is not None:
+            self.span.wall_ms = elapsed * 1000
+            _current_span.reset(self._token)
+        metrics.observe("node_seconds", elapsed, help="Graph node wall time", node=self.node)
+        return False
+
+
+def mark_cache_hit():
+    """Flag the current node as served from the stage cache"""
+    span = _current_span.get()
+    if span is not None:
+        span.cache_hit = True
+    metrics.inc("stage_cache_hits_total", help="Stages served from the stage cache",
+                node=span.node if span is not None else "unknown")
+
+
+def prompt_size(messages: List) -> Tuple[int, int]:
+    """Text characters and inline image bytes (base64 data URIs) of a prompt"""
+    text_chars = image_bytes = 0
+    for message in messages:
+        content = message.content
+        if not isinstance(content, list):
+            text_chars += len(str(content))
+            continue
+        for part in content:
+            if not isinstance(part, dict):
+                continue
+            if part.get("type") == "image_url":
+                url = part["image_url"]
+                url = url.get("url", "") if isinstance(url, dict) else url
+                image_bytes += len(url)
+            else:
+                text_chars += len(part.get("text", ""))
+    return text_chars, image_bytes
+
+
+def record_llm_call(provider: str, latency: float, prompt_chars: int, response_chars: int,
+                    usage: Optional[Dict[str, int]] = None, image_bytes: int = 0,
+                    retries: int = 0, error: Optional[str] = None):
+    """Record one LLM call on the current span and in the aggregated metrics"""
+    span = _current_span.get()
+    node = span.node if span is not None else "unknown"
+    estimated = not usage
+    prompt_tokens = usage["prompt_tokens"] if usage else estimate_tokens(prompt_chars)
+    response_tokens = usage["response_tokens"] if usage else estimate_tokens(response_chars)
+
+    if span is not None:
+        span.llm_calls.append(LLMCall(
+            provider=provider, latency_ms=latency * 1000, prompt_chars=prompt_chars,
+            response_chars=response_chars, prompt_tokens=prompt_tokens, response_tokens=response_tokens,
+            tokens_estimated=estimated, image_bytes=image_bytes, retries=retries, error=error,
+        ))
+
+    metrics.observe("llm_seconds", latency, help="LLM call latency", provider=provider, node=node)
+    metrics.inc("llm_calls_total", help="LLM calls", provider=provider, node=node,
+                status="error" if error else "ok")
+    metrics.inc("llm_prompt_tokens_total", prompt_tokens, help="Prompt tokens (estimated when not reported)",
+                provider=provider, node=node)
+    metrics.inc("llm_response_tokens_total", response_tokens, help="Response tokens (estimated when not reported)",
+                provider=provider, node=node)
+    metrics.inc("llm_prompt_chars_total", prompt_chars, help="Prompt characters", provider=provider, node=node)
+    metrics.inc("llm_response_chars_total", response_chars, help="Response characters", provider=provider, node=node)
+    if image_bytes:
+        metrics.inc("llm_image_bytes_total", image_bytes, help="Inline image payload bytes", provider=provider)
+    if retries:
+        metrics.inc("llm_retries_total", retries, help="LLM call retries", provider=provider, node=node)
+
+
+def response_usage(response) -> Optional[Dict[str, int]]:
+    """Provider-reported token usage of a response, if any"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return {"prompt_tokens": usage.get("input_tokens", 0), "response_tokens": usage.get("output_tokens", 0)}
+
+    metadata = getattr(response, "response_metadata", None) or {}
+    token_usage = metadata.get("token_usage")  # OpenAI-compatible
+    if token_usage:
+        return {"prompt_tokens": token_usage.get("prompt_tokens", 0),
+                "response_tokens": token_usage.get("completion_tokens", 0)}
+    gemini_usage = metadata.get("usage_metadata")
+    if gemini_usage:
+        return {"prompt_tokens": gemini_usage.get("prompt_token_count", 0),
+                "response_tokens": gemini_usage.get("candidates_token_count", 0)}
+    return None
@@ -0,0 +1,202 @@
+"""
+Tolerant JSON parsing for model output
+
+Models asked for JSON still wrap it in markdown fences, add prose around it,
+leave trailing commas, use single quotes or Python literals, or stop mid-way
+when they hit their token limit. repair_json rewrites such text into valid
+JSON in a single pass, tracking the open containers; output cut off mid-value
+is truncated back to the last complete value and its containers are closed.
+"""
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+WORD_PATTERN = re.compile(r"[A-Za-z0-9_+\-.$]+")
+NUMBER_PATTERN = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+LITERALS = {
+    "true": "true", "True": "true", "false": "false", "False": "false",
+    "null": "null", "None": "null", "undefined": "null", "NaN": "null",
+}
+ESCAPES = set('"\\/bfnrtu')
+
+
+class JSONRepairError(ValueError):
+    """The text holds no JSON value that could be recovered"""
+
+
+class _Frame:
+    """An open object or array; state is what the container expects next"""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.state = "key" if kind == "{" else "value"
+
+
+def _read_string(text: str, index: int) -> Tuple[str, int]:
+    """Read a quoted string starting at index as a JSON string (closed at the end of the text); returns (json, next index)"""
+    quote = text[index]
+    chars = ['"']
+    index += 1
+    while index < len(text):
+        char = text[index]
+        if char == quote:
+            chars.append('"')
+            return "".join(chars), index + 1
+        if char == "\\" and index + 1 < len(text):
+            following = text[index + 1]
+            if following == quote and quote == "'":
+                chars.append("'")
+            elif following in ESCAPES:
+                chars.append(char + following)
+            else:
+                chars.append("\\\\" + following)
+            index += 2
+            continue
+        if char == '"':
+            chars.append('\\"')
+        elif char < " ":
+            chars.append(json.dumps(char)[1:-1])
+        else:
+            chars.append(char)
+        index += 1
+    chars.append('"')
+    return "".join(chars), index
+
+
+def _word(word: str, as_key: bool) -> str:
+    """A bare word as JSON: literal, number, or (unquoted keys and stray text) a string"""
+    if not as_key:
+        if word in LITERALS:
+            return LITERALS[word]
+        if NUMBER_PATTERN.fullmatch(word):
+            return word
+    return json.dumps(word)
+
+
+def _json_start(text: str) -> int:
+    """Index of the first { or [ (after any markdown fence)"""
+    fence = text.find("```")
+    if fence >= 0:
+        newline = text.find("\n", fence)
+        text_start = newline + 1 if newline >= 0 else fence + 3
+    else:
+        text_start = 0
+    starts = [i for i in (text.find("{", text_start), text.find("[", text_start)) if i >= 0]
+    return min(starts) if starts else -1
+
+
+def repair_json(text: str) -> str:
+    """Rewrite model output into valid JSON text; raises JSONRepairError when nothing is recoverable"""
+    index = _json_start(text)
+    if index < 0:
+        raise JSONRepairError("no JSON object or array found")
+
+    out: List[str] = []
+    stack: List[_Frame] = []
+    safe: Optional[Tuple[int, List[str]]] = None  # (output length, open container kinds)
+
+    def completed():
+        if stack:
+            stack[-1].state = "comma"
+        safe_point()
+
+    def safe_point():
+        nonlocal safe
+        safe = (len(out), [frame.kind for frame in stack])
+
+    def begin_value() -> bool:
+        """Prepare for a value or key; False when one isn't expected here"""
+        if not stack:
+            return not out
+        if stack[-1].state == "comma":  # missing comma between values
+            out.append(",")
+            stack[-1].state = "key" if stack[-1].kind == "{" else "value"
+        return stack[-1].state in ("key", "value")
+
+    while index < len(text):
+        char = text[index]
+        if char.isspace():
+            index += 1
+        elif text.startswith("//", index):
+            newline = text.find("\n", index)
+            index = len(text) if newline < 0 else newline
+        elif text.startswith("/*", index):
+            close = text.find("*/", index + 2)
+            index = len(text) if close < 0 else close + 2
+        elif char in "{[":
+            index += 1
+            if not begin_value():
+                continue
+            out.append(char)
+            stack.append(_Frame(char))
+            safe_point()
+        elif char in "}]":
+            index += 1
+            if not stack:
+                continue
+            frame = stack.pop()
+            if out[-1] == ",":
+                out.pop()
+            elif frame.state in ("colon", "value") and frame.kind == "{":  # key without a value
+                out.append("null" if frame.state == "value" else ":null")
+            out.append("}" if frame.kind == "{" else "]")
+            completed()
+            if not stack:
+                break
+        elif char == ",":
+            index += 1
+            if stack and stack[-1].state == "comma":
+                out.append(",")
+                stack[-1].state = "key" if stack[-1].kind == "{" else "value"
+        elif char == ":":
+            index += 1
+            if stack and stack[-1].state == "colon":
+                out.append(":")
+                stack[-1].state = "value"
+        elif char in "\"'":
+            if not begin_value():
+                _, index = _read_string(text, index)
+                continue
+            string, index = _read_string(text, index)
+            out.append(string)
+            if stack and stack[-1].state == "key":
+                stack[-1].state = "colon"
+            else:
+                completed()
+        else:
+            match = WORD_PATTERN.match(text, index)
+            if not match:
+                index += 1
+                continue
+            index = match.end()
+            if not begin_value():
+                continue
+            as_key = bool(stack) and stack[-1].state == "key"
+            out.append(_word(match.group(), as_key))
+            if as_key:
+                stack[-1].state = "colon"
+            else:
+                completed()
+                if not stack:
+                    break
+
+    if stack:  # truncated: cut back to the last complete value and close what was open
+        if safe is None:
+            raise JSONRepairError("JSON ends before its first value")
+        length, kinds = safe
+        del out[length:]
+        out.extend("}" if kind == "{" else "]" for kind in reversed(kinds))
+    return "".join(out)
+
+
+def loads_tolerant(text: str) -> Tuple[Any, bool]:
+    """Parse model output as JSON, repairing it when needed; returns (value, whether it was repaired)"""
+    try:
+        return json.loads(text.strip()), False
+    except json.JSONDecodeError:
+        pass
+    repaired = repair_json(text)
+    try:
+        return json.loads(repaired), True
+    except json.JSONDecodeError as e:
+        raise JSONRepairError(f"could not repair JSON: {e}") from None
@@ -0,0 +1,664 @@
+"""
+Resilient LLM call layer shared by all graph nodes
+
+Every call goes through a per-provider guard: a token bucket for the
+provider's request rate and a circuit breaker that stops hammering a provider
+that keeps failing. Transient errors (429, 5xx, timeouts, dropped
+connections) are retried with jittered exponential backoff within a per-call
+deadline. When retries are exhausted, the call optionally falls back to the
+other configured provider. Each logical call is recorded once, with its
+retry count, in the job trace and metrics.
+
+Opt-in hedging (HEDGE_ENABLED) duplicates a slow call to the secondary
+provider once the primary exceeds a percentile of its observed latency; the
+first valid response wins and the other branch is cancelled.
+"""
+import asyncio
+import contextvars
+import math
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from typing import Dict, List, Optional
+import httpx
+from langchain_core.messages import AIMessage
+from utils.events import emit
+from utils.instrumentation import metrics, prompt_size, record_llm_call, response_usage
+from utils.llm_factory import disable_json_mode, get_llm, supports_json_mode, with_json_mode, with_timeout
+from utils.rate_limit import per_minute
+from utils.streaming import get_stream
+import config
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+# Exception class names of provider SDKs that signal a transient failure
+RETRYABLE_ERROR_NAMES = {
+    "RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError",
+    "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded",
+}
+
+# Parameter names that show up when a provider or its SDK refuses the JSON mode option
+JSON_MODE_ERROR_HINTS = ("response_format", "response_mime_type", "generation_config", "json_object")
+
+
+class CallDeadlineExceeded(TimeoutError):
+    """An LLM call attempt (or the whole call with its retries) ran past its deadline"""
+
+
+class CircuitOpenError(RuntimeError):
+    """The provider's circuit breaker is open; calls fail fast until the cooldown ends"""
+
+
+class HedgeLost(Exception):
+    """A hedged call branch was cancelled because the other provider answered first"""
+
+
+class EmptyResponseError(Exception):
+    """A provider answered with no content"""
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures; lets one trial call through after `cooldown`"""
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        """Whether a call may be attempted now"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self._trial_running:
+                return False
+            self._trial_running = True  # half-open: one trial call
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def release_trial(self):
+        """End a half-open trial that neither succeeded nor failed transiently (bad request, lost hedge)"""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self) -> bool:
+        """Count a transient failure; True if this opened (or re-opened) the circuit"""
+        with self._lock:
+            self.failures += 1
+            reopened = self._trial_running
+            self._trial_running = False
+            if reopened or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+
+class LatencyHistogram:
+    """
+    Log-bucketed latency histogram (~10% resolution) used to pick hedge delays.
+    Counts are halved once they exceed `window` samples, so old latencies fade out.
+    """
+
+    GROWTH = 1.1
+    MIN_SECONDS = 0.01
+
+    def __init__(self, window: int):
+        self.window = window
+        self.count = 0.0
+        self._buckets: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, seconds: float) -> int:
+        return max(0, math.ceil(math.log(max(seconds, self.MIN_SECONDS) / self.MIN_SECONDS, self.GROWTH)))
+
+    def observe(self, seconds: float):
+        with self._lock:
+            bucket = self._bucket(seconds)
+            self._buckets[bucket] = self._buckets.get(bucket, 0.0) + 1
+            self.count += 1
+            if self.count > self.window:
+                self._buckets = {b: c / 2 for b, c in self._buckets.items() if c >= 1}
+                self.count = sum(self._buckets.values())
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile, or None without samples"""
+        with self._lock:
+            if not self.count:
+                return None
+            target = q * self.count
+            seen = 0.0
+            for bucket in sorted(self._buckets):
+                seen += self._buckets[bucket]
+                if seen >= target:
+                    return self.MIN_SECONDS * self.GROWTH ** bucket
+            return self.MIN_SECONDS * self.GROWTH ** max(self._buckets)
+
+
+class ProviderGuard:
+    """Rate limit and circuit breaker of one provider"""
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        rpm = config.LLM_RATE_LIMITS.get(provider)
+        self.bucket = per_minute(rpm, config.LLM_RATE_BURST) if rpm else None
+        self.breaker = CircuitBreaker(config.LLM_BREAKER_FAILURES, config.LLM_BREAKER_COOLDOWN)
+        self.latency: Dict[str, LatencyHistogram] = {}  # channel -> successful attempt latencies
+        self._lock = threading.Lock()
+
+    def latency_histogram(self, channel: Optional[str]) -> LatencyHistogram:
+        with self._lock:
+            histogram = self.latency.get(channel)
+            if histogram is None:
+                histogram = self.latency[channel] = LatencyHistogram(config.HEDGE_WINDOW)
+            return histogram
+
+
+_guards: Dict[str, ProviderGuard] = {}
+_guards_lock = threading.Lock()
+_attempt_pool = ThreadPoolExecutor(max_workers=config.HTTP_MAX_CONNECTIONS, thread_name_prefix="llm-call")
+_hedge_pool = ThreadPoolExecutor(max_workers=config.HTTP_MAX_CONNECTIONS, thread_name_prefix="llm-hedge")
+
+
+def get_guard(provider: str) -> ProviderGuard:
+    """Process-wide guard of a provider, created on first use"""
+    with _guards_lock:
+        guard = _guards.get(provider)
+        if guard is None:
+            guard = _guards[provider] = ProviderGuard(provider)
+        return guard
+
+
+def reset_guards():
+    """Forget rate limit and breaker state (e.g. after configuration changes)"""
+    with _guards_lock:
+        _guards.clear()
+
+
+def is_retryable(error: Exception) -> bool:
+    """Whether an error is transient: rate limits, server errors, timeouts, dropped connections"""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError, httpx.TransportError)):
+        return True
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS
+    return type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+
+def json_mode_rejected(error: Exception) -> bool:
+    """Whether a non-transient error is the provider (or its SDK) refusing the JSON mode option"""
+    if is_retryable(error):
+        return False
+    text = str(error).lower()
+    return any(hint in text for hint in JSON_MODE_ERROR_HINTS)
+
+
+def _retry_after(error: Exception) -> float:
+    """Seconds the provider asked us to wait (Retry-After), or 0"""
+    value = getattr(error, "retry_after", None)
+    if value is None:
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        value = headers.get("retry-after")
+    try:
+        return max(0.0, float(value)) if value is not None else 0.0
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def backoff_delay(attempt: int, error: Exception = None) -> float:
+    """Full-jitter exponential backoff for the given retry attempt (1-based), honoring Retry-After"""
+    ceiling = min(config.LLM_BACKOFF_MAX, config.LLM_BACKOFF_BASE * 2 ** (attempt - 1))
+    return max(random.uniform(0, ceiling), _retry_after(error) if error else 0.0)
+
+
+def _configured(provider: str) -> bool:
+    if provider == "gemini":
+        return bool(config.GEMINI_API_KEY)
+    if provider == "openrouter":
+        return bool(config.OPENROUTER_API_KEY)
+    return True
+
+
+def _providers(primary: str) -> List[str]:
+    """The primary provider, then the configured fallback when enabled and usable"""
+    providers = [primary]
+    fallback = config.LLM_FALLBACK_PROVIDERS.get(primary) if config.LLM_FALLBACK_ENABLED else None
+    if fallback and fallback != primary and _configured(fallback):
+        providers.append(fallback)
+    return providers
+
+
+def _secondary(primary: str) -> Optional[str]:
+    """The provider hedged requests go to, when it is configured"""
+    secondary = config.LLM_FALLBACK_PROVIDERS.get(primary)
+    return secondary if secondary and secondary != primary and _configured(secondary) else None
+
+
+def hedge_delay(provider: str, channel: Optional[str]) -> float:
+    """Seconds to wait for the provider before hedging: its HEDGE_PERCENTILE latency on this channel"""
+    histogram = get_guard(provider).latency_histogram(channel)
+    if histogram.count < config.HEDGE_MIN_SAMPLES:
+        return config.HEDGE_INITIAL_DELAY
+    return max(config.HEDGE_MIN_DELAY, histogram.quantile(config.HEDGE_PERCENTILE))
+
+
+def _error_text(error: Exception) -> str:
+    return f"{type(error).__name__}: {error}"
+
+
+class _Call:
+    """Bookkeeping of one logical call across its attempts and providers"""
+
+    def __init__(self, messages: List, job_id: Optional[str], channel: Optional[str], deadline: float = None,
+                 json_mode: bool = False):
+        self.messages = messages
+        self.json_mode = json_mode
+        self.job_id = job_id
+        self.channel = channel
+        self.stream = get_stream(job_id) if channel else None
+        self.started = time.perf_counter()
+        self.deadline = deadline or self.started + config.LLM_CALL_DEADLINE
+        self.retries = 0
+        self.cancelled = threading.Event()  # set when the call lost a hedge race
+
+    def hedge_branch(self) -> "_Call":
+        """A duplicate of this call for the secondary provider: same deadline, no token stream"""
+        branch = _Call(self.messages, self.job_id, self.channel, deadline=self.deadline, json_mode=self.json_mode)
+        branch.stream = None
+        return branch
+
+    def check_cancelled(self):
+        if self.cancelled.is_set():
+            raise HedgeLost("another provider answered first")
+
+    def remaining(self) -> float:
+        return self.deadline - time.perf_counter()
+
+    def attempt_timeout(self) -> float:
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise CallDeadlineExceeded(f"LLM call deadline of {config.LLM_CALL_DEADLINE:.0f}s exceeded")
+        return min(config.LLM_ATTEMPT_TIMEOUT, remaining)
+
+    def rate_wait(self, guard: ProviderGuard) -> float:
+        """Seconds to wait for the provider's rate limit; raises when that would pass the deadline"""
+        if guard.bucket is None:
+            return 0.0
+        wait = guard.bucket.try_acquire()
+        if wait and wait > self.remaining():
+            raise CallDeadlineExceeded(f"{guard.provider} rate limit wait of {wait:.1f}s exceeds the call deadline")
+        return wait
+
+    def retry_delay(self, guard: ProviderGuard, attempt: int, error: Exception) -> Optional[float]:
+        """Backoff before the next attempt, or None when this provider should be given up"""
+        if attempt > config.LLM_MAX_RETRIES or not is_retryable(error):
+            return None
+        delay = backoff_delay(attempt, error)
+        if delay >= self.remaining():
+            return None
+        self.retries += 1
+        emit(self.job_id, f"{guard.provider} call failed ({type(error).__name__}), retry {attempt} in {delay:.1f}s")
+        return delay
+
+    def failed(self, guard: ProviderGuard, error: Exception):
+        """Update the breaker after a failed attempt; other outcomes just release a half-open trial"""
+        if not is_retryable(error) or self.cancelled.is_set():
+            guard.breaker.release_trial()
+        elif guard.breaker.record_failure():
+            metrics.inc("llm_circuit_opened_total", help="Circuit breaker openings", provider=guard.provider)
+            emit(self.job_id, f"{guard.provider} circuit breaker opened for {config.LLM_BREAKER_COOLDOWN:.0f}s")
+
+    def without_json_mode(self, provider: str, error: Exception):
+        """Plain client for the provider after it rejected JSON mode; the attempt is repeated once"""
+        disable_json_mode(provider)
+        metrics.inc("llm_json_mode_rejected_total", help="Providers that refused the JSON mode option", provider=provider)
+        emit(self.job_id, f"{provider} rejected JSON mode ({type(error).__name__}), retrying without it")
+        return get_llm(provider)
+
+    def record(self, provider: str, response=None, error: Exception = None):
+        prompt_chars, image_bytes = prompt_size(self.messages)
+        record_llm_call(
+            provider=provider,
+            latency=time.perf_counter() - self.started,
+            prompt_chars=prompt_chars,
+            response_chars=len(response.content) if response is not None else 0,
+            usage=response_usage(response) if response is not None else None,
+            image_bytes=image_bytes,
+            retries=self.retries,
+            error=_error_text(error) if error else None,
+        )
+
+    def fallback(self, primary: str, provider: str, error: Exception):
+        metrics.inc("llm_fallbacks_total", help="Calls moved to the fallback provider", provider=provider)
+        emit(self.job_id, f"{primary} unavailable ({type(error).__name__}), falling back to {provider}")
+
+
+def _stream_attempt(llm, call: _Call, cancelled: threading.Event):
+    """One synchronous attempt, streaming tokens to the job's stream when one is open"""
+    if call.stream is None:
+        return llm.invoke(call.messages)
+    call.stream.start_channel(call.channel)
+    chunks = []
+    for chunk in llm.stream(call.messages):
+        if cancelled.is_set() or call.cancelled.is_set():
+            raise CallDeadlineExceeded("attempt abandoned after its deadline or a lost hedge")
+        chunks.append(chunk.content)
+        call.stream.write(call.channel, chunk.content)
+    return AIMessage(content="".join(chunks))
+
+
+def _call_provider(call: _Call, provider: str):
+    """Attempt the call against one provider, retrying transient errors; raises the last error"""
+    guard = get_guard(provider)
+    json_mode = call.json_mode and supports_json_mode(provider)
+    llm = with_json_mode(get_llm(provider), provider) if json_mode else get_llm(provider)
+    attempt = 0
+    while True:
+        call.check_cancelled()
+        if guard.breaker.state == "open":
+            raise CircuitOpenError(f"{provider} circuit breaker is open")
+        wait_seconds = call.rate_wait(guard)
+        while wait_seconds:
+            time.sleep(wait_seconds)
+            wait_seconds = call.rate_wait(guard)
+        call.attempt_timeout()  # fails fast once the deadline has passed
+        if not guard.breaker.allow():
+            raise CircuitOpenError(f"{provider} circuit breaker is open")
+
+        attempt_started = threading.Event()
+        cancelled = threading.Event()
+        timing = {}
+
+        def run_attempt():
+            # The attempt's timeout starts when a pool worker picks it up, not while it is queued
+            try:
+                timing["timeout"] = call.attempt_timeout()
+                timing["started"] = time.perf_counter()
+            finally:
+                attempt_started.set()
+            return _stream_attempt(with_timeout(llm, provider, timing["timeout"]), call, cancelled)
+
+        future = _attempt_pool.submit(contextvars.copy_context().run, run_attempt)
+        if not attempt_started.wait(max(0.0, call.remaining())) and future.cancel():
+            guard.breaker.release_trial()  # never reached the provider
+            raise CallDeadlineExceeded(f"{provider} call attempt queued past the call deadline")
+        if not attempt_started.wait(config.LLM_ATTEMPT_TIMEOUT) or "started" not in timing:
+            # Picked up by a worker only once the deadline had passed: it never reached the provider
+            cancelled.set()
+            guard.breaker.release_trial()
+            raise CallDeadlineExceeded(f"{provider} call attempt queued past the call deadline")
+        try:
+            response = future.result(timeout=timing["timeout"] - (time.perf_counter() - timing["started"]))
+        except FutureTimeoutError:
+            cancelled.set()
+            error = CallDeadlineExceeded(f"{provider} call attempt exceeded {timing['timeout']:.1f}s")
+        except Exception as e:
+            error = e
+        except BaseException:
+            cancelled.set()
+            guard.breaker.release_trial()
+            raise
+        else:
+            guard.breaker.record_success()
+            guard.latency_histogram(call.channel).observe(time.perf_counter() - timing["started"])
+            return response
+
+        call.failed(guard, error)
+        call.check_cancelled()
+        if json_mode and json_mode_rejected(error):
+            json_mode = False
+            llm = call.without_json_mode(provider, error)
+            continue
+        attempt += 1
+        delay = call.retry_delay(guard, attempt, error)
+        if delay is None:
+            raise error
+        call.cancelled.wait(delay)
+
+
+def _gives_up(error: Exception) -> bool:
+    """Errors another provider won't fix (e.g. a bad request)"""
+    return not is_retryable(error) and not isinstance(error, CircuitOpenError)
+
+
+def _valid(response) -> AIMessage:
+    if not (response.content or "").strip():
+        raise EmptyResponseError("empty response")
+    return response
+
+
+def _hedge_started(call: _Call, primary: str, secondary: str, delay: float, error: Exception = None):
+    reason = f"failed ({type(error).__name__})" if error else f"slower than {delay:.1f}s"
+    emit(call.job_id, f"{primary} {reason}, hedging the {call.channel} call with {secondary}")
+
+
+def _hedge_finished(call: _Call, winner: _Call, provider: str, loser: Optional[_Call], loser_provider: str,
+                    primary: str, response):
+    """Bookkeeping once a hedged call has a winner: cancel and record the loser, surface the response"""
+    metrics.inc("llm_hedges_total", help="Hedged LLM calls by winning branch",
+                outcome="primary" if provider == primary else "secondary", channel=call.channel or "")
+    if loser is not None:
+        loser.cancelled.set()
+        get_guard(loser_provider).latency_histogram(call.channel).observe(time.perf_counter() - loser.started)
+        loser.record(loser_provider, error=HedgeLost(f"{provider} answered first"))
+    if winner is not call and call.stream is not None:
+        call.stream.start_channel(call.channel)
+        call.stream.write(call.channel, response.content)
+    emit(call.job_id, f"Hedged {call.channel} call answered by {provider}")
+    winner.record(provider, response)
+
+
+def _hedged_call(call: _Call, primary: str, secondary: str):
+    """Race the primary against a delayed duplicate on the secondary provider"""
+    delay = hedge_delay(primary, call.channel)
+    branches = {primary: call, secondary: call.hedge_branch()}
+    futures = {
+        _hedge_pool.submit(contextvars.copy_context().run, lambda: _valid(_call_provider(call, primary))): primary
+    }
+    done, _ = wait(futures, timeout=delay)
+    early_error = next(iter(done)).exception() if done else None
+    if done and early_error is None:
+        response = next(iter(done)).result()
+        call.record(primary, response)
+        return response
+    if early_error is not None and _gives_up(early_error):
+        call.record(primary, error=early_error)
+        raise early_error
+
+    _hedge_started(call, primary, secondary, delay, early_error)
+    hedge = branches[secondary]
+    futures[_hedge_pool.submit(contextvars.copy_context().run, lambda: _valid(_call_provider(hedge, secondary)))] = secondary
+    pending = {future for future in futures if not future.done()}
+    errors = {primary: early_error} if early_error else {}
+    while pending:
+        # Branches give up at the call deadline; the margin covers an attempt already under way
+        done, pending = wait(pending, timeout=max(0.0, call.remaining()) + config.LLM_ATTEMPT_TIMEOUT,
+                             return_when=FIRST_COMPLETED)
+        if not done:
+            for future in pending:
+                branches[futures[future]].cancelled.set()
+                errors[futures[future]] = CallDeadlineExceeded(f"{futures[future]} hedge branch outlived the call deadline")
+            break
+        for future in done:
+            provider = futures[future]
+            if future.exception() is not None:
+                errors[provider] = future.exception()
+                continue
+            loser_provider = secondary if provider == primary else primary
+            loser = branches[loser_provider] if loser_provider not in errors else None
+            _hedge_finished(call, branches[provider], provider, loser, loser_provider, primary, future.result())
+            return future.result()
+
+    for provider, error in errors.items():
+        branches[provider].record(provider, error=error)
+    raise errors[primary]
+
+
+def call_llm(messages: List, provider: str, job_id: Optional[str] = None, channel: Optional[str] = None,
+             hedge: bool = False, json_mode: bool = False):
+    """
+    Invoke the provider's model with rate limiting, retries, deadlines, circuit breaking
+    and optional fallback. Tokens stream to the job's `channel` when a stream is open.
+    With hedge (and HEDGE_ENABLED), slow calls are duplicated to the secondary provider.
+    With json_mode, each provider is asked for its native JSON output.
+    """
+    call = _Call(messages, job_id, channel, json_mode=json_mode)
+    secondary = _secondary(provider)
+    if hedge and config.HEDGE_ENABLED and secondary:
+        return _hedged_call(call, provider, secondary)
+
+    error: Exception = CircuitOpenError(f"{provider} circuit breaker is open")
+    for index, current in enumerate(_providers(provider)):
+        if index:
+            call.fallback(provider, current, error)
+        try:
+            response = _call_provider(call, current)
+        except Exception as e:
+            error = e
+            if _gives_up(error):
+                break
+            continue
+        call.record(current, response)
+        return response
+
+    call.record(current, error=error)
+    raise error
+
+
+async def _astream_attempt(llm, call: _Call):
+    """Async variant of _stream_attempt"""
+    if call.stream is None:
+        return await llm.ainvoke(call.messages)
+    call.stream.start_channel(call.channel)
+    chunks = []
+    async for chunk in llm.astream(call.messages):
+        chunks.append(chunk.content)
+        call.stream.write(call.channel, chunk.content)
+    return AIMessage(content="".join(chunks))
+
+
+async def _acall_provider(call: _Call, provider: str):
+    """Async variant of _call_provider"""
+    guard = get_guard(provider)
+    json_mode = call.json_mode and supports_json_mode(provider)
+    llm = with_json_mode(get_llm(provider), provider) if json_mode else get_llm(provider)
+    attempt = 0
+    while True:
+        if guard.breaker.state == "open":
+            raise CircuitOpenError(f"{provider} circuit breaker is open")
+        wait_seconds = call.rate_wait(guard)
+        while wait_seconds:
+            await asyncio.sleep(wait_seconds)
+            wait_seconds = call.rate_wait(guard)
+        timeout = call.attempt_timeout()
+        if not guard.breaker.allow():
+            raise CircuitOpenError(f"{provider} circuit breaker is open")
+
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(_astream_attempt(with_timeout(llm, provider, timeout), call), timeout)
+        except asyncio.TimeoutError:
+            error = CallDeadlineExceeded(f"{provider} call attempt exceeded {timeout:.1f}s")
+        except Exception as e:
+            error = e
+        except BaseException:  # cancelled, e.g. the losing branch of a hedge
+            guard.breaker.release_trial()
+            raise
+        else:
+            guard.breaker.record_success()
+            guard.latency_histogram(call.channel).observe(time.perf_counter() - started)
+            return response
+
+        call.failed(guard, error)
+        if json_mode and json_mode_rejected(error):
+            json_mode = False
+            llm = call.without_json_mode(provider, error)
+            continue
+        attempt += 1
+        delay = call.retry_delay(guard, attempt, error)
+        if delay is None:
+            raise error
+        await asyncio.sleep(delay)
+
+
+async def _ahedged_call(call: _Call, primary: str, secondary: str):
+    """Async variant of _hedged_call; the losing branch's task is cancelled"""
+    async def branch(branch_call: _Call, provider: str):
+        return _valid(await _acall_provider(branch_call, provider))
+
+    delay = hedge_delay(primary, call.channel)
+    branches = {primary: call, secondary: call.hedge_branch()}
+    tasks = {asyncio.ensure_future(branch(call, primary)): primary}
+    done, _ = await asyncio.wait(tasks, timeout=delay)
+    early_error = next(iter(done)).exception() if done else None
+    if done and early_error is None:
+        response = next(iter(done)).result()
+        call.record(primary, response)
+        return response
+    if early_error is not None and _gives_up(early_error):
+        call.record(primary, error=early_error)
+        raise early_error
+
+    _hedge_started(call, primary, secondary, delay, early_error)
+    tasks[asyncio.ensure_future(branch(branches[secondary], secondary))] = secondary
+    pending = {task for task in tasks if not task.done()}
+    errors = {primary: early_error} if early_error else {}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                provider = tasks[task]
+                if task.exception() is not None:
+                    errors[provider] = task.exception()
+                    continue
+                loser_provider = secondary if provider == primary else primary
+                loser = branches[loser_provider] if loser_provider not in errors else None
+                _hedge_finished(call, branches[provider], provider, loser, loser_provider, primary, task.result())
+                return task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    for provider, error in errors.items():
+        branches[provider].record(provider, error=error)
+    raise errors[primary]
+
+
+async def acall_llm(messages: List, provider: str, job_id: Optional[str] = None, channel: Optional[str] = None,
+                    hedge: bool = False, json_mode: bool = False):
+    """Async variant of call_llm"""
+    call = _Call(messages, job_id, channel, json_mode=json_mode)
+    secondary = _secondary(provider)
+    if hedge and config.HEDGE_ENABLED and secondary:
+        return await _ahedged_call(call, provider, secondary)
+
+    error: Exception = CircuitOpenError(f"{provider} circuit breaker is open")
+    for index, current in enumerate(_providers(provider)):
+        if index:
+            call.fallback(provider, current, error)
+        try:
+            response = await _acall_provider(call, current)
+        except Exception as e:
+            error = e
+            if _gives_up(error):
+                break
+            continue
+        call.record(current, response)
+        return response
+
+    call.record(current, error=error)
+    raise error
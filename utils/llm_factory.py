@@ -1,27 +1,198 @@
 """
 LLM factory for initializing different AI providers
 """
+import asyncio
+import threading
+import httpx
 from langchain_openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI
+from utils.fake_llm import FakeChatModel
 import config
 
-def initialize_llm(api_provider: str):
-    """Initialize the appropriate LLM based on provider"""
+# Process-wide client registry, keyed by (provider, model, temperature)
+_llm_registry = {}
+_registry_lock = threading.Lock()
+
+# Provider options that make the model answer with a JSON object
+JSON_MODE_OPTIONS = {
+    "openrouter": {"response_format": {"type": "json_object"}},
+    "gemini": {"generation_config": {"response_mime_type": "application/json"}},
+    "fake": {"response_format": {"type": "json_object"}},
+}
+
+_json_mode_rejected = set()  # providers whose API or SDK refused the JSON mode option
+
+# Shared keep-alive HTTP pools for OpenAI-compatible providers
+_http_client = None
+_http_async_client = None
+_http_lock = threading.Lock()
+_closing_tasks = set()  # keeps scheduled aclose() tasks alive until they finish
+
+
+def _http_limits() -> httpx.Limits:
+    """Connection pool limits shared by the sync and async HTTP clients"""
+    return httpx.Limits(
+        max_connections=config.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def _get_http_clients():
+    """Return the shared (sync, async) httpx clients, creating them on first use"""
+    global _http_client, _http_async_client
+    with _http_lock:
+        if _http_client is None:
+            _http_client = httpx.Client(limits=_http_limits(), timeout=config.HTTP_TIMEOUT)
+            _http_async_client = httpx.AsyncClient(limits=_http_limits(), timeout=config.HTTP_TIMEOUT)
+        return _http_client, _http_async_client
+
+
+def default_model(api_provider: str) -> str:
+    """Return the configured model name for a provider"""
     if api_provider == "gemini":
+        return config.GEMINI_MODEL
+    if api_provider == "fake":
+        return config.FAKE_LLM_MODEL
+    return config.OPENROUTER_MODEL
+
+
+def initialize_llm(api_provider: str, model: str = None, temperature: float = None):
+    """Initialize the appropriate LLM based on provider"""
+    model = model or default_model(api_provider)
+    temperature = config.LLM_TEMPERATURE if temperature is None else temperature
+
+    if api_provider == "fake":
+        return FakeChatModel(
+            model=model,
+            latency=config.FAKE_LLM_LATENCY,
+            tokens_per_second=config.FAKE_LLM_TOKENS_PER_SECOND,
+            responses_path=config.FAKE_LLM_RESPONSES,
+            failure_rate=config.FAKE_LLM_FAILURE_RATE,
+            failure_kinds=config.FAKE_LLM_FAILURE_KINDS,
+            hang_seconds=config.FAKE_LLM_HANG_SECONDS,
+            seed=config.FAKE_LLM_SEED,
+        )
+    elif api_provider == "gemini":
         if not config.GEMINI_API_KEY:
             raise ValueError("GEMINI_API_KEY environment variable is not set")
         return ChatGoogleGenerativeAI(
-            model=config.GEMINI_MODEL,
+            model=model,
             google_api_key=config.GEMINI_API_KEY,
-            temperature=0.7,
-            convert_system_message_to_human=True
+            temperature=temperature,
+            convert_system_message_to_human=True,
+            max_retries=0,  # retries are handled by utils.llm_call
         )
     else:  # openrouter
         if not config.OPENROUTER_API_KEY:
             raise ValueError("OPENROUTER_API_KEY environment variable is not set")
+        http_client, http_async_client = _get_http_clients()
         return ChatOpenAI(
             base_url="https://openrouter.ai/api/v1",
             api_key=config.OPENROUTER_API_KEY,
-            model=config.OPENROUTER_MODEL,
-            temperature=0.7,
-        )
\ No newline at end of file
+            model=model,
+            temperature=temperature,
+            http_client=http_client,
+            http_async_client=http_async_client,
+            max_retries=0,  # retries are handled by utils.llm_call
+        )
+
+
+def get_llm(api_provider: str, model: str = None, temperature: float = None):
+    """
+    Return a pooled LLM client for the provider/model/temperature combination.
+    Clients are created once per process and shared across nodes, jobs and threads,
+    so HTTP connections stay alive between calls.
+    """
+    model = model or default_model(api_provider)
+    temperature = config.LLM_TEMPERATURE if temperature is None else temperature
+    key = (api_provider, model, temperature)
+
+    llm = _llm_registry.get(key)
+    if llm is not None:
+        return llm
+
+    with _registry_lock:
+        llm = _llm_registry.get(key)
+        if llm is None:
+            llm = initialize_llm(api_provider, model, temperature)
+            _llm_registry[key] = llm
+    return llm
+
+
+def _gemini_json_mode_supported() -> bool:
+    """Whether the installed google-generativeai accepts response_mime_type (added in 0.5)"""
+    try:
+        from google.generativeai.types import GenerationConfig
+    except ImportError:
+        return False
+    return "response_mime_type" in getattr(GenerationConfig, "__dataclass_fields__", {})
+
+
+def supports_json_mode(api_provider: str) -> bool:
+    """Whether the provider is asked for native JSON output"""
+    if api_provider not in JSON_MODE_OPTIONS or api_provider in _json_mode_rejected:
+        return False
+    if api_provider == "gemini":
+        return _gemini_json_mode_supported()
+    return True
+
+
+def disable_json_mode(api_provider: str):
+    """Stop asking a provider for JSON mode once it rejected the option"""
+    _json_mode_rejected.add(api_provider)
+
+
+def with_json_mode(llm, api_provider: str):
+    """Bind the provider's native JSON output mode (unchanged for providers without one)"""
+    if not supports_json_mode(api_provider):
+        return llm
+    return llm.bind(**JSON_MODE_OPTIONS[api_provider])
+
+
+def with_timeout(llm, api_provider: str, seconds: float):
+    """Bind a per-request client timeout so an abandoned attempt stops holding its worker"""
+    if api_provider == "gemini":
+        return llm  # the Gemini client only takes a timeout at construction
+    return llm.bind(timeout=seconds)
+
+
+def _take_http_clients():
+    """Detach the shared HTTP clients so the next provider client gets fresh pools"""
+    global _http_client, _http_async_client
+    with _registry_lock:
+        _llm_registry.clear()
+        _json_mode_rejected.clear()
+    with _http_lock:
+        clients = (_http_client, _http_async_client)
+        _http_client = None
+        _http_async_client = None
+    return clients
+
+
+def clear_llm_registry():
+    """
+    Drop all pooled clients (e.g. after API keys change) and close their HTTP pools.
+    Inside a running event loop the async pool is closed by a task on that loop.
+    """
+    http_client, http_async_client = _take_http_clients()
+    if http_client is not None:
+        http_client.close()
+    if http_async_client is not None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(http_async_client.aclose())
+        else:
+            task = loop.create_task(http_async_client.aclose())
+            _closing_tasks.add(task)
+            task.add_done_callback(_closing_tasks.discard)
+
+
+async def aclear_llm_registry():
+    """Async variant of clear_llm_registry that waits for the async pool to close"""
+    http_client, http_async_client = _take_http_clients()
+    if http_client is not None:
+        http_client.close()
+    if http_async_client is not None:
+        await http_async_client.aclose()
@@ -0,0 +1,141 @@
+"""
+Content-addressed output files with atomic writes and a retention policy
+
+Every saved page gets its own template-<hash> file in the output folder, so
+concurrent users never overwrite each other's downloads and re-saving the
+same content is a no-op. Files are written to a temp name and renamed into
+place; old outputs are evicted by age and total size.
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Hashable
+import config
+from utils.export import export_linked_assets
+
+OUTPUT_PREFIX = "template-"
+STALE_TEMP_SECONDS = 3600  # leftovers of interrupted writes
+
+
+def _temp_path(folder: Path, suffix: str) -> Path:
+    return folder / f".{uuid.uuid4().hex}{suffix}.tmp"
+
+
+def _entry_size(path: Path) -> int:
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+    return path.stat().st_size
+
+
+def _remove(path: Path):
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def _touch(path: Path) -> bool:
+    """Mark an existing output recent; False if it is missing (or a retention pass just removed it)"""
+    try:
+        os.utime(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def write_output(text: str, folder: Path = None, suffix: str = ".html") -> Path:
+    """Write text under its content-hash name via a temp file; existing content is not rewritten"""
+    folder = Path(folder or config.OUTPUT_FOLDER)
+    folder.mkdir(parents=True, exist_ok=True)
+    path = folder / f"{OUTPUT_PREFIX}{hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]}{suffix}"
+
+    if not _touch(path):
+        tmp_path = _temp_path(folder, suffix)
+        try:
+            with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    enforce_retention(folder, keep=path)
+    return path
+
+
+def export_output(html_code: str, folder: Path = None, as_zip: bool = True) -> Path:
+    """Export a linked-assets bundle (zip or folder) under its content-hash name"""
+    folder = Path(folder or config.OUTPUT_FOLDER)
+    folder.mkdir(parents=True, exist_ok=True)
+    name = f"{OUTPUT_PREFIX}{hashlib.sha256(html_code.encode('utf-8')).hexdigest()[:16]}"
+    path = folder / (f"{name}.zip" if as_zip else name)
+
+    if not _touch(path):
+        tmp_path = _temp_path(folder, ".zip" if as_zip else "")
+        try:
+            export_linked_assets(html_code, tmp_path, as_zip=as_zip)
+            os.replace(tmp_path, path)
+        except OSError:
+            _remove(tmp_path)
+            if not path.exists():
+                raise
+            # Otherwise a concurrent export of the same content won the rename
+        except BaseException:
+            _remove(tmp_path)
+            raise
+
+    enforce_retention(folder, keep=path)
+    return path
+
+
+def enforce_retention(folder: Path = None, max_age: float = None, max_bytes: int = None, keep: Path = None):
+    """Delete outputs older than max_age seconds, then the oldest until within max_bytes (never `keep`)"""
+    folder = Path(folder or config.OUTPUT_FOLDER)
+    max_age = config.OUTPUT_RETENTION_MAX_AGE if max_age is None else max_age
+    max_bytes = config.OUTPUT_RETENTION_MAX_BYTES if max_bytes is None else max_bytes
+    now = time.time()
+
+    entries = []
+    for path in folder.iterdir():
+        try:
+            mtime = path.stat().st_mtime
+            if path.name.startswith(".") and path.name.endswith(".tmp"):
+                if now - mtime > STALE_TEMP_SECONDS:
+                    _remove(path)
+                continue
+            if path.name.startswith(OUTPUT_PREFIX) and path != keep:
+                entries.append((mtime, path, _entry_size(path)))
+        except FileNotFoundError:
+            continue  # removed concurrently
+
+    entries.sort(key=lambda entry: entry[0])
+    total = sum(size for _, _, size in entries)
+    for mtime, path, size in entries:
+        if (max_age and now - mtime > max_age) or (max_bytes and total > max_bytes):
+            _remove(path)
+            total -= size
+
+
+class Debouncer:
+    """Lets only the last call of a burst through, per key (e.g. per browser session)"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self._latest: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+
+    def wait(self, key: Hashable) -> bool:
+        """Sleep for the delay; True if no newer call for key arrived meanwhile"""
+        with self._lock:
+            generation = self._latest.get(key, 0) + 1
+            self._latest[key] = generation
+        time.sleep(self.delay)
+        with self._lock:
+            if self._latest.get(key) != generation:
+                return False
+            del self._latest[key]
+            return True
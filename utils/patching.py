@@ -0,0 +1,288 @@
+"""
+Local patch engine for refinement edits
+
+Instead of regenerating the whole document, the refinement model returns a
+list of targeted edits: CSS rule replacements keyed by selector and
+element-level HTML patches keyed by a simple selector (tag, .class, #id,
+tag.class, tag#id). Edits are applied to the document text in order and the
+result is validated; any failure raises PatchError so the caller can fall
+back to full regeneration.
+"""
+import re
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple
+from utils.export import STYLE_BLOCK_PATTERN
+from utils.json_repair import JSONRepairError, loads_tolerant
+from utils.quality import PLACEHOLDER_TOKEN_PATTERN, VOID_ELEMENTS, tag_errors
+
+SELECTOR_PATTERN = re.compile(r"^([a-zA-Z][\w-]*)?(?:([.#])([\w-]+))?$")
+CSS_BLOCK_CHARS = re.compile(r"[{}]|</style", re.IGNORECASE)
+ELEMENT_OPS = {"replace_element", "replace_inner", "set_attribute", "insert_before", "insert_after", "remove_element"}
+CSS_OPS = {"css_rule", "css_remove"}
+
+
+class PatchError(ValueError):
+    """A refinement edit was malformed, matched nothing, or produced an invalid document"""
+
+
+@dataclass
+class _Element:
+    """Offsets of one element: [start, inner_start) is the start tag, [inner_end, end) the end tag"""
+    start: int
+    inner_start: int
+    inner_end: int
+    end: int
+
+
+class _ElementFinder(HTMLParser):
+    """Locates the elements matching a simple selector, with their offsets in the document"""
+
+    def __init__(self, html_code: str, tag: Optional[str], kind: Optional[str], value: Optional[str]):
+        super().__init__(convert_charrefs=True)
+        self.html_code = html_code
+        self.tag, self.kind, self.value = tag, kind, value
+        # getpos() counts "\n" only; splitlines() would also split on \r, \u2028 and friends
+        self.line_starts = [0] + [match.end() for match in re.finditer("\n", html_code)]
+        self.matches: List[_Element] = []
+        self._open: List[Tuple[str, int, int, bool]] = []  # (tag, start, inner_start, matched)
+
+    def _offset(self) -> int:
+        line, column = self.getpos()
+        return self.line_starts[line - 1] + column
+
+    def _matches(self, tag: str, attrs) -> bool:
+        if self.tag and tag != self.tag:
+            return False
+        if self.kind == ".":
+            return self.value in (dict(attrs).get("class") or "").split()
+        if self.kind == "#":
+            return dict(attrs).get("id") == self.value
+        return True
+
+    def handle_starttag(self, tag, attrs):
+        start = self._offset()
+        inner_start = start + len(self.get_starttag_text())
+        matched = self._matches(tag, attrs)
+        if tag in VOID_ELEMENTS:
+            if matched:
+                self.matches.append(_Element(start, inner_start, inner_start, inner_start))
+            return
+        self._open.append((tag, start, inner_start, matched))
+
+    def handle_startendtag(self, tag, attrs):
+        start = self._offset()
+        end = start + len(self.get_starttag_text())
+        if self._matches(tag, attrs):
+            self.matches.append(_Element(start, end, end, end))
+
+    def handle_endtag(self, tag):
+        start = self._offset()
+        end = self.html_code.find(">", start) + 1
+        if not any(open_tag == tag for open_tag, _, _, _ in self._open):
+            return
+        while self._open:
+            open_tag, element_start, inner_start, matched = self._open.pop()
+            if open_tag == tag:
+                if matched:
+                    self.matches.append(_Element(element_start, inner_start, start, end))
+                return
+            if matched:  # implicitly closed by this end tag
+                self.matches.append(_Element(element_start, inner_start, start, start))
+
+    def close(self):
+        super().close()
+        for _, element_start, inner_start, matched in self._open:
+            if matched:
+                self.matches.append(_Element(element_start, inner_start, len(self.html_code), len(self.html_code)))
+
+
+def find_elements(html_code: str, selector: str) -> List[_Element]:
+    """Elements matching a simple selector, in document order"""
+    match = SELECTOR_PATTERN.match(selector.strip())
+    if not match or not (match.group(1) or match.group(3)):
+        raise PatchError(f"unsupported selector '{selector}' (use tag, .class, #id, tag.class or tag#id)")
+    finder = _ElementFinder(html_code, (match.group(1) or "").lower() or None, match.group(2), match.group(3))
+    finder.feed(html_code)
+    finder.close()
+    return sorted(finder.matches, key=lambda element: element.start)
+
+
+def _css_blocks(css: str, start: int, end: int) -> List[Tuple[str, int, int]]:
+    """Top-level blocks of css[start:end] as (normalized prelude, body start, body end)"""
+    blocks = []
+    boundary = index = start
+    depth = 0
+    body_start = 0
+    while index < end:
+        char = css[index]
+        if css.startswith("/*", index):
+            close = css.find("*/", index + 2)
+            index = end if close < 0 else close + 2
+            continue
+        if char in "\"'":
+            close = css.find(char, index + 1)
+            index = end if close < 0 else close + 1
+            continue
+        if char == "{":
+            if depth == 0:
+                body_start = index + 1
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                blocks.append((_normalize_selector(css[boundary:body_start - 1]), body_start, index))
+                boundary = index + 1
+            elif depth < 0:
+                raise PatchError("unbalanced braces in the document's CSS")
+        elif char == ";" and depth == 0:
+            boundary = index + 1
+        index += 1
+    return blocks
+
+
+def _normalize_selector(selector: str) -> str:
+    selector = re.sub(r"/\*.*?\*/", "", selector, flags=re.DOTALL)
+    return re.sub(r"\s*,\s*", ",", " ".join(selector.split()))
+
+
+def _require_text(edit: Dict[str, Any], field: str) -> str:
+    value = edit.get(field)
+    if not isinstance(value, str) or not value.strip():
+        raise PatchError(f"{edit.get('op')} edit needs a non-empty '{field}'")
+    return value
+
+
+def _apply_css(html_code: str, edit: Dict[str, Any]) -> str:
+    """Replace, add or remove a CSS rule (optionally inside an @media block) in the last <style> block"""
+    selector = _normalize_selector(_require_text(edit, "selector"))
+    if CSS_BLOCK_CHARS.search(selector):
+        raise PatchError(f"invalid CSS selector '{selector}'")
+    declarations = ""
+    if edit["op"] == "css_rule":
+        declarations = _require_text(edit, "declarations").strip()
+        if CSS_BLOCK_CHARS.search(declarations):
+            raise PatchError(f"declarations for '{selector}' must not contain braces")
+
+    styles = list(STYLE_BLOCK_PATTERN.finditer(html_code))
+    if not styles:
+        if edit["op"] == "css_remove" or "</head>" not in html_code:
+            raise PatchError("the document has no <style> block to patch")
+        html_code = html_code.replace("</head>", "<style>\n</style>\n</head>", 1)
+        styles = list(STYLE_BLOCK_PATTERN.finditer(html_code))
+    style = styles[-1]
+    css_start, css_end = style.start(1), style.end(1)
+
+    container_start, container_end = css_start, css_end
+    media = edit.get("media")
+    if media:
+        prelude = _normalize_selector(f"@media {media}")
+        media_blocks = [b for b in _css_blocks(html_code, css_start, css_end) if b[0] == prelude]
+        if not media_blocks:
+            if edit["op"] == "css_remove":
+                raise PatchError(f"no '{prelude}' block to remove '{selector}' from")
+            rule = f"\n{prelude} {{\n{selector} {{ {declarations} }}\n}}\n"
+            return html_code[:css_end] + rule + html_code[css_end:]
+        _, container_start, container_end = media_blocks[0]
+
+    rules = [b for b in _css_blocks(html_code, container_start, container_end) if b[0] == selector]
+    if edit["op"] == "css_remove":
+        if not rules:
+            raise PatchError(f"no CSS rule '{selector}' to remove")
+        _, body_start, body_end = rules[0]
+        rule_start = html_code.rfind("}", container_start, body_start)
+        rule_start = max(rule_start + 1, container_start) if rule_start >= 0 else container_start
+        return html_code[:rule_start] + html_code[body_end + 1:]
+    if rules:
+        _, body_start, body_end = rules[0]
+        return html_code[:body_start] + f" {declarations} " + html_code[body_end:]
+    return html_code[:container_end] + f"\n{selector} {{ {declarations} }}\n" + html_code[container_end:]
+
+
+def _set_attribute(start_tag: str, name: str, value: str) -> str:
+    """Set (or add) an attribute in a start tag"""
+    if not re.fullmatch(r"[a-zA-Z_:][\w:.-]*", name):
+        raise PatchError(f"invalid attribute name '{name}'")
+    escaped = value.replace("&", "&amp;").replace('"', "&quot;")
+    pattern = re.compile(rf"""(\s{re.escape(name)})(\s*=\s*(?:"[^"]*"|'[^']*'|[^\s>]+))?""", re.IGNORECASE)
+    if pattern.search(start_tag):
+        return pattern.sub(lambda m: f'{m.group(1)}="{escaped}"', start_tag, count=1)
+    close = 2 if start_tag.endswith("/>") else 1
+    return f'{start_tag[:-close].rstrip()} {name}="{escaped}"{start_tag[-close:]}'
+
+
+def _apply_element(html_code: str, edit: Dict[str, Any]) -> str:
+    """Apply one element-level edit to every selected element, last match first"""
+    op = edit["op"]
+    elements = find_elements(html_code, _require_text(edit, "target"))
+    if not elements:
+        raise PatchError(f"no element matches '{edit['target']}'")
+    index = edit.get("index")
+    if isinstance(index, int) and not isinstance(index, bool):
+        if not 0 <= index < len(elements):
+            raise PatchError(f"'{edit['target']}' has no match at index {index}")
+        elements = [elements[index]]
+    elif len(elements) > 1 and not edit.get("all"):
+        raise PatchError(f"'{edit['target']}' matches {len(elements)} elements; give an index or all")
+
+    fragment = ""
+    if op in ("replace_element", "replace_inner", "insert_before", "insert_after"):
+        fragment = edit.get("html")
+        if not isinstance(fragment, str):
+            raise PatchError(f"{op} edit needs an 'html' fragment")
+        errors = tag_errors(fragment)
+        if errors:
+            raise PatchError(f"{op} fragment for '{edit['target']}' is malformed: {errors[0]}")
+
+    for element in reversed(elements):
+        if op == "replace_element":
+            html_code = html_code[:element.start] + fragment + html_code[element.end:]
+        elif op == "replace_inner":
+            html_code = html_code[:element.inner_start] + fragment + html_code[element.inner_end:]
+        elif op == "insert_before":
+            html_code = html_code[:element.start] + fragment + html_code[element.start:]
+        elif op == "insert_after":
+            html_code = html_code[:element.end] + fragment + html_code[element.end:]
+        elif op == "remove_element":
+            html_code = html_code[:element.start] + html_code[element.end:]
+        else:  # set_attribute
+            start_tag = _set_attribute(html_code[element.start:element.inner_start],
+                                       _require_text(edit, "name"), str(edit.get("value", "")))
+            html_code = html_code[:element.start] + start_tag + html_code[element.inner_start:]
+    return html_code
+
+
+def apply_patches(html_code: str, edits: List[Dict[str, Any]]) -> str:
+    """
+    Apply refinement edits in order and validate the result: no new tag errors and
+    no image placeholder tokens lost. Raises PatchError on the first problem.
+    """
+    tokens_before = set(PLACEHOLDER_TOKEN_PATTERN.findall(html_code))
+    errors_before = len(tag_errors(html_code))
+    patched = html_code
+    for number, edit in enumerate(edits, 1):
+        if not isinstance(edit, dict) or edit.get("op") not in CSS_OPS | ELEMENT_OPS:
+            raise PatchError(f"edit {number} has an unknown op: {edit.get('op') if isinstance(edit, dict) else edit!r}")
+        try:
+            patched = _apply_css(patched, edit) if edit["op"] in CSS_OPS else _apply_element(patched, edit)
+        except PatchError as e:
+            raise PatchError(f"edit {number} ({edit['op']}): {e}") from None
+
+    lost = tokens_before - set(PLACEHOLDER_TOKEN_PATTERN.findall(patched))
+    if lost:
+        raise PatchError(f"edits removed image placeholders: {', '.join(sorted(lost))}")
+    if len(tag_errors(patched)) > errors_before:
+        raise PatchError("edits introduced malformed HTML")
+    return patched
+
+
+def parse_patch_response(content: str) -> List[Dict[str, Any]]:
+    """The edits list of a model response ({"edits": [...]} or a bare list, optionally fenced)"""
+    try:
+        data, _ = loads_tolerant(content)
+    except JSONRepairError as e:
+        raise PatchError(f"edits are not valid JSON: {e}") from None
+    edits = data.get("edits") if isinstance(data, dict) else data
+    if not isinstance(edits, list):
+        raise PatchError("response has no 'edits' list")
+    return edits
@@ -0,0 +1,72 @@
+"""
+Prompt budget manager: measure each prompt and trim its sections to a per-node token budget
+
+A node renders its prompt from named sections. When the estimated token count
+exceeds the node's budget (config.PROMPT_TOKEN_BUDGETS), trimmable sections
+are shrunk in the order given until the prompt fits. Measured and sent token
+counts are recorded per node.
+"""
+import re
+from typing import Callable, Dict, Optional, Tuple
+from utils.events import emit
+from utils.instrumentation import estimate_tokens, metrics
+import config
+
+TRUNCATED_MARKER = "\n[... truncated to fit the prompt budget]"
+HTML_COMMENT_PATTERN = re.compile(r"<!--(?!\[if).*?-->", re.DOTALL)
+CSS_COMMENT_PATTERN = re.compile(r"/\*.*?\*/", re.DOTALL)
+PRESERVED_BLOCK_PATTERN = re.compile(r"(<(pre|textarea)\b.*?</\2>)", re.DOTALL | re.IGNORECASE)
+
+# A trimmer shrinks a section towards max_chars (it may not reach it)
+Trimmer = Callable[[str, int], str]
+
+
+def trim_text(text: str, max_chars: int) -> str:
+    """Cut text at a line boundary so it fits max_chars, marking the cut"""
+    if len(text) <= max_chars:
+        return text
+    keep = max(0, max_chars - len(TRUNCATED_MARKER))
+    cut = text.rfind("\n", 0, keep)
+    return text[:cut if cut > 0 else keep] + TRUNCATED_MARKER
+
+
+def compact_markup(text: str, max_chars: int = 0) -> str:
+    """Drop comments, indentation and blank lines from HTML/CSS (outside <pre>/<textarea>); never truncates"""
+    parts = PRESERVED_BLOCK_PATTERN.split(text)
+    compacted = []
+    # split() yields [text, block, tag name, text, block, tag name, ...]
+    for index in range(0, len(parts), 3):
+        chunk = CSS_COMMENT_PATTERN.sub("", HTML_COMMENT_PATTERN.sub("", parts[index]))
+        compacted.append("\n".join(line.strip() for line in chunk.splitlines() if line.strip()))
+        if index + 1 < len(parts):
+            compacted.append(parts[index + 1])
+    return "\n".join(part for part in compacted if part)
+
+
+def fit_prompt(node: str, render: Callable[[Dict[str, str]], str],
+               sections: Dict[str, Tuple[str, Optional[Trimmer]]], job_id: Optional[str] = None) -> str:
+    """
+    Render a prompt from sections, trimming trimmable sections (in order) until the
+    estimated token count fits the node's budget. Sections with no trimmer are kept as-is.
+    """
+    texts = {name: text for name, (text, _) in sections.items()}
+    prompt = render(texts)
+    measured = estimate_tokens(len(prompt))
+    budget = config.PROMPT_TOKEN_BUDGETS.get(node)
+
+    if budget and measured > budget:
+        for name, (text, trim) in sections.items():
+            excess = len(prompt) - budget * 4
+            if excess <= 0:
+                break
+            if trim is not None:
+                texts[name] = trim(text, max(0, len(text) - excess))
+                prompt = render(texts)
+
+    sent = estimate_tokens(len(prompt))
+    metrics.inc("prompt_tokens_measured_total", measured, help="Estimated prompt tokens before budget trimming", node=node)
+    metrics.inc("prompt_tokens_sent_total", sent, help="Estimated prompt tokens sent after budget trimming", node=node)
+    if sent < measured:
+        over = f", still {sent - budget} over" if sent > budget else ""
+        emit(job_id, f"Trimmed the {node} prompt from ~{measured} to ~{sent} tokens (budget {budget}{over})")
+    return prompt
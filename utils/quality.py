@@ -0,0 +1,130 @@
+"""
+Local quality check of a generated document, used to decide whether a refinement pass is worth an LLM call
+
+Scores four cheap signals between 0 and 1: HTML well-formedness, user image
+placeholders present, HTML classes covered by CSS rules, and palette colors
+used. The overall score is the mean of the checks that apply.
+"""
+import json
+import re
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from typing import Any, Dict, List
+from utils.export import STYLE_BLOCK_PATTERN
+from utils.html_utils import extract_css_classes, extract_html_classes
+
+HEX_COLOR_PATTERN = re.compile(r"#([0-9a-fA-F]{6}|[0-9a-fA-F]{3})\b")
+PLACEHOLDER_TOKEN_PATTERN = re.compile(r"\{\{(?:USER_IMAGE_\d+|IMAGE_PLACEHOLDER_SVG)\}\}")
+VOID_ELEMENTS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta",
+    "source", "track", "wbr",
+}
+# Elements whose end tag HTML allows to be omitted
+OPTIONAL_END_TAGS = {
+    "p", "li", "dt", "dd", "option", "optgroup", "tr", "td", "th", "thead", "tbody",
+    "tfoot", "colgroup", "rt", "rp", "html", "head", "body",
+}
+MAX_LISTED = 8  # names per issue line
+
+
+@dataclass
+class QualityReport:
+    """Per-check scores, their mean and the issues to hand to the refinement prompt"""
+    checks: Dict[str, float] = field(default_factory=dict)
+    issues: List[str] = field(default_factory=list)
+
+    @property
+    def score(self) -> float:
+        return sum(self.checks.values()) / len(self.checks) if self.checks else 1.0
+
+
+class _TagBalance(HTMLParser):
+    """Counts unclosed, stray and misnested tags"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack: List[str] = []
+        self.errors: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in VOID_ELEMENTS:
+            self.stack.append(tag)
+
+    def handle_endtag(self, tag):
+        if tag in VOID_ELEMENTS:
+            return
+        if tag not in self.stack:
+            self.errors.append(f"stray </{tag}>")
+            return
+        while self.stack:
+            open_tag = self.stack.pop()
+            if open_tag == tag:
+                break
+            if open_tag not in OPTIONAL_END_TAGS:
+                self.errors.append(f"<{open_tag}> closed by </{tag}>")
+
+    def close(self):
+        super().close()
+        self.errors.extend(f"unclosed <{tag}>" for tag in self.stack if tag not in OPTIONAL_END_TAGS)
+
+
+def tag_errors(html_code: str) -> List[str]:
+    """Unclosed, stray and misnested tags in a document or fragment"""
+    parser = _TagBalance()
+    parser.feed(html_code)
+    parser.close()
+    return parser.errors
+
+
+def _normalize_hex(value: str) -> str:
+    value = value.lower()
+    return "".join(c * 2 for c in value) if len(value) == 3 else value
+
+
+def _listed(names) -> str:
+    names = sorted(names)
+    more = f" (+{len(names) - MAX_LISTED} more)" if len(names) > MAX_LISTED else ""
+    return ", ".join(names[:MAX_LISTED]) + more
+
+
+def check_quality(html_code: str, images_detected: List[Dict[str, Any]] = None,
+                  color_palette: Dict[str, Any] = None) -> QualityReport:
+    """Score a combined document (placeholders not yet replaced) against the extracted design"""
+    report = QualityReport()
+
+    errors = tag_errors(html_code)
+    if "<body" not in html_code.lower():
+        errors.append("missing <body>")
+    report.checks["well_formed"] = max(0.0, 1.0 - len(errors) / 10)
+    if errors:
+        report.issues.append(f"Malformed HTML: {_listed(set(errors))}")
+
+    expected = {
+        img["url"] for img in images_detected or []
+        if PLACEHOLDER_TOKEN_PATTERN.fullmatch(str(img.get("url", "")))
+    }
+    if expected:
+        missing = {token for token in expected if token not in html_code}
+        report.checks["placeholders"] = 1.0 - len(missing) / len(expected)
+        if missing:
+            report.issues.append(f"Image placeholder tokens missing from the HTML: {_listed(missing)}")
+
+    html_classes = extract_html_classes(STYLE_BLOCK_PATTERN.sub("", html_code))
+    if html_classes:
+        css_classes = set()
+        for match in STYLE_BLOCK_PATTERN.finditer(html_code):
+            css_classes |= extract_css_classes(match.group(1))
+        unstyled = html_classes - css_classes
+        report.checks["css_coverage"] = 1.0 - len(unstyled) / len(html_classes)
+        if unstyled:
+            report.issues.append(f"HTML classes without CSS rules: {_listed(unstyled)}")
+
+    palette = {_normalize_hex(c) for c in HEX_COLOR_PATTERN.findall(json.dumps(color_palette or {}))}
+    if palette:
+        used = {_normalize_hex(c) for c in HEX_COLOR_PATTERN.findall(html_code)}
+        unused = palette - used
+        report.checks["palette"] = 1.0 - len(unused) / len(palette)
+        if unused:
+            report.issues.append(f"Palette colors not used: {_listed('#' + c for c in unused)}")
+
+    return report
@@ -0,0 +1,52 @@
+"""
+Token-bucket rate limiting shared by batch jobs and LLM calls
+"""
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, up to `capacity` at once"""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """Take tokens if available; return 0, or the seconds to wait before retrying"""
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1.0):
+        """Block until tokens are available"""
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: float = 1.0):
+        """Async variant of acquire"""
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+
+def per_minute(requests_per_minute: float, burst: float = 1.0) -> TokenBucket:
+    """Bucket allowing requests_per_minute on average with the given burst size"""
+    return TokenBucket(rate=requests_per_minute / 60.0, capacity=burst)
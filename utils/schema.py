@@ -0,0 +1,72 @@
+"""
+Minimal JSON-schema subset validator for LLM-produced structures
+
+Supports type, properties, required, items, maxItems, maxLength, enum and
+additionalProperties: false; enough to check the shapes our prompts ask
+for without pulling in a schema library.
+"""
+import re
+from typing import Any, Dict, List, Set
+
+FIELD_PATTERN = re.compile(r"^\$(?:\.([^.\[:]+))?[^:]*: (?:missing required field '([^']+)')?")
+
+JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+}
+
+
+def _type_matches(value: Any, expected) -> bool:
+    expected = expected if isinstance(expected, list) else [expected]
+    for name in expected:
+        if name == "null" and value is None:
+            return True
+        python_type = JSON_TYPES.get(name)
+        # bool is an int subclass, but not a JSON number
+        if python_type and isinstance(value, python_type) and not (isinstance(value, bool) and name != "boolean"):
+            return True
+    return False
+
+
+def validate(value: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """Return the schema violations of value as 'path: problem' strings (empty when valid)"""
+    errors = []
+    if "type" in schema and not _type_matches(value, schema["type"]):
+        return [f"{path}: expected {schema['type']}, got {type(value).__name__}"]
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: {value!r} is not one of {schema['enum']}")
+
+    if isinstance(value, dict):
+        for name in schema.get("required", []):
+            if name not in value:
+                errors.append(f"{path}: missing required field '{name}'")
+        properties = schema.get("properties", {})
+        for name, item in value.items():
+            if name in properties:
+                errors.extend(validate(item, properties[name], f"{path}.{name}"))
+            elif schema.get("additionalProperties") is False:
+                errors.append(f"{path}: unexpected field '{name}'")
+    elif isinstance(value, list):
+        if "maxItems" in schema and len(value) > schema["maxItems"]:
+            errors.append(f"{path}: more than {schema['maxItems']} items")
+        if "items" in schema:
+            for index, item in enumerate(value):
+                errors.extend(validate(item, schema["items"], f"{path}[{index}]"))
+    elif isinstance(value, str):
+        if "maxLength" in schema and len(value) > schema["maxLength"]:
+            errors.append(f"{path}: longer than {schema['maxLength']} characters")
+    return errors
+
+
+def invalid_fields(errors: List[str]) -> Set[str]:
+    """Top-level fields named by validate() errors ("" when the value itself is invalid)"""
+    fields = set()
+    for error in errors:
+        match = FIELD_PATTERN.match(error)
+        if match:
+            fields.add(match.group(1) or match.group(2) or "")
+    return fields
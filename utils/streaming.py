@@ -0,0 +1,102 @@
+"""
+Per-job token streams that carry partial LLM output from graph nodes to the UI
+"""
+import threading
+from typing import Dict, Optional
+
+# Channels whose tokens are shown in the code preview, in display order
+CODE_CHANNELS = ["html", "css"]
+
+
+class JobStream:
+    """
+    Thread-safe buffer of the partial output of one generation job.
+    Nodes write tokens per channel ("analysis", "html", "css", "refine", "refine_patch");
+    the service polls snapshots and forwards them to the UI. Patch edits are JSON,
+    so only a full refinement ("refine") replaces the code preview.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._buffers: Dict[str, list] = {}
+        self._progress: list = []
+        self.version = 0
+        self.closed = False
+
+    def start_channel(self, channel: str):
+        """Reset a channel before a node starts (re)generating it"""
+        with self._changed:
+            self._buffers[channel] = []
+            self.version += 1
+            self._changed.notify_all()
+
+    def write(self, channel: str, text: str):
+        """Append a token to a channel"""
+        if not text:
+            return
+        with self._changed:
+            self._buffers.setdefault(channel, []).append(text)
+            self.version += 1
+            self._changed.notify_all()
+
+    def append_progress(self, text: str):
+        """Append progress lines"""
+        with self._changed:
+            self._progress.append(text)
+            self.version += 1
+            self._changed.notify_all()
+
+    def close(self):
+        """Mark the job as finished and wake up waiting readers"""
+        with self._changed:
+            self.closed = True
+            self._changed.notify_all()
+
+    def wait(self, since_version: int, timeout: float) -> bool:
+        """Block until there is data newer than since_version or the stream closes"""
+        with self._changed:
+            return self._changed.wait_for(lambda: self.version != since_version or self.closed, timeout)
+
+    def snapshot(self):
+        """Return (version, progress_log, code_preview, analysis_preview)"""
+        with self._lock:
+            if "refine" in self._buffers:
+                code_preview = "".join(self._buffers["refine"])
+            else:
+                parts = []
+                for channel in CODE_CHANNELS:
+                    if channel in self._buffers:
+                        text = "".join(self._buffers[channel])
+                        parts.append(text if channel == "html" else f"/* CSS */\n{text}")
+                code_preview = "\n\n".join(parts)
+            analysis_preview = "".join(self._buffers.get("analysis", []))
+            return self.version, "".join(self._progress), code_preview, analysis_preview
+
+
+_streams: Dict[str, JobStream] = {}
+_streams_lock = threading.Lock()
+
+
+def open_stream(job_id: str) -> JobStream:
+    """Register a stream for a job"""
+    stream = JobStream()
+    with _streams_lock:
+        _streams[job_id] = stream
+    return stream
+
+
+def get_stream(job_id: Optional[str]) -> Optional[JobStream]:
+    """Return the stream for a job, or None if the job is not being streamed"""
+    if not job_id:
+        return None
+    with _streams_lock:
+        return _streams.get(job_id)
+
+
+def close_stream(job_id: str):
+    """Close and unregister a job's stream"""
+    with _streams_lock:
+        stream = _streams.pop(job_id, None)
+    if stream is not None:
+        stream.close()